@@ -768,6 +768,29 @@ def generate_estimate(file_data_list: list, status_card):
         """, unsafe_allow_html=True)
 
     try:
+        # 生成器はファイルごとではなく1回だけ作成（KB・インデックス・モデルは共有KBレジストリから取得）
+        ai_generator = AIEstimateGenerator(kb_path="kb/price_kb.json")
+
+        # AI生成の項目を届いた順に表示（応答全体を待たずに進捗がわかるように）
+        item_feed = st.empty()
+        generated_names = []
+
+        def show_item_feed():
+            recent = "、".join(name for name in generated_names[-5:] if name)
+            item_feed.caption(f"生成済み {len(generated_names)}項目: {recent}")
+
+        def show_generated_item(item):
+            generated_names.append(item.name)
+            show_item_feed()
+
+        def withdraw_generated_items(items):
+            # 応答を読み直して置き換わった項目（直前に表示した分）を取り消す
+            del generated_names[len(generated_names) - len(items):]
+            show_item_feed()
+
+        ai_generator.on_item_generated = show_generated_item
+        ai_generator.on_items_reset = withdraw_generated_items
+
         for file_idx, (file_name, file_bytes) in enumerate(file_data_list):
             # 一時ファイル作成
             with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_file:
@@ -776,10 +799,10 @@ def generate_estimate(file_data_list: list, status_card):
 
             # ステップ1: 仕様書解析
             show_status(1, 4, "仕様書を解析しています...", "processing")
-            ai_generator = AIEstimateGenerator(kb_path="kb/price_kb.json")
 
             # ステップ2: 見積生成
             show_status(2, 4, "見積項目を生成しています...", "processing")
+            generated_names.clear()
             fmt_doc = ai_generator.generate_estimate_unified(tmp_path, legal_standards=[])
             items = fmt_doc.estimates if hasattr(fmt_doc, 'estimates') else fmt_doc.estimate_items
 
@@ -853,6 +876,7 @@ def generate_estimate(file_data_list: list, status_card):
 
         total_amount = sum(item.amount or 0 for item in items if item.level == 0)
         show_status(4, 4, f"完了しました（推定総額: ¥{total_amount:,.0f}）", "success")
+        item_feed.empty()
 
         end_session()
         st.toast("見積書の生成が完了しました", icon="✅")
@@ -543,12 +543,9 @@ def main():
                             merge_strategy=merge_strategy
                         )
 
-                        # 保存
+                        # 保存（kb_builder.kb_items は共有KBレジストリ経由で最新になる）
                         kb_builder.save_kb_to_json(merged, kb_builder.kb_path)
 
-                        # セッション状態を更新
-                        kb_builder.kb_items = [ref.model_dump(mode='json') for ref in merged]
-
                         st.success(f"KBを保存しました: {len(merged)}項目")
                         st.info(f"保存先: {kb_builder.kb_path}")
 
@@ -661,7 +658,6 @@ def main():
                     col_yes, col_no = st.columns(2)
                     with col_yes:
                         if st.button("はい、クリアする", use_container_width=True, type="primary"):
-                            st.session_state.kb_builder.kb_items = []
                             st.session_state.kb_builder.save_kb_to_json([], st.session_state.kb_builder.kb_path)
                             st.session_state.confirm_clear_kb = False
                             st.success("KBをクリアしました")
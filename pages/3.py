@@ -54,10 +54,10 @@ class LegalKBBuilder:
 
     def __init__(self, kb_path: str = "kb/legal_kb.json"):
         from dotenv import load_dotenv
-        from anthropic import Anthropic
+        from pipelines.llm_gateway import get_llm_gateway
 
         load_dotenv()
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.client = get_llm_gateway()
         self.model_name = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
         self.kb_path = kb_path
         self.kb_items = []
@@ -70,7 +70,7 @@ class LegalKBBuilder:
 
     def extract_legal_from_pdf(self, pdf_path: str, source_name: str = None) -> list:
         """法令PDFから法令情報を抽出"""
-        import PyPDF2
+        from pipelines.pdf_cache import open_pdf
 
         logger.info(f"Extracting legal info from: {pdf_path}")
 
@@ -78,11 +78,7 @@ class LegalKBBuilder:
             source_name = Path(pdf_path).stem
 
         # PDFからテキストを抽出
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page_num in range(min(len(pdf_reader.pages), 30)):
-                text += pdf_reader.pages[page_num].extract_text() + "\n"
+        text = open_pdf(pdf_path).paged_text(1, 30)
 
         logger.info(f"Extracted {len(text)} characters from PDF")
 
@@ -180,17 +176,9 @@ JSON配列形式で出力してください：
                 model=self.model_name,
                 max_tokens=16000,
                 temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            # コスト記録
-            from pipelines.cost_tracker import record_cost
-            record_cost(
+                messages=[{"role": "user", "content": prompt}],
                 operation="法令KB抽出",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"file": source_name}
+                cost_metadata={"file": source_name}
             )
 
             response_text = response.content[0].text
@@ -13,6 +13,7 @@ import sys
 sys.path.insert(0, '.')
 
 from pipelines.cost_tracker import CostTracker, get_tracker
+from pipelines.llm_response_cache import get_response_cache
 
 
 # カスタムCSS（ページ固有）
@@ -76,6 +77,7 @@ def main():
         st.markdown('<p class="sidebar-section-header">トークン使用量</p>', unsafe_allow_html=True)
         st.text(f"入力: {summary['total_input_tokens']:,}")
         st.text(f"出力: {summary['total_output_tokens']:,}")
+        st.text(f"キャッシュ読込: {summary.get('total_cache_read_tokens', 0):,}")
         st.text(f"合計: {summary['total_tokens']:,}")
 
         st.markdown("---")
@@ -148,6 +150,53 @@ def main():
 
         st.divider()
 
+        # 応答キャッシュ（temperature=0 の呼び出し）
+        st.markdown("### 応答キャッシュ")
+
+        cache_stats = get_response_cache().stats()
+        saved_cost_jpy = sum(
+            tracker.calculate_cost(model, stats['saved_input_tokens'], stats['saved_output_tokens'])['total_cost_jpy']
+            for model, stats in cache_stats['by_model'].items()
+        )
+
+        col1, col2, col3, col4 = st.columns(4)
+
+        with col1:
+            st.metric(
+                "ヒット / ミス",
+                f"{cache_stats['hits']:,} / {cache_stats['misses']:,}",
+                help="キャッシュ済みの応答を使った回数 / APIを呼び出した回数（累計）"
+            )
+
+        with col2:
+            st.metric(
+                "ヒット率",
+                f"{cache_stats['hit_rate']:.1%}",
+                help="temperature=0 の呼び出しのうち、キャッシュを使った割合"
+            )
+
+        with col3:
+            st.metric(
+                "節約トークン",
+                f"{cache_stats['saved_input_tokens'] + cache_stats['saved_output_tokens']:,}",
+                help="キャッシュのヒットで呼び出さずに済んだ入力＋出力トークン数"
+            )
+
+        with col4:
+            st.metric(
+                "節約コスト（JPY）",
+                f"¥{saved_cost_jpy:.2f}",
+                help="キャッシュのヒットで節約したAPI利用料金（概算）"
+            )
+
+        st.caption(
+            f"{'有効' if cache_stats['enabled'] else '無効'} ・ {cache_stats['entries']:,}件 ・ "
+            f"{cache_stats['size_bytes'] / 1024 / 1024:.1f} / {cache_stats['max_bytes'] / 1024 / 1024:.0f} MB ・ "
+            f"削除 {cache_stats['evictions']:,}件"
+        )
+
+        st.divider()
+
         # 操作別集計
         st.markdown("### 操作別コスト")
 
@@ -211,7 +260,10 @@ def main():
                     "作業内容": session.get('session_name', '見積作成'),
                     "API呼出回数": session.get('metadata', {}).get('api_calls', 0),
                     "トークン数": f"{session['total_tokens']:,}",
-                    "料金": f"¥{session['cost_jpy']:.2f}"
+                    "キャッシュ読込": f"{session.get('metadata', {}).get('cache_read_tokens', 0):,}",
+                    "API時間": f"{session.get('metadata', {}).get('latency_seconds', 0):.0f}秒",
+                    "料金": f"¥{session['cost_jpy']:.2f}",
+                    "キャッシュ節約": f"¥{session.get('cache_savings_jpy', 0):.2f}"
                 })
 
             st.dataframe(session_data, use_container_width=True, hide_index=True)
@@ -235,10 +287,13 @@ def main():
                         st.markdown(f"**作業内容**: {session_name}")
                         st.markdown(f"**API呼出回数**: {api_calls}回")
                         st.markdown(f"**総トークン数**: {session['total_tokens']:,}")
+                        st.markdown(f"**プロンプトキャッシュ読込**: {session.get('metadata', {}).get('cache_read_tokens', 0):,}トークン")
 
                     with col2:
                         st.markdown(f"**コスト（USD）**: ${session['cost_usd']:.4f}")
                         st.markdown(f"**コスト（JPY）**: ¥{session['cost_jpy']:.2f}")
+                        st.markdown(f"**キャッシュによる節約**: ¥{session.get('cache_savings_jpy', 0):.2f}")
+                        st.markdown(f"**API呼出時間（合計）**: {session.get('metadata', {}).get('latency_seconds', 0):.1f}秒")
 
                     # 操作別内訳
                     operations = session.get('metadata', {}).get('operations', [])
@@ -373,6 +428,29 @@ def main():
 
         st.markdown("---")
 
+        st.markdown("#### 応答キャッシュ")
+        response_cache = get_response_cache()
+        st.text(f"保存先: {response_cache.path}")
+
+        col1, col2 = st.columns(2)
+
+        with col1:
+            cache_enabled = st.toggle(
+                "応答キャッシュを使う",
+                value=response_cache.enabled,
+                help="temperature=0 の呼び出しで、同じリクエストの応答を再利用します（環境変数 LLM_RESPONSE_CACHE=0 で既定を無効化）"
+            )
+            if cache_enabled != response_cache.enabled:
+                response_cache.set_enabled(cache_enabled)
+
+        with col2:
+            if st.button("キャッシュをクリア", type="secondary"):
+                response_cache.clear()
+                st.success("応答キャッシュをクリアしました")
+                st.rerun()
+
+        st.markdown("---")
+
         st.markdown("#### 料金体系")
         st.markdown("""
         **Claude API 料金（2024年時点）**
@@ -384,6 +462,8 @@ def main():
         | Claude 3 Opus | $15.00/1Mトークン | $75.00/1Mトークン |
         | Claude 3 Haiku | $0.25/1Mトークン | $1.25/1Mトークン |
 
+        プロンプトキャッシュ: 書き込みは入力料金の1.25倍、読み込みは入力料金の0.1倍
+
         **参考: 1回あたりの目安コスト**
 
         | 操作 | トークン目安 | コスト目安 |
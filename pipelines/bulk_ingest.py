@@ -0,0 +1,530 @@
+"""
+過去案件フォルダの一括取り込み（data/ などのディレクトリツリー・画面操作なし）
+
+ディレクトリツリー（zipアーカイブの中も含む）を走査し、ファイルの種類ごとに抽出処理を
+ワーカープロセスで並列に実行して、価格KBの行と文書テキストをバッチ単位でファイルに書き出します。
+
+- 見積書フォルダ（パスに「見積」を含む）の .xls / .xlsx（見積明細）は PriceKBBuilder.extract_estimate_from_excel で価格KBの行に変換
+- 見積書フォルダ（パスに「見積」を含む）のPDF・画像は、use_llm=True の場合のみ
+  PriceKBBuilder.extract_estimate_from_pdf（テキスト / OCR、API料金が発生）で価格KBの行に変換
+- それ以外のPDF・Excel・.docx・.doc・.msg・.txt は DocumentIngestor でテキストを抽出して文書として出力
+- 見積書フォルダ以外の画像（現場写真）、.jww・.V2M などの図面・専用形式は対象外として記録
+
+出力ディレクトリの構成:
+    rows/rows-00001.jsonl        価格KBの行（PriceReference.model_dump の形式、1ファイル batch_size 行まで）
+    documents/docs-00001.jsonl   文書テキスト（1ファイル batch_size 件まで）
+    checkpoint.jsonl             処理済みファイルの記録（ソースID・シグネチャ・状態）
+
+チェックポイントには、そのファイルの行・文書をバッチファイルに書き出した後に追記します。
+中断後に再実行すると、シグネチャ（サイズ・更新日時、zip内はCRC）が変わっていない処理済みファイルは
+スキップし、エラーになったファイルは再試行します。
+"""
+
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import zipfile
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from loguru import logger
+
+# 既定の出力ディレクトリ・バッチサイズ・ワーカープロセス数（環境変数で変更可能）
+DEFAULT_OUTPUT_DIR = os.getenv("BULK_INGEST_OUTPUT_DIR", "kb/bulk_ingest")
+DEFAULT_BATCH_SIZE = int(os.getenv("BULK_INGEST_BATCH_SIZE", "5000"))
+DEFAULT_WORKERS = int(os.getenv("BULK_INGEST_WORKERS", str(max(1, (os.cpu_count() or 1) - 1))))
+
+# 取り込み方法
+ROUTE_EXCEL = "excel"        # 見積明細Excel → 価格KBの行
+ROUTE_ESTIMATE = "estimate"  # 見積書PDF・画像 → 価格KBの行（LLM）
+ROUTE_DOCUMENT = "document"  # 仕様書・質疑書・メールなど → 文書テキスト
+ROUTE_SKIP = "skip"          # 対象外
+
+# 処理結果の状態
+STATUS_OK = "ok"
+STATUS_SKIPPED = "skipped"
+STATUS_ERROR = "error"
+
+EXCEL_SUFFIXES = {".xls", ".xlsx"}
+IMAGE_SUFFIXES = {".jpg", ".jpeg", ".png"}
+DOCUMENT_SUFFIXES = {".pdf", ".xls", ".xlsx", ".docx", ".doc", ".msg", ".txt"}
+ARCHIVE_SUFFIXES = {".zip"}
+
+# 見積書フォルダとみなすパスのキーワード
+ESTIMATE_PATH_KEYWORDS = ("見積",)
+
+# ワーカープロセスのログレベル（ファイルごとのINFOログを抑える）
+WORKER_LOG_LEVEL = os.getenv("BULK_INGEST_WORKER_LOG_LEVEL", "WARNING")
+
+# 1ワーカーあたりの投入済みタスク数の上限（大量のファイルでもメモリを使いすぎないよう）
+MAX_PENDING_PER_WORKER = 4
+
+
+class SourceFile(NamedTuple):
+    """取り込み対象の1ファイル（zip内のファイルを含む）"""
+    source_id: str              # ルートからの相対パス（zip内は "a.zip!dir/b.pdf"）
+    path: str                   # 実ファイルのパス（zip内の場合は最も外側のzip）
+    members: Tuple[str, ...]    # zip内のメンバー名（外側から順、zip内でなければ空）
+    project: str                # 案件名（ルート直下のフォルダ名）
+    signature: str              # 変更検出用（サイズ・更新日時、zip内はCRC・サイズ）
+
+    @property
+    def name(self) -> str:
+        """ファイル名"""
+        return Path(self.source_id.rsplit("!", 1)[-1]).name
+
+    @property
+    def suffix(self) -> str:
+        """拡張子（小文字）"""
+        return Path(self.name).suffix.lower()
+
+
+def zip_member_name(info: zipfile.ZipInfo) -> str:
+    """
+    zipメンバーのファイル名（UTF-8フラグのない日本語名はShift_JISとして読み直す）
+
+    zipfile はUTF-8フラグのない名前をCP437として読むため、Windowsで作られたzipの名前が文字化けします。
+    """
+    if info.flag_bits & 0x800:
+        return info.filename
+    try:
+        return info.filename.encode("cp437").decode("cp932")
+    except (UnicodeEncodeError, UnicodeDecodeError):
+        return info.filename
+
+
+def _iter_zip(archive: zipfile.ZipFile, path: str, source_prefix: str, members: Tuple[str, ...],
+              project: str) -> Iterator[SourceFile]:
+    """zipアーカイブ内のファイルを列挙（zip内のzipも展開）"""
+    for info in archive.infolist():
+        if info.is_dir():
+            continue
+        name = zip_member_name(info)
+        source_id = f"{source_prefix}!{name}"
+        if Path(name).suffix.lower() in ARCHIVE_SUFFIXES:
+            try:
+                with zipfile.ZipFile(io.BytesIO(archive.read(info))) as inner:
+                    yield from _iter_zip(inner, path, source_id, members + (info.filename,), project)
+            except zipfile.BadZipFile as e:
+                logger.warning(f"Skipping broken archive {source_id}: {e}")
+            continue
+        yield SourceFile(source_id, path, members + (info.filename,), project,
+                         f"crc={info.CRC:08x}:{info.file_size}")
+
+
+def discover_sources(root: str) -> Iterator[SourceFile]:
+    """
+    ディレクトリツリーの取り込み対象ファイルを列挙（zipアーカイブは中のファイルを列挙）
+
+    Args:
+        root: 走査するディレクトリ
+
+    Yields:
+        SourceFile（パス順）
+    """
+    root_path = Path(root)
+    for path in sorted(p for p in root_path.rglob("*") if p.is_file()):
+        relative = path.relative_to(root_path)
+        project = relative.parts[0] if len(relative.parts) > 1 else path.stem
+        source_id = relative.as_posix()
+
+        if path.suffix.lower() in ARCHIVE_SUFFIXES:
+            try:
+                with zipfile.ZipFile(path) as archive:
+                    yield from _iter_zip(archive, str(path), source_id, (), project)
+            except zipfile.BadZipFile as e:
+                logger.warning(f"Skipping broken archive {source_id}: {e}")
+            continue
+
+        stat = path.stat()
+        yield SourceFile(source_id, str(path), (), project, f"{stat.st_size}:{stat.st_mtime_ns}")
+
+
+def read_source_bytes(source: SourceFile) -> bytes:
+    """ファイルの内容を読み込み（zip内のファイルはメモリ上で展開）"""
+    if not source.members:
+        return Path(source.path).read_bytes()
+    with zipfile.ZipFile(source.path) as archive:
+        data = archive.read(source.members[0])
+    for member in source.members[1:]:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            data = archive.read(member)
+    return data
+
+
+def is_estimate_path(source: SourceFile) -> bool:
+    """見積書フォルダ内のファイルか"""
+    return any(keyword in source.source_id for keyword in ESTIMATE_PATH_KEYWORDS)
+
+
+def route_source(source: SourceFile, use_llm: bool = False) -> str:
+    """
+    ファイルの取り込み方法を決める
+
+    Args:
+        source: 取り込み対象
+        use_llm: 見積書PDF・画像をLLMで価格KB化するか
+
+    Returns:
+        ROUTE_EXCEL / ROUTE_ESTIMATE / ROUTE_DOCUMENT / ROUTE_SKIP
+    """
+    suffix = source.suffix
+    if is_estimate_path(source):
+        if suffix in EXCEL_SUFFIXES:
+            return ROUTE_EXCEL
+        if use_llm and (suffix == ".pdf" or suffix in IMAGE_SUFFIXES):
+            return ROUTE_ESTIMATE
+    if suffix in DOCUMENT_SUFFIXES:
+        return ROUTE_DOCUMENT
+    return ROUTE_SKIP
+
+
+def price_project_name(source: SourceFile) -> str:
+    """価格KBの出典案件名（item_id の接頭辞にもなるため、案件名とファイル名から一意に作る）"""
+    return f"{source.project}_{Path(source.name).stem}"
+
+
+# ワーカープロセス内で使い回す抽出器
+_worker_builder = None
+_worker_ingestor = None
+
+
+def _init_worker(log_level: str):
+    """ワーカープロセスの初期化（ログレベルの設定）"""
+    logger.remove()
+    logger.add(sys.stderr, level=log_level)
+
+
+def _get_builder(kb_path: str):
+    """ワーカープロセス内の PriceKBBuilder"""
+    global _worker_builder
+    if _worker_builder is None or _worker_builder.kb_path != kb_path:
+        from pipelines.kb_builder import PriceKBBuilder
+        _worker_builder = PriceKBBuilder(kb_path)
+    return _worker_builder
+
+
+def _get_ingestor():
+    """ワーカープロセス内の DocumentIngestor"""
+    global _worker_ingestor
+    if _worker_ingestor is None:
+        from pipelines.ingest import DocumentIngestor
+        _worker_ingestor = DocumentIngestor()
+    return _worker_ingestor
+
+
+def _image_to_pdf(data: bytes, suffix: str) -> bytes:
+    """画像を1ページのPDFに変換（スキャンPDFと同じOCR経路で抽出するため）"""
+    import fitz  # PyMuPDF
+
+    with fitz.open(stream=data, filetype=suffix.lstrip(".")) as image:
+        return image.convert_to_pdf()
+
+
+def _extract(source: SourceFile, route: str, file_path: str, kb_path: str) -> Dict[str, Any]:
+    """取り込み方法に応じて抽出（rows: 価格KBの行、document: 文書）"""
+    if route == ROUTE_EXCEL:
+        if source.suffix == ".xls" and importlib.util.find_spec("xlrd") is None:
+            # extract_estimate_from_excel はエラー時に空リストを返すため、再試行できるようここでエラーにする
+            raise ImportError("xlrd is required to read .xls files")
+        refs = _get_builder(kb_path).extract_estimate_from_excel(file_path, price_project_name(source))
+        return {"rows": [ref.model_dump(mode="json") for ref in refs], "document": None}
+
+    if route == ROUTE_ESTIMATE:
+        refs = _get_builder(kb_path).extract_estimate_from_pdf(file_path, price_project_name(source))
+        if not refs:
+            # extract_estimate_from_pdf はAPIエラー（レート制限など）でも空リストを返すため、
+            # 処理済みにせず再実行時に再試行できるようここでエラーにする
+            raise RuntimeError("No price items extracted (LLM extraction failed or no priced items)")
+        return {"rows": [ref.model_dump(mode="json") for ref in refs], "document": None}
+
+    ingested = _get_ingestor().ingest(file_path)
+    document = {
+        "source_id": source.source_id,
+        "project": source.project,
+        "file_type": source.suffix.lstrip("."),
+        "text": ingested.get("text", ""),
+        "metadata": ingested.get("metadata", {}),
+    }
+    return {"rows": [], "document": document}
+
+
+def process_source(source: SourceFile, use_llm: bool = False,
+                   kb_path: str = "kb/price_kb.json") -> Dict[str, Any]:
+    """
+    1ファイルを取り込み（プロセスプールのワーカーで実行されるため、例外は結果に含めて返す）
+
+    Args:
+        source: 取り込み対象
+        use_llm: 見積書PDF・画像をLLMで価格KB化するか
+        kb_path: 価格KBのパス（PriceKBBuilder の初期化用）
+
+    Returns:
+        {"source_id", "signature", "route", "status", "rows", "document", "error"}
+    """
+    route = route_source(source, use_llm)
+    result = {
+        "source_id": source.source_id,
+        "signature": source.signature,
+        "route": route,
+        "status": STATUS_SKIPPED,
+        "rows": [],
+        "document": None,
+        "error": None,
+    }
+    if route == ROUTE_SKIP:
+        return result
+
+    temp_path = None
+    try:
+        if source.members or (route == ROUTE_ESTIMATE and source.suffix in IMAGE_SUFFIXES):
+            # zip内のファイル・画像は拡張子付きの一時ファイルにしてから既存の抽出器に渡す
+            data = read_source_bytes(source)
+            suffix = source.suffix
+            if route == ROUTE_ESTIMATE and suffix in IMAGE_SUFFIXES:
+                data, suffix = _image_to_pdf(data, suffix), ".pdf"
+            with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+                f.write(data)
+                temp_path = f.name
+
+        result.update(_extract(source, route, temp_path or source.path, kb_path))
+        result["status"] = STATUS_OK
+    except Exception as e:
+        result["status"] = STATUS_ERROR
+        result["error"] = f"{type(e).__name__}: {e}"
+    finally:
+        if temp_path:
+            os.unlink(temp_path)
+    return result
+
+
+def _write_jsonl(path: Path, records: List[Dict[str, Any]]):
+    """JSONLファイルを書き出し（一時ファイルに書いてから置き換え）"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    os.replace(temp_path, path)
+
+
+def _next_shard_index(directory: Path, prefix: str) -> int:
+    """既存のバッチファイルの次の番号"""
+    indexes = [int(p.stem.rsplit("-", 1)[-1]) for p in directory.glob(f"{prefix}-*.jsonl")]
+    return max(indexes, default=0) + 1
+
+
+class BulkIngestor:
+    """
+    ディレクトリツリーの一括取り込み
+
+    使用例:
+        ingestor = BulkIngestor("data", workers=4)
+        summary = ingestor.run()
+        merge_rows_into_kb(ingestor.output_dir)
+    """
+
+    def __init__(self, root: str, output_dir: str = DEFAULT_OUTPUT_DIR,
+                 workers: Optional[int] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                 use_llm: bool = False, kb_path: str = "kb/price_kb.json"):
+        """
+        Args:
+            root: 走査するディレクトリ
+            output_dir: 出力ディレクトリ
+            workers: ワーカープロセス数（Noneで DEFAULT_WORKERS、1以下で現在のプロセスのみ）
+            batch_size: バッチファイル1つあたりの行数・文書数
+            use_llm: 見積書PDF・画像をLLMで価格KB化するか（API料金が発生）
+            kb_path: 価格KBのパス
+        """
+        self.root = root
+        self.output_dir = Path(output_dir)
+        self.workers = DEFAULT_WORKERS if workers is None else workers
+        self.batch_size = max(1, batch_size)
+        self.use_llm = use_llm
+        self.kb_path = kb_path
+        self.checkpoint_path = self.output_dir / "checkpoint.jsonl"
+        self.rows_dir = self.output_dir / "rows"
+        self.documents_dir = self.output_dir / "documents"
+
+        self._rows: List[Dict[str, Any]] = []
+        self._documents: List[Dict[str, Any]] = []
+        self._completed: List[Dict[str, Any]] = []
+
+    def load_checkpoint(self) -> Dict[str, Dict[str, Any]]:
+        """チェックポイントを読み込み（ソースIDごとの最後の記録）"""
+        entries: Dict[str, Dict[str, Any]] = {}
+        if not self.checkpoint_path.exists():
+            return entries
+        with open(self.checkpoint_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # 書き込み途中で中断した最終行
+                    continue
+                entries[entry["source_id"]] = entry
+        return entries
+
+    def pending_sources(self) -> Tuple[List[SourceFile], int]:
+        """
+        未処理のファイルを列挙
+
+        Returns:
+            (未処理のSourceFileのリスト, 処理済みでスキップした件数)
+        """
+        checkpoint = self.load_checkpoint()
+        pending = []
+        done = 0
+        for source in discover_sources(self.root):
+            entry = checkpoint.get(source.source_id)
+            if (entry and entry["signature"] == source.signature
+                    and entry["status"] != STATUS_ERROR and entry["route"] == route_source(source, self.use_llm)):
+                done += 1
+                continue
+            pending.append(source)
+        return pending, done
+
+    def run(self, limit: Optional[int] = None) -> Dict[str, Any]:
+        """
+        一括取り込みを実行
+
+        Args:
+            limit: 処理するファイル数の上限（Noneで全件）
+
+        Returns:
+            集計（状態別・取り込み方法別の件数、出力した行数・文書数）
+        """
+        pending, done = self.pending_sources()
+        if limit is not None:
+            pending = pending[:limit]
+        logger.info(f"Bulk ingest: {len(pending)} files to process, {done} already done (root={self.root})")
+
+        summary: Dict[str, Any] = {"already_done": done, "status": Counter(), "route": Counter(),
+                                   "rows": 0, "documents": 0, "errors": []}
+        try:
+            for result in self._results(pending):
+                summary["status"][result["status"]] += 1
+                summary["route"][result["route"]] += 1
+                summary["rows"] += len(result["rows"])
+                summary["documents"] += 1 if result["document"] else 0
+                if result["status"] == STATUS_ERROR:
+                    summary["errors"].append((result["source_id"], result["error"]))
+                    logger.warning(f"Failed to ingest {result['source_id']}: {result['error']}")
+                self._add(result)
+        finally:
+            # 中断時も処理済みの分は書き出してチェックポイントに残す
+            self.flush()
+
+        logger.info(f"Bulk ingest finished: {dict(summary['status'])}, "
+                    f"{summary['rows']} rows, {summary['documents']} documents")
+        return summary
+
+    def _results(self, sources: List[SourceFile]) -> Iterator[Dict[str, Any]]:
+        """ファイルを並列に処理して、完了した順に結果を返す"""
+        if self.workers <= 1 or len(sources) < 2:
+            for source in sources:
+                yield process_source(source, self.use_llm, self.kb_path)
+            return
+
+        # スレッドを使うアプリから呼ばれてもforkしないようspawnで起動
+        with ProcessPoolExecutor(max_workers=self.workers,
+                                 mp_context=multiprocessing.get_context("spawn"),
+                                 initializer=_init_worker, initargs=(WORKER_LOG_LEVEL,)) as pool:
+            queue = iter(sources)
+            futures = set()
+            while True:
+                for source in queue:
+                    futures.add(pool.submit(process_source, source, self.use_llm, self.kb_path))
+                    if len(futures) >= self.workers * MAX_PENDING_PER_WORKER:
+                        break
+                if not futures:
+                    break
+                finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    yield future.result()
+
+    def _add(self, result: Dict[str, Any]):
+        """結果をバッファに追加し、バッチサイズに達したら書き出す"""
+        self._rows.extend(result["rows"])
+        if result["document"]:
+            self._documents.append(result["document"])
+        self._completed.append({
+            "source_id": result["source_id"],
+            "signature": result["signature"],
+            "route": result["route"],
+            "status": result["status"],
+            "rows": len(result["rows"]),
+            "error": result["error"],
+            "finished_at": datetime.now().isoformat(timespec="seconds"),
+        })
+        if len(self._rows) >= self.batch_size or len(self._documents) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """バッファの行・文書をバッチファイルに書き出してから、チェックポイントに追記"""
+        for directory, prefix, records in ((self.rows_dir, "rows", self._rows),
+                                           (self.documents_dir, "docs", self._documents)):
+            for start in range(0, len(records), self.batch_size):
+                shard = directory / f"{prefix}-{_next_shard_index(directory, prefix):05d}.jsonl"
+                _write_jsonl(shard, records[start:start + self.batch_size])
+                logger.info(f"Wrote {min(self.batch_size, len(records) - start)} records to {shard}")
+
+        if self._completed:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+                for entry in self._completed:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+        self._rows = []
+        self._documents = []
+        self._completed = []
+
+
+def iter_rows(output_dir: str = DEFAULT_OUTPUT_DIR) -> Iterator[Dict[str, Any]]:
+    """出力した価格KBの行を読み込み（同じ item_id は後のバッチの行を優先）"""
+    rows: Dict[str, Dict[str, Any]] = {}
+    for shard in sorted((Path(output_dir) / "rows").glob("rows-*.jsonl")):
+        with open(shard, encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                rows[row["item_id"]] = row
+    yield from rows.values()
+
+
+def merge_rows_into_kb(output_dir: str = DEFAULT_OUTPUT_DIR, kb_path: str = "kb/price_kb.json",
+                       merge_strategy: str = "keep_new") -> int:
+    """
+    出力した価格KBの行を既存KBにマージして保存
+
+    中断・再実行で同じファイルの行が重複して出力されても、item_id（案件名_ファイル名_連番）で1件にまとめます。
+
+    Args:
+        output_dir: BulkIngestor の出力ディレクトリ
+        kb_path: 価格KBのパス
+        merge_strategy: PriceKBBuilder.merge_with_existing_kb のマージ戦略
+
+    Returns:
+        マージ後の項目数（マージする行がなければ0）
+    """
+    from pipelines.kb_builder import PriceKBBuilder
+    from pipelines.schemas import PriceReference
+
+    refs = [PriceReference(**row) for row in iter_rows(output_dir)]
+    if not refs:
+        logger.info(f"No rows to merge in {output_dir}")
+        return 0
+
+    builder = PriceKBBuilder(kb_path)
+    merged = builder.merge_with_existing_kb(refs, merge_strategy=merge_strategy)
+    builder.save_kb_to_json(merged, kb_path)
+    return len(merged)
+
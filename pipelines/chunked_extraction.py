@@ -0,0 +1,304 @@
+"""
+見積書テキストのチャンク分割抽出
+
+見積書PDFのテキストを1回のLLM呼び出しで送ると、長い見積書では文字数の上限（text[:60000]）で
+後半が切り捨てられ、出力もmax_tokensで途中で切れたJSONになります。
+
+ここでは
+- テキストをページ単位でまとめたチャンク（1チャンク CHUNK_MAX_CHARS 文字まで）に分割し、
+  前のチャンクの末尾 CHUNK_OVERLAP_LINES 行を重ねて含め（ページ境界をまたぐ行・「同上」の参照元のため）、
+- チャンクごとのLLM呼び出しを並列に実行し（レート制限のリトライ・コスト記録は LLMゲートウェイ）、
+- チャンクの結果をページ順に結合する際に、重ねた行から重複して抽出された項目を取り除き、
+  チャンクの先頭に残った「同上」「〃」を前のチャンクの項目名・仕様で置き換えます。
+
+抽出時間・コストは文書の長さにほぼ比例し、1回の出力が max_tokens を超えにくくなります。
+"""
+
+import json
+import os
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from loguru import logger
+
+from pipelines.page_pipeline import DEFAULT_PAGE_CONCURRENCY, run_page_pipeline
+from pipelines.paged_text import PagedText
+
+# チャンクの最大文字数・重ねる行数・同時実行数（環境変数で変更可能）
+# 出力（項目のJSON）が max_tokens に収まるよう、見積書テキストで約8000文字までとする
+CHUNK_MAX_CHARS = int(os.getenv("ESTIMATE_CHUNK_MAX_CHARS", "8000"))
+CHUNK_OVERLAP_LINES = int(os.getenv("ESTIMATE_CHUNK_OVERLAP_LINES", "3"))
+CHUNK_CONCURRENCY = int(os.getenv("ESTIMATE_CHUNK_CONCURRENCY", str(DEFAULT_PAGE_CONCURRENCY)))
+
+# 省略表記（直前の項目と同じ）
+DITTO_MARKS = ("同上", "仝上", "〃", "同左", "上記と同じ")
+
+# 重複とみなす項目のフィールド
+DEDUP_FIELDS = ("name", "specification", "quantity", "unit", "unit_price", "amount")
+
+
+class TextChunk(NamedTuple):
+    """LLMに1回で送るテキストの範囲"""
+    index: int
+    first_page: Optional[int]  # 含まれる最初のページ番号（ページ情報がない場合はNone）
+    last_page: Optional[int]
+    text: str                  # 前のチャンクの末尾（重なり）を含むテキスト
+
+
+def _split_long_text(text: str, max_chars: int) -> List[str]:
+    """1ページが max_chars を超える場合に行単位で分割"""
+    parts: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in text.splitlines(keepends=True):
+        if current and size + len(line) > max_chars:
+            parts.append("".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def chunk_text(text: str, max_chars: Optional[int] = None,
+               overlap_lines: Optional[int] = None) -> List[TextChunk]:
+    """
+    テキストをページ単位のチャンクに分割
+
+    ページ（PagedText のページ。ページ情報がなければ全体を1ページ）を順にまとめ、
+    max_chars を超える前に次のチャンクに移ります。1ページで max_chars を超える場合は行単位で分割します。
+    2つ目以降のチャンクの先頭には、前のチャンクの最後の overlap_lines 行を重ねて含めます。
+
+    Args:
+        text: 見積書テキスト（PagedText またはページ情報のない文字列）
+        max_chars: チャンクの最大文字数（Noneで CHUNK_MAX_CHARS。重ねる行は含めない）
+        overlap_lines: 重ねる行数（Noneで CHUNK_OVERLAP_LINES）
+
+    Returns:
+        TextChunk のリスト（テキストが空なら空リスト）
+    """
+    max_chars = max(1, max_chars or CHUNK_MAX_CHARS)
+    overlap_lines = CHUNK_OVERLAP_LINES if overlap_lines is None else overlap_lines
+
+    if isinstance(text, PagedText) and text.page_numbers:
+        pages: List[Tuple[Optional[int], str]] = list(text.pages())
+    else:
+        pages = [(None, str(text))]
+
+    # (ページ番号, テキスト) を max_chars 以下の単位にする
+    units: List[Tuple[Optional[int], str]] = []
+    for page_num, page_text in pages:
+        if not page_text.endswith("\n"):
+            page_text += "\n"
+        units.extend((page_num, part) for part in _split_long_text(page_text, max_chars))
+
+    groups: List[List[Tuple[Optional[int], str]]] = []
+    size = 0
+    for unit in units:
+        if groups and size + len(unit[1]) <= max_chars:
+            groups[-1].append(unit)
+            size += len(unit[1])
+        else:
+            groups.append([unit])
+            size = len(unit[1])
+
+    chunks: List[TextChunk] = []
+    previous_tail = ""
+    for index, group in enumerate(groups):
+        body = "".join(part for _, part in group)
+        if not body.strip():
+            continue
+        page_nums = [page_num for page_num, _ in group if page_num is not None]
+        chunks.append(TextChunk(
+            index=len(chunks),
+            first_page=page_nums[0] if page_nums else None,
+            last_page=page_nums[-1] if page_nums else None,
+            text=previous_tail + body,
+        ))
+        lines = body.splitlines(keepends=True)
+        previous_tail = "".join(lines[-overlap_lines:]) if overlap_lines > 0 else ""
+    return chunks
+
+
+def parse_item_array(response_text: str) -> List[Dict[str, Any]]:
+    """
+    LLMの応答からJSON配列を取り出す
+
+    出力が途中で切れて配列が閉じていない場合は、最後に完結しているオブジェクトまでを読み取ります。
+
+    Returns:
+        項目（dict）のリスト（JSONがなければ空リスト）
+    """
+    start = response_text.find('[')
+    if start == -1:
+        return []
+    end = response_text.rfind(']') + 1
+    if end > start:
+        try:
+            items = json.loads(response_text[start:end])
+            return [item for item in items if isinstance(item, dict)]
+        except json.JSONDecodeError:
+            pass
+
+    # 途中で切れた配列: 最後の "}" までで閉じて読み直す
+    cut = response_text.rfind('}')
+    while cut > start:
+        try:
+            items = json.loads(response_text[start:cut + 1] + ']')
+            logger.warning(f"Recovered {len(items)} items from truncated JSON array")
+            return [item for item in items if isinstance(item, dict)]
+        except json.JSONDecodeError:
+            cut = response_text.rfind('}', start, cut)
+    logger.error("Failed to parse JSON array from response")
+    return []
+
+
+def _ditto_rest(value: Any) -> Optional[str]:
+    """省略表記なら残りの文字列（「同上施工費」→「施工費」）、省略表記でなければNone"""
+    if not isinstance(value, str):
+        return None
+    stripped = value.strip()
+    for mark in DITTO_MARKS:
+        if stripped.startswith(mark):
+            return stripped[len(mark):].strip()
+    return None
+
+
+def resolve_ditto(items: Iterable[Dict[str, Any]], previous: Optional[Dict[str, Any]] = None,
+                  fields: Sequence[str] = ("name", "specification")) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    「同上」「〃」を直前の項目の値で置き換え
+
+    Args:
+        items: 項目のリスト（順序どおり）
+        previous: 直前の項目（前のチャンクの最後の項目など）
+        fields: 置き換えるフィールド
+
+    Returns:
+        (置き換え後の項目のリスト, 最後の項目)
+    """
+    resolved = []
+    for item in items:
+        item = dict(item)
+        for field in fields:
+            rest = _ditto_rest(item.get(field))
+            if rest is not None and previous and previous.get(field) is not None:
+                item[field] = (previous[field] or "") + rest
+        resolved.append(item)
+        previous = item
+    return resolved, previous
+
+
+def _dedup_key(item: Dict[str, Any]) -> tuple:
+    """重複判定のキー"""
+    return tuple(str(item.get(field) or "").strip() for field in DEDUP_FIELDS)
+
+
+def merge_chunk_items(chunk_items: Sequence[List[Dict[str, Any]]],
+                      overlap_window: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    チャンクごとの抽出結果をページ順に結合
+
+    - チャンクの先頭の項目が前のチャンクの最後の overlap_window 件と同じ場合は
+      重ねた行から重複して抽出されたものとして除きます（同じ項目の繰り返しを消さないよう境界の近くだけ）
+    - チャンクの先頭に残った「同上」「〃」を前のチャンクの項目の値で置き換えます
+
+    Args:
+        chunk_items: チャンク順の項目のリスト
+        overlap_window: 重複を確認する前のチャンクの末尾の件数（Noneで CHUNK_OVERLAP_LINES の2倍）
+
+    Returns:
+        結合した項目のリスト
+    """
+    overlap_window = max(1, overlap_window or CHUNK_OVERLAP_LINES * 2)
+    merged: List[Dict[str, Any]] = []
+    previous: Optional[Dict[str, Any]] = None
+    previous_tail: List[tuple] = []
+    duplicates = 0
+
+    for items in chunk_items:
+        items, last = resolve_ditto(items, previous)
+        skip = 0
+        while skip < len(items) and _dedup_key(items[skip]) in previous_tail:
+            skip += 1
+        duplicates += skip
+        merged.extend(items[skip:])
+        if items:
+            previous = last
+            previous_tail = [_dedup_key(item) for item in items[-overlap_window:]]
+
+    if duplicates:
+        logger.info(f"Removed {duplicates} duplicate items at chunk boundaries")
+    return merged
+
+
+def chunk_request_params(model_name: str, chunk: TextChunk, build_prompt: Callable[[str], str],
+                         max_tokens: int = 16000) -> Dict[str, Any]:
+    """
+    チャンク1つの messages.create の引数
+
+    extract_items_chunked と Message Batches API による一括実行（llm_batch）で同じ引数を使うため、
+    一括実行の結果は応答キャッシュ経由でそのまま extract_items_chunked の結果になります。
+    """
+    return {
+        "model": model_name,
+        "max_tokens": max_tokens,
+        "temperature": 0,
+        "messages": [{"role": "user", "content": build_prompt(chunk.text)}],
+    }
+
+
+def extract_items_chunked(
+    client,
+    model_name: str,
+    text: str,
+    build_prompt: Callable[[str], str],
+    operation: str,
+    metadata: Optional[Dict[str, Any]] = None,
+    max_tokens: int = 16000,
+    max_chars: Optional[int] = None,
+    max_workers: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    見積書テキストをチャンクに分割して項目を抽出し、結合した項目を返す
+
+    Args:
+        client: LLMゲートウェイ（get_llm_gateway()）
+        model_name: モデル名
+        text: 見積書テキスト（PagedText ならページ単位で分割）
+        build_prompt: チャンクのテキストからプロンプトを作る関数（JSON配列で回答させるもの）
+        operation: コスト記録の処理名
+        metadata: コスト記録のメタデータ（チャンク番号・ページ範囲を追加）
+        max_tokens: 1チャンクあたりの出力トークン数の上限
+        max_chars: チャンクの最大文字数（Noneで CHUNK_MAX_CHARS）
+        max_workers: 同時実行数（Noneで CHUNK_CONCURRENCY）
+
+    Returns:
+        項目（dict）のリスト
+
+    Raises:
+        API呼び出しの例外（最初に失敗したチャンクのもの）
+    """
+    chunks = chunk_text(text, max_chars=max_chars)
+    logger.info(f"{operation}: {len(text)} characters in {len(chunks)} chunks")
+
+    def extract_chunk(index: int, chunk: TextChunk) -> List[Dict[str, Any]]:
+        label = f"{operation} chunk {index + 1}/{len(chunks)}"
+        response = client.messages.create(
+            **chunk_request_params(model_name, chunk, build_prompt, max_tokens),
+            operation=operation,
+            cost_metadata={**(metadata or {}), "chunk": index + 1, "chunks": len(chunks),
+                           "pages": f"{chunk.first_page}-{chunk.last_page}"}
+        )
+        if getattr(response, "stop_reason", None) == "max_tokens":
+            logger.warning(f"{label}: output reached max_tokens, reduce ESTIMATE_CHUNK_MAX_CHARS")
+        items = parse_item_array(response.content[0].text)
+        logger.debug(f"{label}: {len(items)} items (pages {chunk.first_page}-{chunk.last_page})")
+        return items
+
+    results = run_page_pipeline(
+        ((chunk.index, chunk) for chunk in chunks),
+        extract_chunk,
+        max_workers=max_workers or CHUNK_CONCURRENCY,
+    )
+    return merge_chunk_items([items for _, items in results])
@@ -7,6 +7,7 @@ API呼び出しごとのトークン使用量と料金を記録・集計しま
 import os
 import json
 import uuid
+import threading
 from pathlib import Path
 from datetime import datetime
 from typing import Optional, Dict, Any, List
@@ -65,6 +66,8 @@ class CostTracker:
     - 料金を自動計算
     - ローカルファイルに保存
     - 集計情報の提供
+
+    複数スレッド（並列のステージ実行など）から同時に記録できます。
     """
 
     # Claude API 料金（2024年時点、USD/1Mトークン）
@@ -92,6 +95,14 @@ class CostTracker:
         }
     }
 
+    # プロンプトキャッシュの料金（入力料金に対する倍率）
+    # 書き込み: 5分キャッシュの作成は入力の1.25倍、読み込み: キャッシュヒットは入力の0.1倍
+    CACHE_WRITE_MULTIPLIER = 1.25
+    CACHE_READ_MULTIPLIER = 0.1
+
+    # Message Batches API の料金（同期呼び出しに対する倍率）
+    BATCH_MULTIPLIER = 0.5
+
     # USD/JPY レート（概算）
     USD_JPY_RATE = 150.0
 
@@ -99,6 +110,8 @@ class CostTracker:
         self.log_path = Path(log_path)
         self.log_path.parent.mkdir(parents=True, exist_ok=True)
         self.records: List[Dict[str, Any]] = []
+        # 記録の追加とファイル保存を排他する
+        self._lock = threading.RLock()
 
         # 既存ログを読み込み
         if self.log_path.exists():
@@ -122,21 +135,41 @@ class CostTracker:
         self,
         model_name: str,
         input_tokens: int,
-        output_tokens: int
+        output_tokens: int,
+        cache_creation_input_tokens: int = 0,
+        cache_read_input_tokens: int = 0,
+        batch: bool = False
     ) -> Dict[str, float]:
-        """コストを計算"""
-        pricing = self.get_pricing(model_name)
+        """
+        コストを計算
 
-        input_cost_usd = (input_tokens / 1_000_000) * pricing["input"]
-        output_cost_usd = (output_tokens / 1_000_000) * pricing["output"]
-        total_cost_usd = input_cost_usd + output_cost_usd
+        input_tokens はキャッシュ対象外の入力トークン数（APIの usage.input_tokens）です。
+        cache_savings_usd はプロンプトキャッシュを使わなかった場合との差額（書き込みの割増を差し引いた値）です。
+        batch=True の場合は Message Batches API の料金（入出力とも BATCH_MULTIPLIER 倍）で計算します。
+        """
+        pricing = self.get_pricing(model_name)
+        price_multiplier = self.BATCH_MULTIPLIER if batch else 1.0
+        input_price = pricing["input"] / 1_000_000 * price_multiplier
+
+        input_cost_usd = input_tokens * input_price
+        cache_write_cost_usd = cache_creation_input_tokens * input_price * self.CACHE_WRITE_MULTIPLIER
+        cache_read_cost_usd = cache_read_input_tokens * input_price * self.CACHE_READ_MULTIPLIER
+        output_cost_usd = (output_tokens / 1_000_000) * pricing["output"] * price_multiplier
+        total_cost_usd = input_cost_usd + cache_write_cost_usd + cache_read_cost_usd + output_cost_usd
         total_cost_jpy = total_cost_usd * self.USD_JPY_RATE
 
+        uncached_cost_usd = (input_tokens + cache_creation_input_tokens + cache_read_input_tokens) * input_price
+        cache_savings_usd = uncached_cost_usd - (input_cost_usd + cache_write_cost_usd + cache_read_cost_usd)
+
         return {
             "input_cost_usd": input_cost_usd,
+            "cache_write_cost_usd": cache_write_cost_usd,
+            "cache_read_cost_usd": cache_read_cost_usd,
             "output_cost_usd": output_cost_usd,
             "total_cost_usd": total_cost_usd,
-            "total_cost_jpy": total_cost_jpy
+            "total_cost_jpy": total_cost_jpy,
+            "cache_savings_usd": cache_savings_usd,
+            "cache_savings_jpy": cache_savings_usd * self.USD_JPY_RATE
         }
 
     def record(
@@ -145,7 +178,11 @@ class CostTracker:
         model_name: str,
         input_tokens: int,
         output_tokens: int,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        cache_creation_input_tokens: int = 0,
+        cache_read_input_tokens: int = 0,
+        latency_seconds: Optional[float] = None,
+        batch: bool = False
     ) -> Dict[str, Any]:
         """
         API呼び出しを記録
@@ -153,14 +190,21 @@ class CostTracker:
         Args:
             operation: 操作種別（"見積生成", "KB抽出", "法令抽出" など）
             model_name: 使用モデル名
-            input_tokens: 入力トークン数
+            input_tokens: 入力トークン数（キャッシュ対象外）
             output_tokens: 出力トークン数
             metadata: 追加情報（ファイル名など）
+            cache_creation_input_tokens: プロンプトキャッシュに書き込んだ入力トークン数
+            cache_read_input_tokens: プロンプトキャッシュから読み込んだ入力トークン数
+            latency_seconds: API呼び出しにかかった時間（秒）
+            batch: Message Batches API で実行した呼び出しか
 
         Returns:
             記録されたレコード
         """
-        cost = self.calculate_cost(model_name, input_tokens, output_tokens)
+        cost = self.calculate_cost(
+            model_name, input_tokens, output_tokens,
+            cache_creation_input_tokens, cache_read_input_tokens, batch=batch
+        )
 
         record = {
             "timestamp": datetime.now().isoformat(),
@@ -168,19 +212,30 @@ class CostTracker:
             "model": model_name,
             "input_tokens": input_tokens,
             "output_tokens": output_tokens,
-            "total_tokens": input_tokens + output_tokens,
+            "cache_creation_input_tokens": cache_creation_input_tokens,
+            "cache_read_input_tokens": cache_read_input_tokens,
+            "total_tokens": input_tokens + output_tokens + cache_creation_input_tokens + cache_read_input_tokens,
             "cost_usd": cost["total_cost_usd"],
             "cost_jpy": cost["total_cost_jpy"],
+            "cache_savings_jpy": cost["cache_savings_jpy"],
+            "latency_seconds": latency_seconds,
+            "batch": batch,
             "metadata": metadata or {},
             "session_id": get_current_session_id()  # セッションIDを記録
         }
 
-        self.records.append(record)
-        self._save()
+        with self._lock:
+            self.records.append(record)
+            self._save()
 
+        cache_note = ""
+        if cache_creation_input_tokens or cache_read_input_tokens:
+            cache_note = f" (cache {cache_read_input_tokens:,} read / {cache_creation_input_tokens:,} write)"
+        if batch:
+            cache_note += " (batch)"
         logger.info(
             f"Cost recorded: {operation} - "
-            f"{input_tokens:,} in / {output_tokens:,} out = "
+            f"{input_tokens:,} in / {output_tokens:,} out{cache_note} = "
             f"${cost['total_cost_usd']:.4f} (¥{cost['total_cost_jpy']:.2f})"
         )
 
@@ -189,7 +244,7 @@ class CostTracker:
     def _save(self):
         """ログをファイルに保存"""
         try:
-            with open(self.log_path, 'w', encoding='utf-8') as f:
+            with self._lock, open(self.log_path, 'w', encoding='utf-8') as f:
                 json.dump(self.records, f, ensure_ascii=False, indent=2)
         except Exception as e:
             logger.error(f"Failed to save cost log: {e}")
@@ -229,8 +284,11 @@ class CostTracker:
                 "total_tokens": 0,
                 "total_input_tokens": 0,
                 "total_output_tokens": 0,
+                "total_cache_read_tokens": 0,
+                "total_cache_creation_tokens": 0,
                 "total_cost_usd": 0,
                 "total_cost_jpy": 0,
+                "cache_savings_jpy": 0,
                 "by_operation": {},
                 "by_date": {}
             }
@@ -272,8 +330,11 @@ class CostTracker:
             "total_tokens": sum(r["total_tokens"] for r in records),
             "total_input_tokens": sum(r["input_tokens"] for r in records),
             "total_output_tokens": sum(r["output_tokens"] for r in records),
+            "total_cache_read_tokens": sum(r.get("cache_read_input_tokens", 0) for r in records),
+            "total_cache_creation_tokens": sum(r.get("cache_creation_input_tokens", 0) for r in records),
             "total_cost_usd": sum(r["cost_usd"] for r in records),
             "total_cost_jpy": sum(r["cost_jpy"] for r in records),
+            "cache_savings_jpy": sum(r.get("cache_savings_jpy", 0) for r in records),
             "by_operation": by_operation,
             "by_date": dict(sorted(by_date.items(), reverse=True))
         }
@@ -284,8 +345,9 @@ class CostTracker:
 
     def clear_records(self):
         """全レコードをクリア"""
-        self.records = []
-        self._save()
+        with self._lock:
+            self.records = []
+            self._save()
         logger.info("Cost records cleared")
 
     def get_session_summary(self, session_id: str) -> Dict[str, Any]:
@@ -302,6 +364,9 @@ class CostTracker:
                 "total_tokens": 0,
                 "total_cost_usd": 0,
                 "total_cost_jpy": 0,
+                "cache_read_tokens": 0,
+                "cache_savings_jpy": 0,
+                "latency_seconds": 0,
                 "operations": []
             }
 
@@ -310,7 +375,9 @@ class CostTracker:
             operations.append({
                 "operation": r["operation"],
                 "tokens": r["total_tokens"],
-                "cost_jpy": r["cost_jpy"]
+                "cost_jpy": r["cost_jpy"],
+                "cache_read_tokens": r.get("cache_read_input_tokens", 0),
+                "latency_seconds": r.get("latency_seconds")
             })
 
         return {
@@ -319,6 +386,10 @@ class CostTracker:
             "total_tokens": sum(r["total_tokens"] for r in session_records),
             "total_cost_usd": sum(r["cost_usd"] for r in session_records),
             "total_cost_jpy": sum(r["cost_jpy"] for r in session_records),
+            "cache_read_tokens": sum(r.get("cache_read_input_tokens", 0) for r in session_records),
+            "cache_savings_jpy": sum(r.get("cache_savings_jpy", 0) for r in session_records),
+            # API呼び出し時間の合計（並列実行した呼び出しは重複して数える）
+            "latency_seconds": sum(r.get("latency_seconds") or 0 for r in session_records),
             "operations": operations
         }
 
@@ -340,13 +411,17 @@ class CostTracker:
             "total_tokens": summary["total_tokens"],
             "cost_usd": summary["total_cost_usd"],
             "cost_jpy": summary["total_cost_jpy"],
+            "cache_savings_jpy": summary.get("cache_savings_jpy", 0),
             "metadata": {
                 "api_calls": summary["total_records"],
+                "cache_read_tokens": summary.get("cache_read_tokens", 0),
+                "latency_seconds": summary.get("latency_seconds", 0),
                 "operations": summary.get("operations", [])
             }
         }
-        self.records.append(record)
-        self._save()
+        with self._lock:
+            self.records.append(record)
+            self._save()
 
     def get_session_history(self, limit: int = 20) -> List[Dict[str, Any]]:
         """セッション完了履歴を取得"""
@@ -359,14 +434,16 @@ class CostTracker:
 
 # グローバルインスタンス（シングルトン的に使用）
 _tracker_instance: Optional[CostTracker] = None
+_tracker_lock = threading.Lock()
 
 
 def get_tracker() -> CostTracker:
     """グローバルトラッカーを取得"""
     global _tracker_instance
-    if _tracker_instance is None:
-        _tracker_instance = CostTracker()
-    return _tracker_instance
+    with _tracker_lock:
+        if _tracker_instance is None:
+            _tracker_instance = CostTracker()
+        return _tracker_instance
 
 
 def record_cost(
@@ -374,10 +451,20 @@ def record_cost(
     model_name: str,
     input_tokens: int,
     output_tokens: int,
-    metadata: Optional[Dict[str, Any]] = None
+    metadata: Optional[Dict[str, Any]] = None,
+    cache_creation_input_tokens: int = 0,
+    cache_read_input_tokens: int = 0,
+    latency_seconds: Optional[float] = None,
+    batch: bool = False
 ) -> Dict[str, Any]:
     """コストを記録（簡易関数）"""
-    return get_tracker().record(operation, model_name, input_tokens, output_tokens, metadata)
+    return get_tracker().record(
+        operation, model_name, input_tokens, output_tokens, metadata,
+        cache_creation_input_tokens=cache_creation_input_tokens,
+        cache_read_input_tokens=cache_read_input_tokens,
+        latency_seconds=latency_seconds,
+        batch=batch
+    )
 
 
 if __name__ == "__main__":
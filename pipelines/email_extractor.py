@@ -20,9 +20,10 @@ from typing import Optional, Dict, Any
 
 from PyPDF2 import PdfReader
 from pydantic import BaseModel, Field
-import anthropic
 from dotenv import load_dotenv
 
+from pipelines.llm_gateway import get_llm_gateway
+
 logger = logging.getLogger(__name__)
 
 
@@ -66,7 +67,7 @@ class EmailExtractor:
             api_key: Anthropic API key（Noneの場合は環境変数から取得）
         """
         load_dotenv()
-        self.client = anthropic.Anthropic(api_key=api_key or os.getenv("ANTHROPIC_API_KEY"))
+        self.client = get_llm_gateway(api_key)
 
     def extract_text_from_pdf(self, pdf_path: str) -> str:
         """PDFからテキストを抽出"""
@@ -144,7 +145,9 @@ JSON形式のみを出力してください。説明文は不要です。"""
             messages=[{
                 "role": "user",
                 "content": prompt
-            }]
+            }],
+            operation="メール見積依頼抽出",
+            cost_metadata={"source": "email_extractor"}
         )
 
         # レスポンスからJSONを抽出
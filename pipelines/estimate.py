@@ -32,13 +32,11 @@ class EstimateGenerator:
     def _init_llm(self):
         """Claude LLMを初期化"""
         try:
-            from anthropic import Anthropic
             from dotenv import load_dotenv
+            from pipelines.llm_gateway import get_llm_gateway
             load_dotenv()
 
-            self.client = Anthropic(
-                api_key=os.getenv("ANTHROPIC_API_KEY")
-            )
+            self.client = get_llm_gateway()
             self.model_name = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-5-20250929")
             logger.info(f"Claude initialized: {self.model_name}")
         except Exception as e:
@@ -181,7 +179,9 @@ JSON配列形式で以下のように出力してください：
                 system="あなたは建設見積の専門家です。必ずJSON形式で回答してください。",
                 messages=[
                     {"role": "user", "content": prompt}
-                ]
+                ],
+                operation="見積項目生成",
+                cost_metadata={"source": "estimate_generator"}
             )
 
             import json
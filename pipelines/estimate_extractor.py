@@ -6,12 +6,11 @@ from pathlib import Path
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from dotenv import load_dotenv
-from anthropic import Anthropic
 from loguru import logger
-import PyPDF2
 
 from pipelines.schemas import EstimateItem, DisciplineType, FMTDocument, ProjectInfo, FacilityType
-from pipelines.cost_tracker import record_cost
+from pipelines.llm_gateway import get_llm_gateway
+from pipelines.pdf_cache import open_pdf
 
 
 class EstimateExtractor:
@@ -19,7 +18,7 @@ class EstimateExtractor:
 
     def __init__(self):
         load_dotenv()
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.client = get_llm_gateway()
         self.model_name = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
 
     def extract_text_from_pdf(self, pdf_path: str, max_pages: int = None) -> str:
@@ -27,18 +26,14 @@ class EstimateExtractor:
         logger.info(f"Extracting text from PDF: {pdf_path}")
 
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                total_pages = len(pdf_reader.pages)
-                pages_to_read = total_pages if max_pages is None else min(total_pages, max_pages)
-
-                text = ""
-                for page_num in range(pages_to_read):
-                    page = pdf_reader.pages[page_num]
-                    text += page.extract_text() + "\n"
-
-                logger.info(f"Extracted {len(text)} characters from {pages_to_read}/{total_pages} pages")
-                return text
+            pdf = open_pdf(pdf_path)
+            total_pages = pdf.page_count
+            pages_to_read = total_pages if max_pages is None else min(total_pages, max_pages)
+
+            text = pdf.paged_text(1, pages_to_read)
+
+            logger.info(f"Extracted {len(text)} characters from {pages_to_read}/{total_pages} pages")
+            return text
         except Exception as e:
             logger.error(f"Error extracting text from PDF: {e}")
             raise
@@ -127,16 +122,9 @@ JSON配列形式で出力してください：
                 model=self.model_name,
                 max_tokens=16000,
                 temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            # コスト記録
-            record_cost(
+                messages=[{"role": "user", "content": prompt}],
                 operation="見積項目抽出",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"source": "extract_estimate_items", "discipline": discipline.value}
+                cost_metadata={"source": "extract_estimate_items", "discipline": discipline.value}
             )
 
             response_text = response.content[0].text
@@ -197,16 +185,9 @@ JSON形式で出力してください：
                 model=self.model_name,
                 max_tokens=2000,
                 temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            # コスト記録
-            record_cost(
+                messages=[{"role": "user", "content": prompt}],
                 operation="プロジェクト情報抽出",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"source": "extract_project_info"}
+                cost_metadata={"source": "extract_project_info"}
             )
 
             response_text = response.content[0].text
@@ -11,15 +11,15 @@ from pathlib import Path
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from dotenv import load_dotenv
-from anthropic import Anthropic
 from loguru import logger
-import PyPDF2
 
 from pipelines.schemas import (
     EstimateItem, DisciplineType, FMTDocument, ProjectInfo, FacilityType,
     CostType, OverheadCalculation
 )
-from pipelines.cost_tracker import record_cost
+from pipelines.chunked_extraction import extract_items_chunked
+from pipelines.llm_gateway import get_llm_gateway
+from pipelines.pdf_cache import open_pdf
 from pipelines.estimate_verifier import EstimateVerifier, CalculationBasis
 
 
@@ -33,7 +33,7 @@ class EstimateFromReference:
 
     def __init__(self):
         load_dotenv()
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.client = get_llm_gateway()
         self.model_name = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
         self.verifier = EstimateVerifier()  # 算出根拠検証器
 
@@ -56,13 +56,10 @@ class EstimateFromReference:
 
         try:
             # PDFからテキストを抽出（全ページ対応）
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                total_pages = len(pdf_reader.pages)
-                # 全ページを処理（制限なし）
-                for page_num in range(total_pages):
-                    text += pdf_reader.pages[page_num].extract_text() + "\n"
+            pdf = open_pdf(pdf_path)
+            total_pages = pdf.page_count
+            # 全ページを処理（制限なし）
+            text = pdf.paged_text()
 
             logger.info(f"Extracted {len(text)} characters from reference PDF ({total_pages} pages)")
 
@@ -86,12 +83,62 @@ class EstimateFromReference:
 
                 logger.info(f"OCR extraction completed: {len(text)} characters, {len(items_data)} items")
 
-            # LLMで構造化データに変換
-            # テキスト制限を緩和: 最大60000文字（大規模PDF対応）
-            prompt = f"""以下の見積書PDFから、見積項目を詳細に抽出してください。
+            # LLMで構造化データに変換（ページ単位のチャンクに分割して並列に抽出し、境界の重複・同上を処理）
+            items_data = extract_items_chunked(
+                self.client,
+                self.model_name,
+                text,
+                self._build_reference_prompt,
+                operation="見積抽出（参照PDF）",
+                metadata={"file": Path(pdf_path).name, "discipline": discipline.value}
+            )
+
+            logger.info(f"Extracted {len(items_data)} items from reference PDF")
+
+            # EstimateItemに変換
+            estimate_items = []
+            for item_data in items_data:
+                # cost_typeの変換
+                cost_type_str = item_data.get("cost_type", "")
+                cost_type = None
+                if cost_type_str:
+                    for ct in CostType:
+                        if ct.value == cost_type_str:
+                            cost_type = ct
+                            break
+
+                estimate_item = EstimateItem(
+                    item_no=item_data.get("item_no", ""),
+                    level=item_data.get("level", 0),
+                    name=item_data.get("name", ""),
+                    specification=item_data.get("specification", ""),
+                    quantity=item_data.get("quantity"),
+                    unit=item_data.get("unit", ""),
+                    unit_price=item_data.get("unit_price"),
+                    amount=item_data.get("amount"),
+                    discipline=discipline,
+                    cost_type=cost_type,
+                    remarks=item_data.get("remarks", ""),
+                    source_type="reference",
+                    source_reference=Path(pdf_path).name
+                )
+
+                estimate_items.append(estimate_item)
+
+            return estimate_items
+
+        except Exception as e:
+            logger.error(f"Error extracting estimate from PDF: {e}")
+            import traceback
+            logger.error(traceback.format_exc())
+            return []
+
+    def _build_reference_prompt(self, text: str) -> str:
+        """見積書テキスト（チャンク）から見積項目を抽出するプロンプト"""
+        return f"""以下の見積書PDFのテキスト（長い見積書はページ単位に分割した一部）から、見積項目を詳細に抽出してください。
 
 見積書テキスト:
-{text[:60000]}
+{text}
 
 【抽出する情報】
 各見積項目について、以下の情報を正確に抽出してください：
@@ -122,6 +169,7 @@ class EstimateFromReference:
 - 単位は必ず抽出してください
 - 親項目（小計のみ）と子項目を区別してください
 - 法定福利費（16.07%）も必ず抽出してください
+- 「同上」「〃」は直前の項目名に置き換えてください（参照先の項目がテキスト内にない場合は「同上」のまま）
 
 【出力形式】
 JSON配列形式で出力してください：
@@ -193,77 +241,6 @@ JSON配列形式で出力してください：
 
 必ずJSON形式で回答してください。"""
 
-            response = self.client.messages.create(
-                model=self.model_name,
-                max_tokens=16000,
-                temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            # コスト記録
-            record_cost(
-                operation="見積抽出（参照PDF）",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"file": Path(pdf_path).name, "discipline": discipline.value}
-            )
-
-            response_text = response.content[0].text
-            logger.debug(f"LLM Response: {response_text[:500]}...")
-
-            # JSONを抽出
-            json_start = response_text.find('[')
-            json_end = response_text.rfind(']') + 1
-
-            if json_start == -1 or json_end == 0:
-                logger.error("No JSON found in response")
-                return []
-
-            import json
-            json_str = response_text[json_start:json_end]
-            items_data = json.loads(json_str)
-
-            logger.info(f"Extracted {len(items_data)} items from reference PDF")
-
-            # EstimateItemに変換
-            estimate_items = []
-            for item_data in items_data:
-                # cost_typeの変換
-                cost_type_str = item_data.get("cost_type", "")
-                cost_type = None
-                if cost_type_str:
-                    for ct in CostType:
-                        if ct.value == cost_type_str:
-                            cost_type = ct
-                            break
-
-                estimate_item = EstimateItem(
-                    item_no=item_data.get("item_no", ""),
-                    level=item_data.get("level", 0),
-                    name=item_data.get("name", ""),
-                    specification=item_data.get("specification", ""),
-                    quantity=item_data.get("quantity"),
-                    unit=item_data.get("unit", ""),
-                    unit_price=item_data.get("unit_price"),
-                    amount=item_data.get("amount"),
-                    discipline=discipline,
-                    cost_type=cost_type,
-                    remarks=item_data.get("remarks", ""),
-                    source_type="reference",
-                    source_reference=Path(pdf_path).name
-                )
-
-                estimate_items.append(estimate_item)
-
-            return estimate_items
-
-        except Exception as e:
-            logger.error(f"Error extracting estimate from PDF: {e}")
-            import traceback
-            logger.error(traceback.format_exc())
-            return []
-
     def adjust_quantities_from_spec(
         self,
         estimate_items: List[EstimateItem],
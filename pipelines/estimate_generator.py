@@ -4,7 +4,6 @@
 """
 
 import os
-import json
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from datetime import datetime
@@ -15,6 +14,7 @@ from pipelines.schemas import (
     CostType, OverheadCalculation, PriceReference
 )
 from pipelines.estimate_extractor_v2 import EstimateExtractorV2
+from pipelines.kb_registry import get_kb_registry
 
 
 class EstimateGenerator:
@@ -39,15 +39,11 @@ class EstimateGenerator:
             kb_path = "kb/price_kb.json"
 
         self.kb_path = kb_path
-        self.price_kb: List[Dict[str, Any]] = []
 
-        # KBを読み込み
-        if Path(kb_path).exists():
-            with open(kb_path, 'r', encoding='utf-8') as f:
-                self.price_kb = json.load(f)
+        # KBを読み込み（プロセス共通の読み取り専用スナップショット）
+        self.price_kb: List[Dict[str, Any]] = get_kb_registry().get_kb(kb_path)
+        if self.price_kb:
             logger.info(f"Loaded {len(self.price_kb)} items from KB: {kb_path}")
-        else:
-            logger.warning(f"KB file not found: {kb_path}")
 
     def match_price_from_kb(
         self,
@@ -9,15 +9,12 @@ import os
 import json
 import re
 import io
-import base64
 import hashlib
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple
 from datetime import datetime
 from dotenv import load_dotenv
-from anthropic import Anthropic
 from loguru import logger
-import PyPDF2
 
 # ログ設定（ファイル出力含む）
 try:
@@ -51,7 +48,28 @@ from pipelines.schemas import (
 from pipelines.building_type_templates import (
     detect_building_type, get_template_items, BUILDING_TEMPLATES
 )
-from pipelines.cost_tracker import record_cost
+from pipelines.llm_gateway import get_llm_gateway
+from pipelines.kb_features import KBFeatureTable, normalize_text, extract_size, get_category
+from pipelines.kb_registry import get_kb_registry
+from pipelines.stage_cache import StageCache
+from pipelines.stage_runner import StageRunner
+from pipelines.pdf_cache import open_pdf, resolve_text_engine
+from pipelines.paged_text import PagedText
+from pipelines.streaming_json import JSONArrayStreamParser
+from pipelines.page_classifier import (
+    DRAWING_MAX_PAGES,
+    SPEC_TABLE_KEYWORDS,
+    select_drawing_pages,
+    select_spec_table_pages,
+)
+from pipelines.page_pipeline import iter_rendered_pages, run_page_pipeline
+from pipelines.render_policy import DEFAULT_RENDER_POLICY, RenderedPage
+from pipelines.spec_table_parser import (
+    LOCAL_TABLE_MIN_CONFIDENCE,
+    extract_spec_table_page,
+    merge_rooms,
+    summarize_rooms,
+)
 from pipelines.estimation_rules import EstimationChecker, get_checklist_summary
 from pipelines.pattern_learner import PatternLearner
 from pipelines.item_categorizer import add_category_hierarchy
@@ -486,21 +504,71 @@ MAX_PRICE_EXCLUDE_KEYWORDS = [
 
 
 # ===== ベクトル検索クラス =====
+# 永続化したベクトルインデックスの保存先（KBの隣に配置）
+VECTOR_INDEX_DIR = "kb/vector_index"
+
+# 広すぎるマッチ判定用: 具体的な作業を示すキーワード / 設備工事全体を示すパターン
+SPECIFIC_WORK_KEYWORDS = ["配管", "器具", "機器", "配線", "取付", "撤去", "試験", "調整"]
+BROAD_KB_PATTERNS = ["設備工事", "工事一式", "設備一式"]
+
+# ステージ結果キャッシュのプロンプトバージョン（プロンプト・抽出ロジックを変更したら上げる）
+PROMPT_VERSIONS = {
+    # テキスト抽出エンジンで抽出結果が変わるためエンジン名を含める
+    "spec_text": f"2-{resolve_text_engine()}",
+    # 仕様書をプロンプトキャッシュ用の共通の先頭ブロック（SPEC_CONTEXT_MAX_CHARS まで）に移したため更新
+    "building_info": "3",
+    # 対象ページをページ分類（page_classifier）で選ぶようにしたため更新
+    # Vision系は画像化ポリシー（render_policy）で送る画像が変わるため更新
+    "spec_tables": "2",
+    # 諸元表はテキストレイヤーからのローカル抽出を優先し、部屋を統合して集計するため更新
+    "spec_table_vision": "4",
+    "drawing_info": "3",
+    "equipment_quantities": "3",
+}
+
+# 仕様書テキストをプロンプトに含める最大文字数（環境変数で変更可能）
+# 建物情報・設備数量の抽出と工事区分ごとの項目生成で同じ範囲を先頭に置き、プロンプトキャッシュを共有する
+# （従来の建物情報の抽出と同じ範囲。2回目以降の呼び出しは入力料金の0.1倍で読み込むため、
+#   従来の工事区分ごとの12000〜15000文字より安くなる）
+SPEC_CONTEXT_MAX_CHARS = int(os.getenv("SPEC_CONTEXT_MAX_CHARS", "60000"))
+SPEC_CONTEXT_TEMPLATE = """以下は見積対象工事の仕様書です。この後の指示に従って、仕様書の内容を参照してください。
+
+【仕様書】
+{spec_text}"""
+
+
 class VectorKBSearch:
     """
     FAISSを使用したKBベクトル検索
 
     sentence-transformersで日本語テキストをベクトル化し、
     FAISSで高速な類似度検索を行います。
+    インデックスはKB項目ごとの安定ID（item_id・項目の内容・埋め込みテキストのハッシュ）で
+    管理し、モデル・KBファイルごとにディスクに保存します。KBが変更された場合は追加・変更・削除された
+    項目だけを差分更新し、KBが前回と同じ場合はメモリマップで読み込みます。
     """
 
-    def __init__(self, model_name: str = "intfloat/multilingual-e5-small"):
+    def __init__(self, model_name: str = "intfloat/multilingual-e5-small", index_dir: Optional[str] = VECTOR_INDEX_DIR,
+                 kb_path: Optional[str] = None):
         """
         Args:
             model_name: 使用するembeddingモデル名
                 推奨: "intfloat/multilingual-e5-small" (高速・日本語対応)
                 高精度: "intfloat/multilingual-e5-base"
+            index_dir: インデックスの保存先ディレクトリ（Noneで永続化しない）
+            kb_path: インデックスを作るKBファイルのパス（KBごとに別のファイルに保存する）
         """
+        self.model_name = model_name
+        self.index_dir = Path(index_dir) if index_dir else None
+        self.kb_path = kb_path
+        # FAISS上のID → KB行番号
+        self._row_by_id: Dict[int, int] = {}
+        # バッチ検索用の行テーブル（_prepare_row_tables で構築）
+        self._sorted_ids = None
+        self._sorted_rows = None
+        self._discipline_masks: Dict[str, "np.ndarray"] = {}
+        self._unit_masks: Dict[str, "np.ndarray"] = {}
+
         if not HAS_VECTOR_SEARCH:
             logger.warning("Vector search not available - using fallback string matching")
             self.model = None
@@ -510,7 +578,8 @@ class VectorKBSearch:
 
         logger.info(f"Initializing vector search with model: {model_name}")
         try:
-            self.model = SentenceTransformer(model_name)
+            # モデルはプロセス内で共有（セッションごとにロードしない）
+            self.model = get_kb_registry().get_embedding_model(model_name)
             self.index = None
             self.kb_items = []
             self.dimension = self.model.get_sentence_embedding_dimension()
@@ -521,9 +590,141 @@ class VectorKBSearch:
             self.index = None
             self.kb_items = []
 
+    @staticmethod
+    def _passage_text(item: Dict) -> str:
+        """KB項目から埋め込み用テキストを生成（項目名 + 仕様 + 工事区分）"""
+        desc = item.get("description", "")
+        spec = item.get("features", {}).get("specification", "")
+        discipline = item.get("discipline", "")
+        # E5モデル用のプレフィックス
+        return f"passage: {desc} {spec} {discipline}"
+
+    @staticmethod
+    def _row_ids(kb_items: List[Dict], texts: List[str]) -> List[int]:
+        """
+        KB項目ごとの安定ID（63bit）を計算
+
+        item_id・項目の内容全体・埋め込みテキストのハッシュから計算するため、
+        KB内の位置や他の項目の追加・削除に関係なく同じ項目は同じIDになり、
+        内容が変わった項目は別IDになり再エンコード対象になります。
+        （KBに同一item_idの重複があっても、内容が異なれば別IDになります。
+        内容まで完全に同じ重複は同じIDになり、インデックスには1件だけ入ります）
+        """
+        ids = []
+        for item, text in zip(kb_items, texts):
+            content = json.dumps(item, ensure_ascii=False, sort_keys=True, default=str)
+            digest = hashlib.blake2b(
+                f"{item.get('item_id', '')}\x1f{text}\x1f{content}".encode("utf-8"), digest_size=8
+            ).digest()
+            ids.append(int.from_bytes(digest, "big") & 0x7FFFFFFFFFFFFFFF)
+        return ids
+
+    def _kb_key(self, ids: List[int]) -> str:
+        """KB全体（行ID列）とモデル名からキーを計算（差分なし判定用）"""
+        hasher = hashlib.sha256(self.model_name.encode("utf-8"))
+        hasher.update(np.asarray(ids, dtype="int64").tobytes())
+        return hasher.hexdigest()[:16]
+
+    def _index_paths(self):
+        """インデックス・メタ情報のファイルパス（モデル・KBファイルごと）"""
+        model_slug = re.sub(r"[^0-9A-Za-z]+", "_", self.model_name).strip("_")
+        if self.kb_path:
+            # 同じファイル名の別ディレクトリのKBと区別するため、絶対パスのハッシュも付ける
+            kb_hash = hashlib.sha256(str(Path(self.kb_path).resolve()).encode("utf-8")).hexdigest()[:8]
+            model_slug = f"{model_slug}_{Path(self.kb_path).stem}_{kb_hash}"
+        stem = self.index_dir / model_slug
+        return stem.with_suffix(".faiss"), stem.with_suffix(".json")
+
+    def _load_persisted_index(self, kb_key: str):
+        """
+        保存済みインデックスを読み込み
+
+        Returns:
+            (index, KB全体が一致したか)。保存済みインデックスがなければ (None, False)
+        """
+        index_path, meta_path = self._index_paths()
+        if not index_path.exists() or not meta_path.exists():
+            return None, False
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            unchanged = meta.get("kb_key") == kb_key
+            # KBに変更がなければ読み取り専用でメモリマップ、差分更新する場合は通常読み込み
+            flags = faiss.IO_FLAG_MMAP if unchanged else 0
+            index = faiss.read_index(str(index_path), flags)
+        except Exception as e:
+            logger.warning(f"Failed to load persisted vector index {index_path.name}: {e}")
+            return None, False
+        if index.d != self.dimension:
+            logger.warning(f"Persisted vector index {index_path.name} has different dimension - rebuilding")
+            return None, False
+        return index, unchanged
+
+    def _save_index(self, kb_key: str):
+        """インデックスとメタ情報を保存"""
+        index_path, meta_path = self._index_paths()
+        try:
+            self.index_dir.mkdir(parents=True, exist_ok=True)
+            # 書き込み途中のファイルを読まれないよう一時ファイル経由で置き換え
+            tmp_index = index_path.with_suffix(".faiss.tmp")
+            faiss.write_index(self.index, str(tmp_index))
+            os.replace(tmp_index, index_path)
+            tmp_meta = meta_path.with_suffix(".json.tmp")
+            with open(tmp_meta, 'w', encoding='utf-8') as f:
+                json.dump({
+                    "model_name": self.model_name,
+                    "kb_key": kb_key,
+                    "ntotal": int(self.index.ntotal),
+                    "updated_at": datetime.now().isoformat(),
+                }, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_meta, meta_path)
+            logger.info(f"Vector index saved to {index_path}")
+        except Exception as e:
+            logger.warning(f"Failed to persist vector index: {e}")
+
+    def _encode_passages(self, texts: List[str]) -> "np.ndarray":
+        """パッセージをベクトル化して正規化"""
+        embeddings = self.model.encode(texts, show_progress_bar=False)
+        embeddings = np.array(embeddings).astype('float32')
+        # 正規化（コサイン類似度計算のため）
+        faiss.normalize_L2(embeddings)
+        return embeddings
+
+    def add_items(self, items: List[Dict], ids: List[int], texts: List[str] = None) -> int:
+        """
+        項目をインデックスに追加（既存IDは置き換え）
+
+        Args:
+            items: 追加するKB項目
+            ids: 各項目の安定ID（_row_ids で計算）
+            texts: 埋め込み用テキスト（省略時は項目から生成）
+
+        Returns:
+            エンコードした項目数
+        """
+        if not items:
+            return 0
+        if texts is None:
+            texts = [self._passage_text(item) for item in items]
+        id_array = np.asarray(ids, dtype="int64")
+        if self.index.ntotal > 0:
+            self.index.remove_ids(id_array)
+        self.index.add_with_ids(self._encode_passages(texts), id_array)
+        return len(items)
+
+    def remove_items(self, ids: List[int]) -> int:
+        """指定IDの項目をインデックスから削除"""
+        if not len(ids) or self.index is None:
+            return 0
+        return int(self.index.remove_ids(np.asarray(ids, dtype="int64")))
+
     def build_index(self, kb_items: List[Dict]) -> bool:
         """
-        KBアイテムからFAISSインデックスを構築
+        KBアイテムからFAISSインデックスを構築（差分更新）
+
+        保存済みインデックスがあれば読み込み、追加・変更された項目だけを
+        エンコードし、KBから消えた項目を削除します。KBに変更がなければ
+        エンコードは一切行いません。
 
         Args:
             kb_items: KB項目のリスト
@@ -534,37 +735,53 @@ class VectorKBSearch:
         if not self.model or not kb_items:
             return False
 
-        self.kb_items = kb_items
-
-        # KB項目からテキストを生成（項目名 + 仕様 + 工事区分）
-        texts = []
-        for item in kb_items:
-            desc = item.get("description", "")
-            spec = item.get("features", {}).get("specification", "")
-            discipline = item.get("discipline", "")
-            # E5モデル用のプレフィックス
-            text = f"passage: {desc} {spec} {discipline}"
-            texts.append(text)
-
-        logger.info(f"Building vector index for {len(texts)} KB items...")
+        texts = [self._passage_text(item) for item in kb_items]
+        ids = self._row_ids(kb_items, texts)
+        kb_key = self._kb_key(ids)
 
         try:
-            # ベクトル化
-            embeddings = self.model.encode(texts, show_progress_bar=False)
-            embeddings = np.array(embeddings).astype('float32')
-
-            # FAISSインデックス構築（L2距離）
-            self.index = faiss.IndexFlatIP(self.dimension)  # 内積（コサイン類似度用）
+            index, unchanged = (None, False)
+            if self.index_dir:
+                index, unchanged = self._load_persisted_index(kb_key)
 
-            # 正規化（コサイン類似度計算のため）
-            faiss.normalize_L2(embeddings)
-            self.index.add(embeddings)
+            if index is None:
+                # IDで管理するインデックスを新規作成（内積＝コサイン類似度）
+                index = faiss.IndexIDMap2(faiss.IndexFlatIP(self.dimension))
+            self.index = index
 
-            logger.info(f"Vector index built successfully: {self.index.ntotal} vectors")
+            if unchanged:
+                logger.info(f"Vector index loaded from disk ({index.ntotal} vectors, mmap)")
+            else:
+                stored_ids = set(faiss.vector_to_array(index.id_map).tolist()) if index.ntotal else set()
+                current_ids = set(ids)
+                stale_ids = list(stored_ids - current_ids)
+                # 内容まで同じ重複項目は最初の1件だけエンコード
+                first_rows = {}
+                for i, row_id in enumerate(ids):
+                    first_rows.setdefault(row_id, i)
+                new_rows = [i for row_id, i in first_rows.items() if row_id not in stored_ids]
+
+                removed = self.remove_items(stale_ids)
+                encoded = self.add_items(
+                    [kb_items[i] for i in new_rows],
+                    [ids[i] for i in new_rows],
+                    [texts[i] for i in new_rows],
+                )
+                logger.info(f"Vector index updated: {encoded} encoded, {removed} removed, "
+                           f"{len(kb_items) - encoded} reused ({self.index.ntotal} vectors)")
+                if self.index_dir:
+                    self._save_index(kb_key)
+
+            self.kb_items = kb_items
+            self._row_by_id = {}
+            for row, row_id in enumerate(ids):
+                self._row_by_id.setdefault(row_id, row)
+            self._prepare_row_tables(ids)
             return True
 
         except Exception as e:
             logger.error(f"Failed to build vector index: {e}")
+            self.index = None
             return False
 
     def _expand_query_with_synonyms(self, query: str) -> str:
@@ -596,6 +813,49 @@ class VectorKBSearch:
         unique_terms = list(dict.fromkeys(expanded_terms))
         return " ".join(unique_terms[:5])  # 最大5語
 
+    def _prepare_row_tables(self, ids: List[int]):
+        """バッチ検索用にID→行番号の対応表と工事区分・単位の行配列を作成"""
+        id_array = np.asarray(ids, dtype="int64")
+        order = np.argsort(id_array, kind="stable")
+        self._sorted_ids = id_array[order]
+        self._sorted_rows = order.astype("int64")
+        # 工事区分・単位のない項目（None）は空文字として扱う（マスク作成時の部分一致で TypeError にしない）
+        self._kb_disciplines = np.array([item.get("discipline") or "" for item in self.kb_items], dtype=object)
+        self._kb_units = np.array([item.get("unit") or "" for item in self.kb_items], dtype=object)
+        self._discipline_masks = {}
+        self._unit_masks = {}
+
+    def _rows_for_ids(self, id_matrix: "np.ndarray") -> "np.ndarray":
+        """FAISSのID行列をKB行番号の行列に変換（該当なしは-1）"""
+        pos = np.searchsorted(self._sorted_ids, id_matrix)
+        pos = np.clip(pos, 0, len(self._sorted_ids) - 1)
+        found = (self._sorted_ids[pos] == id_matrix) & (id_matrix >= 0)
+        return np.where(found, self._sorted_rows[pos], -1)
+
+    def _discipline_mask(self, discipline: str) -> "np.ndarray":
+        """工事区分フィルタを通過するKB行のマスク（汎用の「設備工事」は常に許可）"""
+        mask = self._discipline_masks.get(discipline)
+        if mask is None:
+            allowed = {
+                kb_discipline for kb_discipline in set(self._kb_disciplines)
+                if discipline in kb_discipline or kb_discipline in discipline or kb_discipline == "設備工事"
+            }
+            mask = np.isin(self._kb_disciplines, list(allowed))
+            self._discipline_masks[discipline] = mask
+        return mask
+
+    def _unit_mask(self, target_unit: str) -> "np.ndarray":
+        """希望単位と一致（部分一致含む）するKB行のマスク"""
+        mask = self._unit_masks.get(target_unit)
+        if mask is None:
+            allowed = {
+                kb_unit for kb_unit in set(self._kb_units)
+                if kb_unit == target_unit or target_unit in kb_unit or kb_unit in target_unit
+            }
+            mask = np.isin(self._kb_units, list(allowed))
+            self._unit_masks[target_unit] = mask
+        return mask
+
     def search(self, query: str, discipline: str = None, top_k: int = 5, target_unit: str = None) -> List[Dict]:
         """
         クエリに類似したKB項目を検索（同義語展開・単位リランキング付き）
@@ -609,64 +869,93 @@ class VectorKBSearch:
         Returns:
             類似KB項目のリスト（スコア付き）
         """
-        if not self.model or not self.index or self.index.ntotal == 0:
-            return []
+        return self.search_batch([query], [discipline], [target_unit], top_k=top_k)[0]
 
-        try:
-            # 同義語展開
-            expanded_query = self._expand_query_with_synonyms(query)
-            if expanded_query != query:
-                logger.debug(f"Query expanded: '{query}' -> '{expanded_query}'")
-
-            # クエリをベクトル化（E5モデル用プレフィックス）
-            query_text = f"query: {expanded_query}"
-            query_embedding = self.model.encode([query_text], show_progress_bar=False)
-            query_embedding = np.array(query_embedding).astype('float32')
-            faiss.normalize_L2(query_embedding)
-
-            # 検索（多めに取得してフィルタ後に絞る）
-            search_k = top_k * 3 if discipline else top_k
-            distances, indices = self.index.search(query_embedding, min(search_k, len(self.kb_items)))
-
-            results = []
-            for i, (dist, idx) in enumerate(zip(distances[0], indices[0])):
-                if idx < 0 or idx >= len(self.kb_items):
-                    continue
+    def search_batch(
+        self,
+        queries: List[str],
+        disciplines: List[Optional[str]] = None,
+        target_units: List[Optional[str]] = None,
+        top_k: int = 5,
+    ) -> List[List[Dict]]:
+        """
+        複数クエリをまとめて検索（1回のエンコード・1回のFAISS検索）
 
-                kb_item = self.kb_items[idx]
+        工事区分フィルタと単位一致ボーナスは結果行列に対してまとめて適用します。
+        各クエリの結果は search() と同じ形式で、KB行番号 kb_index を含みます。
 
-                # 工事区分フィルタ
-                if discipline:
-                    kb_discipline = kb_item.get("discipline", "")
-                    if discipline not in kb_discipline and kb_discipline not in discipline:
-                        if kb_discipline != "設備工事":  # 汎用項目は許可
-                            continue
+        Args:
+            queries: 検索クエリのリスト（項目名 + 仕様）
+            disciplines: クエリごとの工事区分フィルタ（Noneでフィルタなし）
+            target_units: クエリごとの希望単位（Noneでボーナスなし）
+            top_k: クエリごとに返す結果数
 
-                # 単位一致ボーナス
-                adjusted_score = float(dist)
-                if target_unit:
-                    kb_unit = kb_item.get("unit", "")
-                    if kb_unit == target_unit or target_unit in kb_unit or kb_unit in target_unit:
-                        adjusted_score += 0.05  # 単位一致で+0.05ボーナス
+        Returns:
+            クエリごとの類似KB項目リスト
+        """
+        n_queries = len(queries)
+        if not n_queries or not self.model or not self.index or self.index.ntotal == 0:
+            return [[] for _ in queries]
+        disciplines = list(disciplines) if disciplines is not None else [None] * n_queries
+        target_units = list(target_units) if target_units is not None else [None] * n_queries
 
-                results.append({
-                    "kb_item": kb_item,
-                    "score": adjusted_score,
-                    "original_score": float(dist),
-                    "rank": len(results) + 1
-                })
+        try:
+            # 同義語展開
+            query_texts = []
+            for query in queries:
+                expanded_query = self._expand_query_with_synonyms(query)
+                if expanded_query != query:
+                    logger.debug(f"Query expanded: '{query}' -> '{expanded_query}'")
+                # E5モデル用プレフィックス
+                query_texts.append(f"query: {expanded_query}")
+
+            # クエリをまとめてベクトル化
+            query_embeddings = self.model.encode(query_texts, show_progress_bar=False)
+            query_embeddings = np.array(query_embeddings).astype('float32')
+            faiss.normalize_L2(query_embeddings)
+
+            # 検索（工事区分フィルタ付きのクエリは多めに取得してフィルタ後に絞る）
+            n_kb = len(self.kb_items)
+            query_k = np.array([min(top_k * 3 if d else top_k, n_kb) for d in disciplines])
+            distances, id_matrix = self.index.search(query_embeddings, int(query_k.max()))
+            rows = self._rows_for_ids(id_matrix)
+            safe_rows = np.where(rows >= 0, rows, 0)
+
+            # 有効な結果: KBに存在し、クエリごとの取得件数内
+            valid = (rows >= 0) & (np.arange(rows.shape[1])[None, :] < query_k[:, None])
+
+            # 工事区分フィルタ・単位一致ボーナス（+0.05）を行列で適用
+            bonus = np.zeros(rows.shape, dtype="float32")
+            for q, (discipline, target_unit) in enumerate(zip(disciplines, target_units)):
+                if discipline:
+                    valid[q] &= self._discipline_mask(discipline)[safe_rows[q]]
+                if target_unit:
+                    bonus[q] = self._unit_mask(target_unit)[safe_rows[q]] * 0.05
+            scores = distances + bonus
 
-            # 単位リランキング: スコアで再ソート
-            if target_unit and len(results) > 1:
-                results.sort(key=lambda x: x["score"], reverse=True)
-                for i, r in enumerate(results):
-                    r["rank"] = i + 1
+            # 単位リランキング: スコアで再ソート（安定ソートで同点はFAISS順を維持）
+            order = np.argsort(np.where(valid, -scores, np.inf), axis=1, kind="stable")
 
-            return results[:top_k]
+            all_results = []
+            for q in range(n_queries):
+                results = []
+                for col in order[q]:
+                    if not valid[q, col] or len(results) >= top_k:
+                        break
+                    idx = int(rows[q, col])
+                    results.append({
+                        "kb_item": self.kb_items[idx],
+                        "kb_index": idx,
+                        "score": float(scores[q, col]),
+                        "original_score": float(distances[q, col]),
+                        "rank": len(results) + 1
+                    })
+                all_results.append(results)
+            return all_results
 
         except Exception as e:
             logger.error(f"Vector search error: {e}")
-            return []
+            return [[] for _ in queries]
 
     def is_available(self) -> bool:
         """ベクトル検索が利用可能かどうか"""
@@ -683,16 +972,26 @@ class AIEstimateGenerator:
 
     def __init__(self, kb_path: str = "kb/price_kb.json", use_vector_search: bool = True, use_cache: bool = True):
         load_dotenv()
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.client = get_llm_gateway()
         self.model_name = os.getenv("CLAUDE_MODEL", "claude-opus-4-5-20251101")
         self.kb_path = kb_path
         self.price_kb = self._load_price_kb()
+        # 文字列マッチング用のKB特徴量（正規化テキスト等）を事前計算（KBスナップショットごとに共有）
+        self._kb_features = get_kb_registry().get_derived(
+            self.kb_path, "kb_features", lambda items: KBFeatureTable(items, SYNONYM_DICT)
+        )
 
         # キャッシュ設定
         self.use_cache = use_cache
         self.cache_dir = Path("cache/estimates")
         if use_cache:
             self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.stage_cache = StageCache("cache/stages", enabled=use_cache)
+
+        # 項目が生成されるたびに呼ぶコールバック（画面への逐次表示など。Noneで呼ばない）
+        self.on_item_generated: Optional[Callable[[EstimateItem], None]] = None
+        # on_item_generated で渡した項目を取り消すコールバック（応答全体を読み直して項目が変わった場合。引数は取り消す項目）
+        self.on_items_reset: Optional[Callable[[List[EstimateItem]], None]] = None
 
         # ベクトル検索の初期化
         self.vector_search = None
@@ -701,12 +1000,8 @@ class AIEstimateGenerator:
             self._init_vector_search()
 
     def _load_price_kb(self) -> List[Dict]:
-        """価格KBを読み込み"""
-        if os.path.exists(self.kb_path):
-            with open(self.kb_path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        logger.warning(f"Price KB not found: {self.kb_path}")
-        return []
+        """価格KBを読み込み（プロセス共通の読み取り専用スナップショット）"""
+        return get_kb_registry().get_kb(self.kb_path)
 
     def _get_pdf_hash(self, pdf_path: str) -> str:
         """PDFファイルのハッシュを計算（キャッシュキー用）"""
@@ -752,20 +1047,117 @@ class AIEstimateGenerator:
         except Exception as e:
             logger.warning(f"Cache write error: {e}")
 
+    def _run_cached_stage(self, pdf_hash: str, stage: str, compute):
+        """
+        ステージを実行（キャッシュがあればAPIを呼ばずに復元）
+
+        Args:
+            pdf_hash: 仕様書PDFのハッシュ
+            stage: ステージ名（PROMPT_VERSIONS のキー）
+            compute: キャッシュがない場合に結果を計算する関数
+
+        Returns:
+            ステージの結果（空の結果はキャッシュしない）
+        """
+        prompt_version = PROMPT_VERSIONS[stage]
+        cached = self.stage_cache.get(pdf_hash, stage, prompt_version, self.model_name)
+        if cached is not None:
+            return cached
+        result = compute()
+        self.stage_cache.put(pdf_hash, stage, prompt_version, self.model_name, result)
+        return result
+
+    def _run_extraction_stages(self, spec_pdf_path: str) -> Dict[str, Any]:
+        """
+        仕様書の抽出ステージを並列実行
+
+        テキスト抽出の後に建物情報・諸元表・設備数量の抽出を、PDFのみに依存する
+        Vision諸元表・図面の抽出はテキスト抽出と同時に実行します。
+        各ステージの結果はPDFハッシュ単位でキャッシュします（同じ仕様書の再実行ではAPIを呼ばない）。
+
+        Returns:
+            ステージ名 → 結果 の辞書
+        """
+        pdf_hash = self._get_pdf_hash(spec_pdf_path)
+
+        def stage(name, compute):
+            return lambda **deps: self._run_cached_stage(pdf_hash, name, lambda: compute(**deps))
+
+        runner = StageRunner()
+        # キャッシュから復元したテキストもページ配列付き（PagedText）で後続ステージに渡す
+        spec_text_stage = stage("spec_text", lambda: self.extract_text_from_pdf(spec_pdf_path))
+        runner.add("spec_text", lambda: PagedText.parse(spec_text_stage()))
+        # 建物情報・設備数量の抽出は仕様書の先頭ブロック（プロンプトキャッシュ）を共有する。
+        # 同時に始めると両方がキャッシュを書き込む（入力料金の1.25倍）ため、先に1回だけ書き込んでから並列に実行する
+        prefix_deps = ["spec_text"]
+        prefix_stages = ("building_info", "equipment_quantities")
+        if not any(self._is_stage_cached(pdf_hash, name) for name in prefix_stages):
+            runner.add("spec_prefix", lambda spec_text: self._warm_spec_prefix(spec_text), depends_on=["spec_text"])
+            prefix_deps.append("spec_prefix")
+        runner.add(
+            "building_info",
+            stage("building_info", lambda spec_text, **_: self.extract_building_info(spec_text)),
+            depends_on=prefix_deps,
+        )
+        runner.add(
+            "spec_tables",
+            stage("spec_tables", lambda spec_text: self.extract_specification_tables(spec_pdf_path, spec_text)),
+            depends_on=["spec_text"],
+        )
+        if HAS_PYMUPDF:
+            runner.add(
+                "spec_table_vision",
+                stage("spec_table_vision", lambda: self.extract_specification_table_with_vision(spec_pdf_path)),
+            )
+            runner.add("drawing_info", stage("drawing_info", lambda: self.extract_drawing_info(spec_pdf_path)))
+        runner.add(
+            "equipment_quantities",
+            stage("equipment_quantities", lambda spec_text, **_: self.extract_equipment_quantities(spec_text)),
+            depends_on=prefix_deps,
+        )
+        return runner.run()
+
+    def _is_stage_cached(self, pdf_hash: str, stage: str) -> bool:
+        """ステージの結果がキャッシュにあるか"""
+        return self.stage_cache.get(pdf_hash, stage, PROMPT_VERSIONS[stage], self.model_name) is not None
+
+    def _warm_spec_prefix(self, spec_text: str):
+        """
+        仕様書の先頭ブロックをプロンプトキャッシュに書き込む（出力1トークンの呼び出し）
+
+        失敗しても後続の抽出は行えるため、警告のみ出して続行します。
+        """
+        try:
+            self.client.messages.create(
+                model=self.model_name,
+                max_tokens=1,
+                messages=self._spec_context_messages(spec_text, "「OK」とだけ回答してください。"),
+                operation="仕様書プロンプトキャッシュ準備",
+                cost_metadata={"source": "warm_spec_prefix"}
+            )
+        except Exception as e:
+            logger.warning(f"Failed to warm spec prompt cache: {e}")
+
     def _init_vector_search(self):
-        """ベクトル検索インデックスを初期化"""
+        """ベクトル検索インデックスを初期化（KBスナップショットごとにプロセス内で共有）"""
+        kb_path = self.kb_path
+        self.vector_search = get_kb_registry().get_derived(
+            kb_path, "vector_search", lambda kb_items: self._build_vector_search(kb_items, kb_path)
+        )
+
+    @staticmethod
+    def _build_vector_search(kb_items: List[Dict], kb_path: Optional[str] = None) -> Optional[VectorKBSearch]:
+        """ベクトル検索インデックスを構築（失敗時はNone）"""
         logger.info("Initializing vector search for KB...")
-        self.vector_search = VectorKBSearch()
-        if self.vector_search.model:
-            success = self.vector_search.build_index(self.price_kb)
-            if success:
-                logger.info(f"Vector search ready: {len(self.price_kb)} KB items indexed")
-            else:
-                logger.warning("Vector search index build failed - using fallback")
-                self.vector_search = None
-        else:
+        vector_search = VectorKBSearch(kb_path=kb_path)
+        if not vector_search.model:
             logger.warning("Vector search model not loaded - using fallback")
-            self.vector_search = None
+            return None
+        if not vector_search.build_index(kb_items):
+            logger.warning("Vector search index build failed - using fallback")
+            return None
+        logger.info(f"Vector search ready: {len(kb_items)} KB items indexed")
+        return vector_search
 
     def generate_items_from_template(
         self,
@@ -1075,37 +1467,135 @@ class AIEstimateGenerator:
         Returns:
             最良マッチのKB項目とスコア、またはNone
         """
-        if not self.vector_search or not self.vector_search.is_available():
-            return None
+        return self._vector_search_match_batch([(item_name, item_spec, discipline, target_unit)])[0]
 
-        # クエリ生成
-        query = f"{item_name} {item_spec}".strip()
-        if not query:
-            return None
+    def _vector_search_match_batch(self, queries: List[tuple]) -> List[Optional[Dict]]:
+        """
+        複数項目のベクトル検索マッチングをまとめて実行
 
-        # ベクトル検索実行（単位リランキング付き）
-        results = self.vector_search.search(query, discipline=discipline, top_k=5, target_unit=target_unit)
+        Args:
+            queries: (項目名, 仕様, 工事区分, 希望単位) のリスト
 
-        if not results:
-            return None
+        Returns:
+            項目ごとの最良マッチ（なければNone）
+        """
+        matches: List[Optional[Dict]] = [None] * len(queries)
+        if not self.vector_search or not self.vector_search.is_available():
+            return matches
+
+        # クエリ生成（空クエリは検索しない）
+        positions = []
+        query_texts = []
+        for i, (item_name, item_spec, _, _) in enumerate(queries):
+            query = f"{item_name} {item_spec or ''}".strip()
+            if query:
+                positions.append(i)
+                query_texts.append(query)
+        if not positions:
+            return matches
+
+        # ベクトル検索実行（単位リランキング付き）
+        all_results = self.vector_search.search_batch(
+            query_texts,
+            disciplines=[queries[i][2] for i in positions],
+            target_units=[queries[i][3] for i in positions],
+            top_k=5,
+        )
+        kb_is_broad = self._kb_broad_mask()
 
-        # 結果をフィルタリング（広すぎるマッチを除外）
-        for result in results:
-            if result["score"] < 0.3:
+        for i, query, results in zip(positions, query_texts, all_results):
+            if not results:
                 continue
+            item_name = queries[i][0]
+
+            # 結果をフィルタリング（スコア不足・広すぎるマッチを除外）
+            scores = np.array([r["score"] for r in results])
+            accepted = scores >= 0.3
+            if any(kw in item_name for kw in SPECIFIC_WORK_KEYWORDS):
+                broad = kb_is_broad[[r["kb_index"] for r in results]]
+                for r in np.array(results, dtype=object)[accepted & broad]:
+                    logger.debug(f"Skipping too broad match: '{item_name}' → '{r['kb_item'].get('description', '')}'")
+                accepted &= ~broad
+
+            if accepted.any():
+                result = results[int(np.argmax(accepted))]
+                logger.debug(f"Vector match: '{query}' → '{result['kb_item'].get('description', '')}' "
+                           f"(score={result['score']:.3f})")
+                matches[i] = result
+
+        return matches
+
+    def _batch_vector_results(self, estimate_items: List[EstimateItem], use_discipline: bool) -> List[Optional[Dict]]:
+        """見積項目リストのベクトル検索結果をまとめて取得（親項目はNone）"""
+        targets = [i for i, item in enumerate(estimate_items) if item.level != 0]
+        matches = self._vector_search_match_batch([
+            (
+                estimate_items[i].name,
+                estimate_items[i].specification or "",
+                estimate_items[i].discipline.value if use_discipline else None,
+                estimate_items[i].unit,  # 単位リランキング用
+            )
+            for i in targets
+        ])
+        results: List[Optional[Dict]] = [None] * len(estimate_items)
+        for i, match in zip(targets, matches):
+            results[i] = match
+        return results
+
+    def _best_unit_only_row(
+        self,
+        kb_features: KBFeatureTable,
+        candidate_set: set,
+        item: EstimateItem,
+        discipline_compatible: Dict[str, bool],
+        unit_scores: Dict[tuple, Optional[float]],
+    ) -> Optional[tuple]:
+        """
+        候補外のKB行のうち、単位一致スコアが最大で最も前にある行を取得
 
-            kb_item = result["kb_item"]
-            kb_desc = kb_item.get("description", "")
+        候補外の行は項目名・仕様・カテゴリのスコアが0のため、スコアは単位一致分のみです。
 
-            # 広すぎるマッチを除外
-            if self._is_too_broad_match(item_name, kb_desc):
-                logger.debug(f"Skipping too broad match: '{item_name}' → '{kb_desc}'")
+        Returns:
+            (スコア, 行番号)。該当なしはNone
+        """
+        best = None
+        for (kb_discipline, kb_unit, kb_unit_norm), group_rows in kb_features.unit_groups.items():
+            compatible = discipline_compatible.get(kb_discipline)
+            if compatible is None:
+                compatible = self._is_discipline_compatible(kb_discipline, item.discipline.value)
+                discipline_compatible[kb_discipline] = compatible
+            if not compatible:
                 continue
 
-            logger.debug(f"Vector match: '{query}' → '{kb_desc}' (score={result['score']:.3f})")
-            return result
+            unit_key = (kb_unit, kb_unit_norm)
+            if unit_key not in unit_scores:
+                unit_scores[unit_key] = self._unit_match_score(item.unit, kb_unit, kb_unit_norm)
+            unit_score = unit_scores[unit_key]
+            if not unit_score or (best and unit_score < best[0]):
+                continue
 
-        return None
+            row_index = next((r for r in group_rows if r not in candidate_set), None)
+            if row_index is None:
+                continue
+            if best is None or unit_score > best[0] or row_index < best[1]:
+                best = (unit_score, row_index)
+        return best
+
+    def _kb_broad_mask(self) -> "np.ndarray":
+        """KB項目ごとの「広い項目（○○設備工事など）」フラグ（ベクトル検索のKBに対応）"""
+        kb_items = self.vector_search.kb_items
+        cached = getattr(self, "_kb_broad_cache", None)
+        if cached is None or cached[0] is not kb_items:
+            mask = np.array([self._is_broad_kb_name(item.get("description", "")) for item in kb_items], dtype=bool)
+            cached = (kb_items, mask)
+            self._kb_broad_cache = cached
+        return cached[1]
+
+    @staticmethod
+    def _is_broad_kb_name(kb_name: str) -> bool:
+        """KB側が「○○設備工事」のような広い項目かチェック"""
+        return any(pattern in kb_name for pattern in BROAD_KB_PATTERNS) and \
+               not any(kw in kb_name for kw in SPECIFIC_WORK_KEYWORDS)
 
     def _is_too_broad_match(self, item_name: str, kb_name: str) -> bool:
         """
@@ -1113,18 +1603,10 @@ class AIEstimateGenerator:
 
         例: 「空調設備配管工事」→「空調設備工事」は広すぎる
         """
-        # 具体的な作業を示すキーワード
-        specific_keywords = ["配管", "器具", "機器", "配線", "取付", "撤去", "試験", "調整"]
-
-        # KB側が「○○設備工事」のような広い項目かチェック
-        broad_patterns = ["設備工事", "工事一式", "設備一式"]
-
-        item_has_specific = any(kw in item_name for kw in specific_keywords)
-        kb_is_broad = any(pattern in kb_name for pattern in broad_patterns) and \
-                      not any(kw in kb_name for kw in specific_keywords)
+        item_has_specific = any(kw in item_name for kw in SPECIFIC_WORK_KEYWORDS)
 
         # 見積項目が具体的で、KB項目が広い場合は除外
-        if item_has_specific and kb_is_broad:
+        if item_has_specific and self._is_broad_kb_name(kb_name):
             return True
 
         return False
@@ -1180,29 +1662,13 @@ class AIEstimateGenerator:
         Returns:
             類義語リスト（元の項目名を含む）
         """
-        synonyms = [item_name]
-
-        # 正規化した項目名
-        item_name_norm = self._normalize_text(item_name)
-
-        for key, values in SYNONYM_DICT.items():
-            key_norm = self._normalize_text(key)
-
-            # キーが項目名に含まれる、または項目名がキーに含まれる
-            if key_norm in item_name_norm or item_name_norm in key_norm:
-                synonyms.extend(values)
-                synonyms.append(key)
-                continue
-
-            # 類義語が項目名に含まれる
-            for value in values:
-                value_norm = self._normalize_text(value)
-                if value_norm in item_name_norm or item_name_norm in value_norm:
-                    synonyms.append(key)
-                    synonyms.extend(values)
-                    break
+        return self._get_kb_features().find_synonyms(item_name)
 
-        return list(set(synonyms))
+    def _get_kb_features(self) -> KBFeatureTable:
+        """KB特徴量テーブルを取得（price_kbが差し替えられていれば作り直す）"""
+        if not self._kb_features.is_for(self.price_kb):
+            self._kb_features = KBFeatureTable(self.price_kb, SYNONYM_DICT)
+        return self._kb_features
 
     def _validate_price(self, item_name: str, matched_price: float) -> bool:
         """
@@ -1396,34 +1862,130 @@ class AIEstimateGenerator:
             model=self.model_name,
             max_tokens=max_tokens,
             temperature=0,
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        # コスト記録
-        record_cost(
+            messages=[{"role": "user", "content": prompt}],
             operation=operation,
-            model_name=self.model_name,
-            input_tokens=response.usage.input_tokens,
-            output_tokens=response.usage.output_tokens,
-            metadata=metadata or {}
+            cost_metadata=metadata or {}
         )
 
         return response
 
+    @staticmethod
+    def _spec_context_messages(spec_text: str, instructions: str,
+                               max_chars: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        仕様書を先頭のブロック、指示をその後のブロックに置いたメッセージ
+
+        仕様書のブロックには cache_control を付けます。建物情報・設備数量の抽出と
+        工事区分ごとの項目生成で先頭が同じになるため、同じ仕様書の2回目以降の呼び出しでは
+        仕様書部分をプロンプトキャッシュから読み込みます（入力料金の0.1倍）。
+
+        Args:
+            spec_text: 仕様書テキスト
+            instructions: 指示
+            max_chars: 先頭ブロックを共有しない呼び出しの仕様書の文字数
+                （指定した場合はその文字数までを含め、cache_control を付けない）
+        """
+        shared = max_chars is None
+        spec_block = SPEC_CONTEXT_TEMPLATE.format(
+            spec_text=str(spec_text)[:SPEC_CONTEXT_MAX_CHARS if shared else max_chars] or "仕様書テキストなし"
+        )
+        spec_content = {"type": "text", "text": spec_block}
+        if shared:
+            spec_content["cache_control"] = {"type": "ephemeral"}
+        return [{
+            "role": "user",
+            "content": [spec_content, {"type": "text", "text": instructions}]
+        }]
+
+    def _stream_estimate_items(
+        self,
+        messages: List[Dict[str, Any]],
+        to_item: Callable[[Dict[str, Any]], EstimateItem],
+        operation: str,
+        cost_metadata: Dict[str, Any],
+        max_tokens: int = 16000
+    ) -> Tuple[List[EstimateItem], str]:
+        """
+        項目のJSON配列をストリーミングで生成し、要素が閉じるたびに EstimateItem に変換
+
+        変換した項目ごとに on_item_generated を呼びます。逐次パースで項目を取り出せなかった場合
+        （配列以外の形式で回答された場合など）や壊れた要素があった場合は、
+        応答全体を extract_json_array_robust（JSONの修復付き）で読み直します。
+        壊れた要素の後の項目は、読み直した結果が決まってから on_item_generated を呼びます。
+        すでに渡した項目が最終結果と異なる場合は、on_items_reset で取り消してから渡し直します。
+
+        Args:
+            messages: メッセージ
+            to_item: 応答の項目（dict）を EstimateItem に変換する関数
+            operation: コスト記録の処理名
+            cost_metadata: コスト記録のメタデータ
+            max_tokens: 出力トークン数の上限
+
+        Returns:
+            (項目のリスト, 応答テキスト全体)
+        """
+        parser = JSONArrayStreamParser()
+        items: List[EstimateItem] = []
+        shown: List[EstimateItem] = []
+        chunks: List[str] = []
+
+        def notify(item: EstimateItem):
+            shown.append(item)
+            if self.on_item_generated is not None:
+                try:
+                    self.on_item_generated(item)
+                except Exception as e:
+                    logger.warning(f"on_item_generated callback failed: {e}")
+
+        for text in self.client.stream_text(
+            model=self.model_name,
+            max_tokens=max_tokens,
+            temperature=0,
+            messages=messages,
+            operation=operation,
+            cost_metadata=cost_metadata
+        ):
+            chunks.append(text)
+            for item_data in parser.feed(text):
+                items.append(to_item(item_data))
+                # 壊れた要素の後は、応答全体を読み直した結果で置き換わる場合があるため、ここでは渡さない
+                if not parser.errors:
+                    notify(items[-1])
+
+        response_text = "".join(chunks)
+        if not items:
+            items = [to_item(item_data) for item_data in extract_json_array_robust(response_text)
+                     if isinstance(item_data, dict)]
+        elif parser.errors:
+            # 壊れた要素は逐次パースでは読み飛ばすため、修復してパースできる応答全体の結果を使う
+            repaired = [to_item(item_data) for item_data in extract_json_array_robust(response_text)
+                        if isinstance(item_data, dict)]
+            logger.info(f"{operation}: {parser.errors} malformed items in stream, "
+                        f"re-parsed response ({len(items)} -> {len(repaired)} items)")
+            if len(repaired) >= len(items):
+                items = repaired
+
+        if items[:len(shown)] != shown:
+            # 渡した項目が最終結果と異なる場合は取り消してから渡し直す
+            if self.on_items_reset is not None:
+                try:
+                    self.on_items_reset(list(shown))
+                except Exception as e:
+                    logger.warning(f"on_items_reset callback failed: {e}")
+            shown.clear()
+        for item in items[len(shown):]:
+            notify(item)
+        return items, response_text
+
     def extract_text_from_pdf(self, pdf_path: str, max_pages: int = None) -> str:
         """PDFからテキストを抽出（ページ番号マーカー付き）。スキャンPDFの場合はOCRを使用"""
         logger.info(f"Extracting text from PDF: {pdf_path}")
 
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                total_pages = len(pdf_reader.pages) if max_pages is None else min(len(pdf_reader.pages), max_pages)
-                for page_num in range(total_pages):
-                    page_text = pdf_reader.pages[page_num].extract_text()
-                    # ページ番号マーカーを追加（セクション特定用）
-                    text += f"\n[PAGE {page_num + 1}/{total_pages}]\n"
-                    text += page_text + "\n"
+            pdf = open_pdf(pdf_path)
+            total_pages = pdf.page_count if max_pages is None else min(pdf.page_count, max_pages)
+            # ページ番号マーカーを追加（セクション特定用）
+            text = pdf.paged_text(1, total_pages, marker="[PAGE {page}/{total}]")
 
             logger.info(f"Extracted {len(text)} characters from {total_pages} pages")
 
@@ -1442,66 +2004,48 @@ class AIEstimateGenerator:
             return ""
 
     def _extract_text_with_ocr(self, pdf_path: str, max_pages: int = 10) -> str:
-        """Vision APIを使用してスキャンPDFからテキストを抽出"""
+        """
+        Vision APIを使用してスキャンPDFからテキストを抽出
+
+        ページの画像化とVision API呼び出しを重ねてページ間で並列に実行します
+        （同時実行数は VISION_PAGE_CONCURRENCY）。結果はページ順に結合します。
+        """
         logger.info(f"Extracting text with OCR (Vision API) from first {max_pages} pages")
 
         try:
-            import fitz  # PyMuPDF
-            doc = fitz.open(pdf_path)
-            all_text = ""
-
-            pages_to_process = min(len(doc), max_pages)
-            for page_num in range(pages_to_process):
-                page = doc[page_num]
+            pages_to_process = min(open_pdf(pdf_path).page_count, max_pages)
 
-                # ページを画像に変換
-                mat = fitz.Matrix(150/72, 150/72)  # 150 DPI
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
+            def ocr_page(page_no: int, rendered: RenderedPage) -> str:
+                """1ページ分をVision APIでテキスト化（ワーカースレッドで実行）"""
+                image_block = rendered.to_content_block()
 
-                # Base64エンコード
-                import base64
-                img_base64 = base64.b64encode(img_data).decode('utf-8')
-
-                # Vision APIでテキスト抽出
                 response = self.client.messages.create(
                     model=self.model_name,
                     max_tokens=8000,
                     messages=[{
                         "role": "user",
                         "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": img_base64
-                                }
-                            },
+                            image_block,
                             {
                                 "type": "text",
                                 "text": "この画像のテキストを全て読み取ってください。表形式のデータも含めて、できるだけ正確に文字起こししてください。装飾や書式は不要です。"
                             }
                         ]
-                    }]
+                    }],
+                    operation=f"OCRテキスト抽出(page {page_no})",
+                    cost_metadata={"source": "ocr_text_extraction", "page": page_no}
                 )
 
                 page_text = response.content[0].text
-                all_text += f"\n[PAGE {page_num + 1}/{pages_to_process}]\n"
-                all_text += page_text + "\n"
-
-                # コスト記録
-                record_cost(
-                    operation=f"OCRテキスト抽出(page {page_num + 1})",
-                    model_name=self.model_name,
-                    input_tokens=response.usage.input_tokens,
-                    output_tokens=response.usage.output_tokens,
-                    metadata={"source": "ocr_text_extraction", "page": page_num + 1}
-                )
 
-                logger.info(f"OCR page {page_num + 1}: {len(page_text)} chars")
+                logger.info(f"OCR page {page_no}: {len(page_text)} chars")
+                return page_text
+
+            # ページを1枚ずつ画像化しながら並列にOCR（解像度・切り出しはページの内容に応じて RenderPolicy が決める）
+            pages = iter_rendered_pages(pdf_path, page_numbers=range(1, pages_to_process + 1))
+            page_texts = run_page_pipeline(pages, ocr_page)
 
-            doc.close()
+            all_text = PagedText.from_pages(page_texts, marker="[PAGE {page}/{total}]", total=pages_to_process)
             logger.info(f"OCR extraction complete: {len(all_text)} characters from {pages_to_process} pages")
             return all_text
 
@@ -1514,13 +2058,7 @@ class AIEstimateGenerator:
         logger.info(f"Extracting text from pages {start_page}-{end_page}: {pdf_path}")
 
         try:
-            with open(pdf_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                for page_num in range(start_page - 1, min(end_page, len(pdf_reader.pages))):
-                    page_text = pdf_reader.pages[page_num].extract_text()
-                    text += f"\n[PAGE {page_num + 1}]\n"
-                    text += page_text + "\n"
+            text = open_pdf(pdf_path).paged_text(start_page, end_page, marker="[PAGE {page}]")
 
             logger.info(f"Extracted {len(text)} characters from pages {start_page}-{end_page}")
             return text
@@ -1530,20 +2068,11 @@ class AIEstimateGenerator:
 
     def detect_specification_table_pages(self, spec_text: str) -> List[int]:
         """諸元表が含まれるページを検出"""
-        table_keywords = ["諸元表", "室名", "床面積", "天井高", "空調", "給排水", "ガス栓"]
+        table_keywords = SPEC_TABLE_KEYWORDS
         pages = []
 
-        # ページマーカーで分割
-        import re
-        page_pattern = r'\[PAGE (\d+)(?:/\d+)?\]'
-        page_splits = re.split(page_pattern, spec_text)
-
-        for i in range(1, len(page_splits), 2):
-            page_num = int(page_splits[i])
-            page_content = page_splits[i + 1] if i + 1 < len(page_splits) else ""
-
-            # キーワードマッチでページを検出
-            keyword_count = sum(1 for kw in table_keywords if kw in page_content)
+        # ページ配列に対してキーワードマッチ（キャッシュ由来の文字列はマーカーから1回だけ分割）
+        for page_num, keyword_count in PagedText.parse(spec_text).keyword_hits(table_keywords):
             if keyword_count >= 3:  # 3つ以上のキーワードがあれば諸元表ページ
                 pages.append(page_num)
                 logger.info(f"Detected specification table on page {page_num} (keywords: {keyword_count})")
@@ -1566,9 +2095,12 @@ class AIEstimateGenerator:
         table_pages = self.detect_specification_table_pages(spec_text)
 
         if not table_pages:
-            # キーワード検出できない場合、典型的なページ範囲を試行（後半ページ）
-            logger.info("No table pages detected by keywords, trying pages 35-45")
-            table_pages = list(range(35, 46))
+            # キーワード検出できない場合、罫線の格子などからページ分類で選ぶ（API呼び出しなし）
+            table_pages = select_spec_table_pages(open_pdf(pdf_path).all_page_features())
+            if not table_pages:
+                logger.warning("No specification table pages detected")
+                return {"rooms": [], "equipment_summary": {}}
+            logger.info(f"No table pages detected by keywords, using classified pages {table_pages}")
 
         # 該当ページのテキストを抽出
         table_text = self.extract_text_from_pages(pdf_path, min(table_pages), max(table_pages))
@@ -1621,16 +2153,9 @@ class AIEstimateGenerator:
             model=self.model_name,
             max_tokens=16000,
             temperature=0,
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        # コスト記録
-        record_cost(
+            messages=[{"role": "user", "content": prompt}],
             operation="諸元表テキスト抽出",
-            model_name=self.model_name,
-            input_tokens=response.usage.input_tokens,
-            output_tokens=response.usage.output_tokens,
-            metadata={"source": "extract_specification_table"}
+            cost_metadata={"source": "extract_specification_table"}
         )
 
         response_text = response.content[0].text
@@ -1667,9 +2192,13 @@ class AIEstimateGenerator:
         """
         諸元表ページを画像として抽出し、Claude Vision APIで構造化データに変換
 
+        テキストレイヤーのあるページは、罫線と単語の位置から表を再構成して（spec_table_parser）
+        ローカルで抽出し、信頼度が LOCAL_TABLE_MIN_CONFIDENCE 未満のページだけをVisionに送ります。
+        ページごとの rooms は室名・階で統合してから totals を集計します。
+
         Args:
             pdf_path: PDFファイルパス
-            target_pages: 諸元表のページ番号リスト（1-indexed）。Noneの場合は39-40を使用
+            target_pages: 諸元表のページ番号リスト（1-indexed）。Noneの場合はページ分類で選定
 
         Returns:
             {
@@ -1681,7 +2210,9 @@ class AIEstimateGenerator:
                     "room_count": 50,
                     "gas_outlet_total": 38,
                     "electrical_outlet_total": 200
-                }
+                },
+                "local_pages": [39, 40],  # ローカルで抽出したページ
+                "vision_pages": []        # Visionで抽出したページ
             }
         """
         if not HAS_PYMUPDF:
@@ -1689,33 +2220,40 @@ class AIEstimateGenerator:
             return {"rooms": [], "totals": {}}
 
         if target_pages is None:
-            target_pages = [39, 40]  # デフォルトは諸元表のページ
+            # キーワード・罫線の格子からスコアの高いページだけをVisionに送る
+            target_pages = select_spec_table_pages(open_pdf(pdf_path).all_page_features())
+            if not target_pages:
+                logger.warning("No specification table pages detected - skipping Vision extraction")
+                return {"rooms": [], "totals": {}}
 
-        logger.info(f"Extracting specification tables with Vision from pages {target_pages}")
+        logger.info(f"Extracting specification tables from pages {target_pages}")
 
         try:
-            doc = fitz.open(pdf_path)
-            all_rooms = []
-            totals = {
-                "room_count": 0,
-                "gas_outlet_total": 0,
-                "electrical_outlet_total": 0,
-                "total_area_m2": 0
-            }
+            pdf = open_pdf(pdf_path)
+            room_lists = []
+            local_pages = []
+            vision_pages = []
 
+            # テキストレイヤーから表を再構成できたページはVisionを使わない
             for page_num in target_pages:
-                if page_num > len(doc):
+                if page_num > pdf.page_count:
                     continue
+                local = extract_spec_table_page(pdf, page_num)
+                if local.confidence >= LOCAL_TABLE_MIN_CONFIDENCE:
+                    room_lists.append(local.rooms)
+                    local_pages.append(page_num)
+                    logger.info(f"Page {page_num}: Extracted {len(local.rooms)} room types from text layer "
+                                f"(confidence {local.confidence:.2f})")
+                else:
+                    vision_pages.append(page_num)
 
-                page = doc[page_num - 1]  # 0-indexed
+            if vision_pages:
+                logger.info(f"Extracting specification tables with Vision from pages {vision_pages}")
 
-                # ページを高解像度画像に変換
-                mat = fitz.Matrix(200/72, 200/72)  # 200 DPI
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
+            for page_num in vision_pages:
 
-                # Base64エンコード
-                image_base64 = base64.b64encode(img_data).decode('utf-8')
+                # ページを画像に変換（表は高解像度、余白は切り出して除く）
+                image_block = DEFAULT_RENDER_POLICY.render(pdf, page_num).to_content_block()
 
                 # Claude Vision APIで表を解析
                 prompt = """この画像は建物仕様書の諸元表（部屋一覧表）です。
@@ -1767,26 +2305,12 @@ class AIEstimateGenerator:
                         messages=[{
                             "role": "user",
                             "content": [
-                                {
-                                    "type": "image",
-                                    "source": {
-                                        "type": "base64",
-                                        "media_type": "image/png",
-                                        "data": image_base64
-                                    }
-                                },
+                                image_block,
                                 {"type": "text", "text": prompt}
                             ]
-                        }]
-                    )
-
-                    # コスト記録
-                    record_cost(
+                        }],
                         operation="諸元表Vision抽出",
-                        model_name=self.model_name,
-                        input_tokens=response.usage.input_tokens,
-                        output_tokens=response.usage.output_tokens,
-                        metadata={"source": "extract_specification_table_with_vision", "page": page_num}
+                        cost_metadata={"source": "extract_specification_table_with_vision", "page": page_num}
                     )
 
                     content = response.content[0].text
@@ -1802,15 +2326,7 @@ class AIEstimateGenerator:
                     if json_start != -1 and json_end > json_start:
                         page_data = json.loads(content[json_start:json_end])
                         rooms = page_data.get("rooms", [])
-                        all_rooms.extend(rooms)
-
-                        # 集計
-                        page_totals = page_data.get("page_totals", {})
-                        for room in rooms:
-                            count = room.get("count", 1) or 1
-                            totals["room_count"] += count
-                            totals["gas_outlet_total"] += (room.get("gas_outlets", 0) or 0) * count
-                            totals["electrical_outlet_total"] += (room.get("electrical_outlets", 0) or 0) * count
+                        room_lists.append(rooms)
 
                         logger.info(f"Page {page_num}: Extracted {len(rooms)} room types")
 
@@ -1821,29 +2337,35 @@ class AIEstimateGenerator:
                     logger.warning(f"Failed to process page {page_num}: {e}")
                     continue
 
-            doc.close()
+            # 建築・機械設備と電気設備でページが分かれるため、同じ部屋を統合してから集計
+            all_rooms = merge_rooms(room_lists)
+            totals = summarize_rooms(all_rooms)
 
-            logger.info(f"Vision extraction complete: {len(all_rooms)} room types, "
+            logger.info(f"Specification table extraction complete: {len(all_rooms)} room types, "
                        f"{totals['room_count']} total rooms, "
-                       f"{totals['gas_outlet_total']} gas outlets")
+                       f"{totals['gas_outlet_total']} gas outlets "
+                       f"(local pages {local_pages}, Vision pages {vision_pages})")
 
             return {
                 "rooms": all_rooms,
-                "totals": totals
+                "totals": totals,
+                "local_pages": local_pages,
+                "vision_pages": vision_pages
             }
 
         except Exception as e:
             logger.error(f"Error in Vision extraction: {e}")
             return {"rooms": [], "totals": {}}
 
-    def extract_drawing_info(self, pdf_path: str, start_page: int = 41, end_page: int = 49) -> Dict[str, Any]:
+    def extract_drawing_info(self, pdf_path: str, start_page: Optional[int] = None,
+                             end_page: Optional[int] = None) -> Dict[str, Any]:
         """
         図面ページから設備情報を抽出（Claude Vision API使用）
 
         Args:
             pdf_path: PDFファイルパス
-            start_page: 図面開始ページ（1-indexed）
-            end_page: 図面終了ページ（1-indexed）
+            start_page: 図面開始ページ（1-indexed）。start_page・end_page ともNoneの場合はページ分類で選定
+            end_page: 図面終了ページ（1-indexed）。Noneで最終ページまで
 
         Returns:
             {
@@ -1856,10 +2378,20 @@ class AIEstimateGenerator:
             logger.warning("PyMuPDF not available - skipping drawing extraction")
             return {"pipe_routes": [], "equipment_locations": [], "estimated_pipe_lengths": {}}
 
-        logger.info(f"Extracting drawing information from pages {start_page}-{end_page}")
-
         try:
-            doc = fitz.open(pdf_path)
+            pdf = open_pdf(pdf_path)
+            if start_page is None and end_page is None:
+                # ベクター描画・画像の占有率・図面キーワードからスコアの高いページを選ぶ
+                drawing_pages = select_drawing_pages(pdf.all_page_features())
+                if not drawing_pages:
+                    logger.warning("No drawing pages detected - skipping drawing extraction")
+                    return {"pipe_routes": [], "equipment_locations": [], "estimated_pipe_lengths": {}}
+            else:
+                last_page = pdf.page_count if end_page is None else min(end_page, pdf.page_count)
+                # 最大 DRAWING_MAX_PAGES ページに制限してAPI呼び出しを節約
+                drawing_pages = list(range(start_page or 1, last_page + 1))[:DRAWING_MAX_PAGES]
+
+            logger.info(f"Extracting drawing information from pages {drawing_pages}")
             drawing_info = {
                 "pipe_routes": [],
                 "equipment_locations": [],
@@ -1867,19 +2399,11 @@ class AIEstimateGenerator:
                 "drawing_types": []
             }
 
-            # 図面ページを処理（最大5ページに制限してAPI呼び出しを節約）
-            pages_to_process = list(range(start_page - 1, min(end_page, len(doc))))[:5]
+            pages_to_process = [page - 1 for page in drawing_pages]
 
             for page_num in pages_to_process:
-                page = doc[page_num]
-
-                # ページを画像に変換
-                mat = fitz.Matrix(150/72, 150/72)  # 150 DPI
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
-
-                # Base64エンコード
-                image_base64 = base64.b64encode(img_data).decode('utf-8')
+                # ページを画像に変換（図面は低めの解像度、余白は切り出して除く）
+                image_block = DEFAULT_RENDER_POLICY.render(pdf, page_num + 1).to_content_block()
 
                 # Claude Vision APIで図面を分析
                 prompt = """この画像は建物の設備図面です。以下の情報を抽出してJSON形式で出力してください：
@@ -1910,26 +2434,12 @@ class AIEstimateGenerator:
                         messages=[{
                             "role": "user",
                             "content": [
-                                {
-                                    "type": "image",
-                                    "source": {
-                                        "type": "base64",
-                                        "media_type": "image/png",
-                                        "data": image_base64
-                                    }
-                                },
+                                image_block,
                                 {"type": "text", "text": prompt}
                             ]
-                        }]
-                    )
-
-                    # コスト記録
-                    record_cost(
+                        }],
                         operation="図面Vision分析",
-                        model_name=self.model_name,
-                        input_tokens=response.usage.input_tokens,
-                        output_tokens=response.usage.output_tokens,
-                        metadata={"source": "extract_drawing_info_with_vision", "page": page_num}
+                        cost_metadata={"source": "extract_drawing_info_with_vision", "page": page_num}
                     )
 
                     content = response.content[0].text
@@ -1956,8 +2466,6 @@ class AIEstimateGenerator:
                     logger.warning(f"Failed to process drawing page {page_num + 1}: {e}")
                     continue
 
-            doc.close()
-
             # 重複を除去
             drawing_info["equipment_locations"] = list(set(drawing_info["equipment_locations"]))
 
@@ -1978,11 +2486,11 @@ class AIEstimateGenerator:
         - 工事条件
         """
         logger.info("Extracting detailed building information")
+        window_pages = PagedText.parse(spec_text).pages_in_window(SPEC_CONTEXT_MAX_CHARS)
+        if window_pages:
+            logger.debug(f"Building info prompt covers pages {window_pages[0]}-{window_pages[-1]}")
 
-        prompt = f"""あなたは建築設備の専門家です。以下の仕様書から、設備設計に必要な建物情報を詳細に抽出してください。
-
-仕様書:
-{spec_text[:60000]}
+        prompt = f"""あなたは建築設備の専門家です。上記の仕様書から、設備設計に必要な建物情報を詳細に抽出してください。
 
 【抽出する情報】
 以下の情報をJSON形式で抽出してください：
@@ -2039,16 +2547,9 @@ class AIEstimateGenerator:
             model=self.model_name,
             max_tokens=16000,
             temperature=0,
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        # コスト記録
-        record_cost(
+            messages=self._spec_context_messages(spec_text, prompt),
             operation="建物情報抽出",
-            model_name=self.model_name,
-            input_tokens=response.usage.input_tokens,
-            output_tokens=response.usage.output_tokens,
-            metadata={"source": "extract_building_info"}
+            cost_metadata={"source": "extract_building_info"}
         )
 
         response_text = response.content[0].text
@@ -2085,10 +2586,7 @@ class AIEstimateGenerator:
         """
         logger.info("Extracting specific equipment quantities from specification")
 
-        prompt = f"""あなたは建築設備の専門家です。以下の仕様書から、具体的な設備数量の記載を抽出してください。
-
-仕様書:
-{spec_text[:40000]}
+        prompt = f"""あなたは建築設備の専門家です。上記の仕様書から、具体的な設備数量の記載を抽出してください。
 
 【抽出する情報】
 仕様書に明記されている設備の数量のみを抽出してください。推測は不要です。
@@ -2129,11 +2627,11 @@ JSON形式で回答:
             response = self.client.messages.create(
                 model=self.model_name,
                 max_tokens=2000,
-                messages=[{"role": "user", "content": prompt}]
+                messages=self._spec_context_messages(spec_text, prompt),
+                operation="設備数量抽出"
             )
 
             response_text = response.content[0].text
-            record_cost("設備数量抽出", self.model_name, response.usage.input_tokens, response.usage.output_tokens)
 
             # JSON抽出
             json_start = response_text.find("{")
@@ -2299,7 +2797,7 @@ JSON形式で回答:
         # 仕様書テキストを取得
         spec_text = building_info.get("spec_text_excerpt", "")
 
-        prompt = f"""あなたは熟練のガス設備積算技術者です。以下の仕様書からガス設備工事の見積項目を抽出してください。
+        prompt = f"""あなたは熟練のガス設備積算技術者です。上記の仕様書からガス設備工事の見積項目を抽出してください。
 
 【重要な制約】
 1. **仕様書に明記されている項目**を中心に抽出してください
@@ -2344,9 +2842,6 @@ JSON形式で回答:
   - 0.6-0.7: 上記ルールで推定
   - 0.5以下: 概算（要確認）
 
-【仕様書の内容】
-{spec_text[:15000] if spec_text else '仕様書テキストなし'}
-
 【建物情報（参考）】
 {building_summary}
 {spec_table_info}
@@ -2447,32 +2942,8 @@ JSON配列で、階層構造を持った見積項目を出力してください
 - 単価はnullのままで構いません（後でKBから取得します）
 - 仕様書にガス設備の記載がない場合は空配列 [] を返してください"""
 
-        response = self.client.messages.create(
-            model=self.model_name,
-            max_tokens=16000,
-            temperature=0,  # 決定的に（毎回同じ結果）
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        # コスト記録
-        record_cost(
-            operation="ガス設備見積生成",
-            model_name=self.model_name,
-            input_tokens=response.usage.input_tokens,
-            output_tokens=response.usage.output_tokens,
-            metadata={"source": "generate_detailed_estimate_items", "discipline": "ガス設備工事"}
-        )
-
-        response_text = response.content[0].text
-        logger.debug(f"LLM Response for gas: {response_text[:500]}...")
-
-        # 堅牢なJSON抽出を使用
-        items_data = extract_json_array_robust(response_text)
-        logger.info(f"Gas items extracted: {len(items_data)} items")
-
-        # EstimateItemに変換
-        estimate_items = []
-        for item_data in items_data:
+        def to_item(item_data: Dict[str, Any]) -> EstimateItem:
+            """応答の項目をEstimateItemに変換"""
             # cost_typeの変換
             cost_type_str = item_data.get("cost_type", "")
             cost_type = None
@@ -2482,7 +2953,7 @@ JSON配列で、階層構造を持った見積項目を出力してください
                         cost_type = ct
                         break
 
-            estimate_item = EstimateItem(
+            return EstimateItem(
                 item_no=item_data.get("item_no", ""),
                 level=item_data.get("level", 0),
                 name=item_data.get("name", ""),
@@ -2499,7 +2970,15 @@ JSON配列で、階層構造を持った見積項目を出力してください
                 confidence=item_data.get("confidence", 0.7)
             )
 
-            estimate_items.append(estimate_item)
+        # 応答をストリーミングで受け取り、JSON配列の要素が閉じるたびに項目に変換（応答全体を待たない）
+        estimate_items, response_text = self._stream_estimate_items(
+            self._spec_context_messages(spec_text, prompt),
+            to_item,
+            operation="ガス設備見積生成",
+            cost_metadata={"source": "generate_detailed_estimate_items", "discipline": "ガス設備工事"}
+        )
+        logger.debug(f"LLM Response for gas: {response_text[:500]}...")
+        logger.info(f"Gas items extracted: {len(estimate_items)} items")
 
         return estimate_items
 
@@ -2539,7 +3018,7 @@ JSON配列で、階層構造を持った見積項目を出力してください
         # 仕様書テキストを取得
         spec_text = building_info.get("spec_text_excerpt", "")
 
-        prompt = f"""あなたは熟練の給排水設備（衛生設備）積算技術者です。以下の仕様書から給排水設備工事の見積項目を抽出してください。
+        prompt = f"""あなたは熟練の給排水設備（衛生設備）積算技術者です。上記の仕様書から給排水設備工事の見積項目を抽出してください。
 
 【重要な制約】
 1. **仕様書に明記されている項目**を中心に抽出してください
@@ -2588,9 +3067,6 @@ JSON配列で、階層構造を持った見積項目を出力してください
   - 0.6-0.7: 上記ルールで推定
   - 0.5以下: 概算（要確認）
 
-【仕様書の内容】
-{spec_text[:15000] if spec_text else '仕様書テキストなし'}
-
 【建物情報（参考）】
 {building_summary}
 {spec_table_info}
@@ -2749,32 +3225,8 @@ JSON配列で、階層構造を持った見積項目を出力してください
 - 単価はnullのままで構いません（後でKBから取得します）
 - 仕様書に給排水設備の記載がない場合は空配列 [] を返してください"""
 
-        response = self.client.messages.create(
-            model=self.model_name,
-            max_tokens=16000,
-            temperature=0,  # 決定的に（毎回同じ結果）
-            messages=[{"role": "user", "content": prompt}]
-        )
-
-        # コスト記録
-        record_cost(
-            operation="給排水設備見積生成",
-            model_name=self.model_name,
-            input_tokens=response.usage.input_tokens,
-            output_tokens=response.usage.output_tokens,
-            metadata={"source": "generate_detailed_estimate_items", "discipline": "給排水設備工事"}
-        )
-
-        response_text = response.content[0].text
-        logger.debug(f"LLM Response for plumbing: {response_text[:500]}...")
-
-        # 堅牢なJSON抽出を使用
-        items_data = extract_json_array_robust(response_text)
-        logger.info(f"Plumbing items extracted: {len(items_data)} items")
-
-        # EstimateItemに変換
-        estimate_items = []
-        for item_data in items_data:
+        def to_item(item_data: Dict[str, Any]) -> EstimateItem:
+            """応答の項目をEstimateItemに変換"""
             # cost_typeの変換
             cost_type_str = item_data.get("cost_type", "")
             cost_type = None
@@ -2784,7 +3236,7 @@ JSON配列で、階層構造を持った見積項目を出力してください
                         cost_type = ct
                         break
 
-            estimate_item = EstimateItem(
+            return EstimateItem(
                 item_no=item_data.get("item_no", ""),
                 level=item_data.get("level", 0),
                 name=item_data.get("name", ""),
@@ -2801,7 +3253,15 @@ JSON配列で、階層構造を持った見積項目を出力してください
                 confidence=item_data.get("confidence", 0.7)
             )
 
-            estimate_items.append(estimate_item)
+        # 応答をストリーミングで受け取り、JSON配列の要素が閉じるたびに項目に変換（応答全体を待たない）
+        estimate_items, response_text = self._stream_estimate_items(
+            self._spec_context_messages(spec_text, prompt),
+            to_item,
+            operation="給排水設備見積生成",
+            cost_metadata={"source": "generate_detailed_estimate_items", "discipline": "給排水設備工事"}
+        )
+        logger.debug(f"LLM Response for plumbing: {response_text[:500]}...")
+        logger.info(f"Plumbing items extracted: {len(estimate_items)} items")
 
         return estimate_items
 
@@ -2834,7 +3294,7 @@ JSON配列で、階層構造を持った見積項目を出力してください
         total_rooms = equipment_summary.get("total_rooms", 0)
 
         # 仕様書準拠のプロンプト
-        prompt = f"""あなたは熟練の電気設備積算技術者です。以下の仕様書と建物情報から電気設備工事の見積項目を生成してください。
+        prompt = f"""あなたは熟練の電気設備積算技術者です。上記の仕様書と以下の建物情報から電気設備工事の見積項目を生成してください。
 
 【最重要: 過大見積を避ける】
 ★ 仕様書に明記されていない項目は生成しないでください
@@ -2904,9 +3364,6 @@ JSON配列で、階層構造を持った見積項目を出力してください
   - 0.6-0.7: 上記ルールで推定
   - 0.5以下: 概算（要確認）
 
-【仕様書の内容】
-{spec_text[:12000]}
-
 【建物基本情報】
 - 工事名: {building_info.get('project_name', '')}
 - 延床面積: {bldg.get('total_floor_area', 2000)}㎡
@@ -2954,30 +3411,8 @@ JSON配列で、階層構造を持った見積項目を出力してください
         all_items.append(parent_item)
 
         try:
-            response = self.client.messages.create(
-                model=self.model_name,
-                max_tokens=16000,
-                temperature=0,  # 決定的に（毎回同じ結果）
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            record_cost(
-                operation="電気設備生成（仕様書準拠）",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"source": "generate_electrical_spec_based"}
-            )
-
-            response_text = response.content[0].text
-            logger.debug(f"LLM Response for electrical (first 500 chars): {response_text[:500]}")
-
-            # 堅牢なJSON抽出を使用
-            items_data = extract_json_array_robust(response_text)
-            logger.info(f"Electrical items extracted: {len(items_data)} items")
-
-            # EstimateItemに変換
-            for item_data in items_data:
+            def to_item(item_data: Dict[str, Any]) -> EstimateItem:
+                """応答の項目をEstimateItemに変換"""
                 cost_type = None
                 cost_type_str = item_data.get("cost_type", "")
                 for ct in CostType:
@@ -2985,7 +3420,7 @@ JSON配列で、階層構造を持った見積項目を出力してください
                         cost_type = ct
                         break
 
-                estimate_item = EstimateItem(
+                return EstimateItem(
                     item_no="",
                     level=item_data.get("level", 2),
                     name=item_data.get("name", ""),
@@ -3001,9 +3436,17 @@ JSON配列で、階層構造を持った見積項目を出力してください
                     source_reference=item_data.get("source", "仕様書"),
                     confidence=item_data.get("confidence", 0.7)
                 )
-                all_items.append(estimate_item)
 
-            logger.info(f"Generated {len(items_data)} electrical items from specification")
+            # 応答をストリーミングで受け取り、JSON配列の要素が閉じるたびに項目に変換（応答全体を待たない）
+            streamed_items, response_text = self._stream_estimate_items(
+                self._spec_context_messages(spec_text, prompt),
+                to_item,
+                operation="電気設備生成（仕様書準拠）",
+                cost_metadata={"source": "generate_electrical_spec_based"}
+            )
+            logger.debug(f"LLM Response for electrical (first 500 chars): {response_text[:500]}")
+            all_items.extend(streamed_items)
+            logger.info(f"Generated {len(streamed_items)} electrical items from specification")
 
         except Exception as e:
             logger.error(f"Failed to generate electrical items: {e}")
@@ -3107,7 +3550,7 @@ JSON配列で、階層構造を持った見積項目を出力してください
         legal_standards = building_info.get("legal_standards", [])
 
         # 仕様書準拠のプロンプト
-        prompt = f"""あなたは熟練の機械設備積算技術者です。以下の仕様書から機械設備工事の見積項目を抽出してください。
+        prompt = f"""あなたは熟練の機械設備積算技術者です。上記の仕様書から機械設備工事の見積項目を抽出してください。
 
 【重要な制約】
 1. **仕様書に明記されている項目**を中心に抽出してください
@@ -3159,9 +3602,6 @@ JSON配列で、階層構造を持った見積項目を出力してください
   - 0.6-0.7: 上記ルールで推定
   - 0.5以下: 概算（要確認）
 
-【仕様書の内容】
-{spec_text[:15000]}
-
 【建物基本情報（参考）】
 - 工事名: {building_info.get('project_name', '')}
 - 延床面積: {bldg.get('total_floor_area', '')}㎡
@@ -3203,30 +3643,8 @@ JSON配列で、階層構造を持った見積項目を出力してください
         all_items.append(parent_item)
 
         try:
-            response = self.client.messages.create(
-                model=self.model_name,
-                max_tokens=16000,
-                temperature=0,  # 決定的に（毎回同じ結果）
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            record_cost(
-                operation="機械設備生成（仕様書準拠）",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"source": "generate_mechanical_spec_based"}
-            )
-
-            response_text = response.content[0].text
-            logger.debug(f"LLM Response for mechanical (first 500 chars): {response_text[:500]}")
-
-            # 堅牢なJSON抽出を使用
-            items_data = extract_json_array_robust(response_text)
-            logger.info(f"Mechanical items extracted: {len(items_data)} items")
-
-            # EstimateItemに変換
-            for item_data in items_data:
+            def to_item(item_data: Dict[str, Any]) -> EstimateItem:
+                """応答の項目をEstimateItemに変換"""
                 cost_type = None
                 cost_type_str = item_data.get("cost_type", "")
                 for ct in CostType:
@@ -3234,7 +3652,7 @@ JSON配列で、階層構造を持った見積項目を出力してください
                         cost_type = ct
                         break
 
-                estimate_item = EstimateItem(
+                return EstimateItem(
                     item_no="",
                     level=item_data.get("level", 2),
                     name=item_data.get("name", ""),
@@ -3250,9 +3668,17 @@ JSON配列で、階層構造を持った見積項目を出力してください
                     source_reference=item_data.get("source", "仕様書"),
                     confidence=item_data.get("confidence", 0.7)
                 )
-                all_items.append(estimate_item)
 
-            logger.info(f"Generated {len(items_data)} mechanical items from specification")
+            # 応答をストリーミングで受け取り、JSON配列の要素が閉じるたびに項目に変換（応答全体を待たない）
+            streamed_items, response_text = self._stream_estimate_items(
+                self._spec_context_messages(spec_text, prompt),
+                to_item,
+                operation="機械設備生成（仕様書準拠）",
+                cost_metadata={"source": "generate_mechanical_spec_based"}
+            )
+            logger.debug(f"LLM Response for mechanical (first 500 chars): {response_text[:500]}")
+            all_items.extend(streamed_items)
+            logger.info(f"Generated {len(streamed_items)} mechanical items from specification")
 
         except Exception as e:
             logger.error(f"Failed to generate mechanical items: {e}")
@@ -3262,69 +3688,42 @@ JSON配列で、階層構造を持った見積項目を出力してください
 
     def _normalize_text(self, text: str) -> str:
         """テキストを正規化（空白・記号を統一、類義語統一）"""
-        if not text:
-            return ""
-        import re
-        # 全角→半角
-        text = text.replace('（', '(').replace('）', ')').replace('　', ' ')
-        # 記号の統一
-        text = text.replace('・', '').replace('/', '').replace('-', '')
-        # 複数空白を1つに
-        text = re.sub(r'\s+', ' ', text)
-        text = text.strip().lower()
-
-        # 接尾辞の統一（「工事」「費」「材」等を除去して比較しやすく）
-        suffixes_to_remove = ['工事', '費', '工', '材料', '材']
-        for suffix in suffixes_to_remove:
-            if text.endswith(suffix) and len(text) > len(suffix):
-                text = text[:-len(suffix)]
-
-        # 類義語の統一
-        synonyms = {
-            '穴補修': '穴補修',
-            '穴あけ': '穴補修',
-            '壁穿孔': '穴補修',
-            '貫通': '穴補修',
-            '撤去': '撤去',
-            '解体': '撤去',
-            '取り外し': '撤去',
-            '取外し': '撤去',
-            '取付': '取付',
-            '設置': '取付',
-            '据付': '取付',
-        }
-        for key, value in synonyms.items():
-            if key in text:
-                text = text.replace(key, value)
-
-        return text
+        return normalize_text(text)
 
     def _extract_size(self, text: str) -> str:
         """テキストからサイズ情報を抽出（例: 15A, 20mm）"""
-        if not text:
-            return ""
-        import re
-        # サイズパターン: 数値 + 単位（A, mm, cm等）
-        match = re.search(r'(\d+)\s*([Aａmcm]{1,2})', text, re.IGNORECASE)
-        if match:
-            return f"{match.group(1)}{match.group(2).upper()}"
-        return ""
+        return extract_size(text)
 
     def _get_category(self, item_name: str) -> str:
         """項目名からカテゴリを抽出（例: 白ガス管、PE管）"""
-        # カテゴリキーワード
-        categories = [
-            "白ガス管", "カラー鋼管", "PE管", "露出結び",
-            "ガスコンセント", "ネジコック", "分岐コック",
-            "ボールスライドジョイント", "ガスメーター",
-            "配管支持金具", "穴あけ", "埋戻し", "コンクリート",
-            "高所作業車", "運搬", "諸経費", "試験", "検査", "撤去"
-        ]
+        return get_category(item_name)
 
-        for category in categories:
-            if category in item_name:
-                return category
-        return ""
+    def _unit_match_score(self, item_unit: str, kb_unit: Optional[str], kb_unit_norm: str) -> Optional[float]:
+        """
+        単位一致スコアを計算
+
+        Returns:
+            0.5（一致）/ 0.3（部分一致）/ 0.0、単位が互換性なしの場合はNone
+        """
+        if item_unit == kb_unit:
+            return 0.5
+        if item_unit and kb_unit:
+            # m と メートル、式 と 式 等
+            unit_norm_item = self._normalize_text(item_unit)
+            if unit_norm_item == kb_unit_norm:
+                return 0.5
+            if unit_norm_item in kb_unit_norm or kb_unit_norm in unit_norm_item:
+                return 0.3
+            # 単位が完全に異なる場合は互換性なし（例: 式 vs 箇所）
+            incompatible_pairs = [
+                ("式", "箇所"), ("式", "個"), ("式", "m"), ("式", "台"),
+                ("箇所", "m"), ("個", "m"), ("台", "m"), ("ヶ所", "m")
+            ]
+            for u1, u2 in incompatible_pairs:
+                if (u1 in unit_norm_item and u2 in kb_unit_norm) or \
+                   (u2 in unit_norm_item and u1 in kb_unit_norm):
+                    return None
+        return 0.0
 
     def enrich_with_prices(self, estimate_items: List[EstimateItem]) -> List[EstimateItem]:
         """
@@ -3344,7 +3743,11 @@ JSON配列で、階層構造を持った見積項目を出力してください
         vector_match_count = 0
         string_match_count = 0
 
-        for item in estimate_items:
+        # ベクトル検索は全項目分をまとめて実行
+        vector_results = self._batch_vector_results(estimate_items, use_discipline=True) \
+            if vector_search_available else [None] * len(estimate_items)
+
+        for item, vector_result in zip(estimate_items, vector_results):
             # 親項目（level 0）のみスキップ - 数量nullでも単価マッチングは試行
             if item.level == 0:
                 enriched_items.append(item)
@@ -3363,26 +3766,19 @@ JSON配列で、階層構造を持った見積項目を出力してください
             match_type = ""
             best_score = 0.0
 
-            if vector_search_available:
-                vector_result = self._vector_search_match(
-                    item.name,
-                    item.specification or "",
-                    item.discipline.value,
-                    target_unit=item.unit  # 単位リランキング用
-                )
-                if vector_result:
-                    kb_item = vector_result["kb_item"]
-                    kb_price = kb_item.get("unit_price")
-                    # 単位互換性チェック（高額「式」単価を拒否）
-                    if self._check_unit_compatibility(item.unit, kb_item.get("unit", ""), kb_price, kb_item):
-                        # 単価妥当性チェック
-                        if self._validate_price(item.name, kb_price):
-                            matched_item = kb_item
-                            match_type = "vector"
-                            best_score = vector_result["score"]
-                            vector_match_count += 1
-                            logger.debug(f"✓ Vector match: '{item.name}' → '{kb_item.get('item_id')}' "
-                                       f"(score={best_score:.3f})")
+            if vector_result:
+                kb_item = vector_result["kb_item"]
+                kb_price = kb_item.get("unit_price")
+                # 単位互換性チェック（高額「式」単価を拒否）
+                if self._check_unit_compatibility(item.unit, kb_item.get("unit", ""), kb_price, kb_item):
+                    # 単価妥当性チェック
+                    if self._validate_price(item.name, kb_price):
+                        matched_item = kb_item
+                        match_type = "vector"
+                        best_score = vector_result["score"]
+                        vector_match_count += 1
+                        logger.debug(f"✓ Vector match: '{item.name}' → '{kb_item.get('item_id')}' "
+                                   f"(score={best_score:.3f})")
 
             # ===== フォールバック: 文字列マッチング =====
             if not matched_item:
@@ -3393,31 +3789,35 @@ JSON配列で、階層構造を持った見積項目を出力してください
                 kb_candidates = 0
 
                 # Phase 2: 類義語を取得
-                item_synonyms = self._find_synonyms(item.name)
-                item_synonyms_norm = [self._normalize_text(s) for s in item_synonyms]
+                kb_features = self._get_kb_features()
+                item_synonyms_norm = kb_features.synonyms_norm(item.name)
+                item_words = [word for word in item_name_norm.split() if len(word) > 1]
+                discipline_compatible = {}
+                unit_scores = {}
+                best_index = -1
+
+                # 転置インデックスで候補行を絞り込み（絞り込めない項目は全件走査）
+                candidate_rows = kb_features.candidate_rows(
+                    item_name_norm, item_spec_norm, item_size, item_category, item_synonyms_norm
+                )
+                scan_rows = range(len(kb_features.rows)) if candidate_rows is None else candidate_rows
+
+                for row_index in scan_rows:
+                    kb_item = self.price_kb[row_index]
+                    kb_row = kb_features.rows[row_index]
 
-                for kb_item in self.price_kb:
                     # Phase 2: 工事区分の互換性チェック（緩和版）
-                    kb_discipline = kb_item.get("discipline", "")
-                    if not self._is_discipline_compatible(kb_discipline, item.discipline.value):
+                    compatible = discipline_compatible.get(kb_row.discipline)
+                    if compatible is None:
+                        compatible = self._is_discipline_compatible(kb_row.discipline, item.discipline.value)
+                        discipline_compatible[kb_row.discipline] = compatible
+                    if not compatible:
                         continue
 
                     kb_candidates += 1
 
-                    kb_desc = kb_item.get("description", "")
-                    kb_spec = kb_item.get("features", {}).get("specification", "")
-                    kb_full_text = f"{kb_desc} {kb_spec}"
-
-                    # 正規化
-                    kb_desc_norm = self._normalize_text(kb_desc)
-                    kb_spec_norm = self._normalize_text(kb_spec)
-                    kb_full_norm = self._normalize_text(kb_full_text)
-                    kb_size = self._extract_size(kb_spec)
-                    kb_category = self._get_category(kb_desc)
-
-                    # KB側の類義語も取得
-                    kb_synonyms = self._find_synonyms(kb_desc)
-                    kb_synonyms_norm = [self._normalize_text(s) for s in kb_synonyms]
+                    kb_desc_norm = kb_row.desc_norm
+                    kb_spec_norm = kb_row.spec_norm
 
                     # 詳細な類似度計算
                     score = 0.0
@@ -3428,14 +3828,14 @@ JSON配列で、階層構造を持った見積項目を出力してください
                     elif item_name_norm in kb_desc_norm or kb_desc_norm in item_name_norm:
                         score += 1.5
                     # Phase 2: 類義語でのマッチング
-                    elif any(syn in kb_synonyms_norm for syn in item_synonyms_norm):
+                    elif not item_synonyms_norm.isdisjoint(kb_row.synonyms_norm):
                         score += 1.8  # 類義語一致は高スコア
-                        logger.debug(f"  Synonym match: {item.name} ↔ {kb_desc}")
-                    elif any(word in kb_desc_norm for word in item_name_norm.split() if len(word) > 1):
+                        logger.debug(f"  Synonym match: {item.name} ↔ {kb_item.get('description', '')}")
+                    elif any(word in kb_desc_norm for word in item_words):
                         score += 1.0
 
                     # 2. カテゴリの一致
-                    if item_category and kb_category and item_category == kb_category:
+                    if item_category and item_category == kb_row.category:
                         score += 1.0
                         # カテゴリが一致する場合はフォールバック候補
                         if score > category_fallback_score:
@@ -3448,50 +3848,39 @@ JSON配列で、階層構造を持った見積項目を出力してください
                         if item_spec_norm == kb_spec_norm:
                             score += 1.5
                         # サイズ一致（例: 15A）
-                        elif item_size and kb_size and item_size == kb_size:
+                        elif item_size and item_size == kb_row.size:
                             score += 1.2
                         # 仕様が含まれる
-                        elif item_spec_norm in kb_full_norm or kb_spec_norm in item_spec_norm:
+                        elif item_spec_norm in kb_row.full_norm or kb_spec_norm in item_spec_norm:
                             score += 0.8
 
-                    # 4. 単位の一致
-                    unit_match_score = 0.0
-                    unit_compatible = True  # 単位の互換性フラグ
-
-                    if item.unit == kb_item.get("unit"):
-                        unit_match_score = 0.5
-                    elif item.unit and kb_item.get("unit"):
-                        # m と メートル、式 と 式 等
-                        unit_norm_item = self._normalize_text(item.unit)
-                        unit_norm_kb = self._normalize_text(kb_item.get("unit", ""))
-                        if unit_norm_item == unit_norm_kb:
-                            unit_match_score = 0.5
-                        elif unit_norm_item in unit_norm_kb or unit_norm_kb in unit_norm_item:
-                            unit_match_score = 0.3
-                        else:
-                            # 単位が完全に異なる場合は互換性なし（例: 式 vs 箇所）
-                            incompatible_pairs = [
-                                ("式", "箇所"), ("式", "個"), ("式", "m"), ("式", "台"),
-                                ("箇所", "m"), ("個", "m"), ("台", "m"), ("ヶ所", "m")
-                            ]
-                            for u1, u2 in incompatible_pairs:
-                                if (u1 in unit_norm_item and u2 in unit_norm_kb) or \
-                                   (u2 in unit_norm_item and u1 in unit_norm_kb):
-                                    unit_compatible = False
-                                    break
-
-                    # 単位が互換性ありの場合のみスコアに加算
-                    if unit_compatible:
-                        score += unit_match_score
-                    else:
+                    # 4. 単位の一致（KBの単位ごとに1回だけ判定）
+                    unit_key = (kb_row.unit, kb_row.unit_norm)
+                    if unit_key not in unit_scores:
+                        unit_scores[unit_key] = self._unit_match_score(item.unit, kb_row.unit, kb_row.unit_norm)
+                    unit_match_score = unit_scores[unit_key]
+                    if unit_match_score is None:
                         # 単位不整合の場合はマッチング対象外
-                        score = 0
-                        logger.debug(f"  ✗ Unit incompatible: {item.unit} vs {kb_item.get('unit')} - skipping")
+                        logger.debug(f"  ✗ Unit incompatible: {item.unit} vs {kb_row.unit} - skipping")
                         continue
 
+                    score += unit_match_score
+
                     if score > best_score:
                         best_score = score
                         best_match = kb_item
+                        best_index = row_index
+
+                # 候補外の行は単位一致スコアのみ（0.5/0.3）なので、最良の1行だけ比較
+                if candidate_rows is not None:
+                    unit_only = self._best_unit_only_row(
+                        kb_features, set(candidate_rows), item, discipline_compatible, unit_scores
+                    )
+                    if unit_only:
+                        unit_score, unit_index = unit_only
+                        if unit_score > best_score or (unit_score == best_score and 0 <= unit_index < best_index):
+                            best_score = unit_score
+                            best_match = self.price_kb[unit_index]
 
                 # マッチング成功（閾値を調整）
                 logger.debug(f"  KB candidates: {kb_candidates}, best_score={best_score:.2f}")
@@ -3708,7 +4097,8 @@ JSON配列で、階層構造を持った見積項目を出力してください
 
         # 仕様書テキストを追加（生成時に参照するため）
         # 最初の30000文字のみ（トークン制限のため）
-        building_info["spec_text_excerpt"] = spec_text[:30000]
+        # 仕様書テキスト（プロンプトに含める範囲は _spec_context_messages で SPEC_CONTEXT_MAX_CHARS まで）
+        building_info["spec_text_excerpt"] = spec_text
 
         # 法令情報を追加
         if legal_standards:
@@ -3859,7 +4249,7 @@ JSON配列で、階層構造を持った見積項目を出力してください
         Returns:
             見積項目リスト
         """
-        spec_text = building_info.get("spec_text_excerpt", "")[:30000]
+        spec_text = building_info.get("spec_text_excerpt", "")
         discipline_name = discipline.value
 
         # KBから該当カテゴリの項目例を取得
@@ -3869,7 +4259,7 @@ JSON配列で、階層構造を持った見積項目を出力してください
                 kb_examples.append(f"- {kb_item.get('description')} ({kb_item.get('unit')})")
         kb_examples_str = "\n".join(kb_examples[:20]) if kb_examples else "（KB項目なし）"
 
-        prompt = f"""あなたは熟練の建築設備積算技術者です。以下の仕様書から「{discipline_name}」に関する見積項目を抽出してください。
+        prompt = f"""あなたは熟練の建築設備積算技術者です。上記の仕様書から「{discipline_name}」に関する見積項目を抽出してください。
 
 【重要な制約】
 1. **仕様書に明記されている項目**を中心に抽出してください
@@ -3887,9 +4277,6 @@ JSON配列で、階層構造を持った見積項目を出力してください
 - 階数: {building_info.get('building_info', {}).get('floors', '不明')}
 - 部屋数: {building_info.get('building_info', {}).get('num_rooms', '不明')}
 
-【仕様書（抜粋）】
-{spec_text}
-
 【出力形式】
 JSON配列形式で出力してください：
 ```json
@@ -3915,15 +4302,9 @@ JSON配列形式で出力してください：
                 model=self.model_name,
                 max_tokens=16000,
                 temperature=0,  # 決定的に（毎回同じ結果）
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            record_cost(
+                messages=self._spec_context_messages(spec_text, prompt),
                 operation=f"{discipline_name}項目生成",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"source": "generate_detailed_items_generic", "discipline": discipline_name}
+                cost_metadata={"source": "generate_detailed_items_generic", "discipline": discipline_name}
             )
 
             response_text = response.content[0].text
@@ -3989,11 +4370,14 @@ JSON配列形式で出力してください：
             legal_standards = []
         logger.info("Starting unified estimate generation (all disciplines)")
 
+        # 1〜2.8. 抽出ステージを依存関係に従って並列実行（結果のマージは下記の固定順）
+        stage_results = self._run_extraction_stages(spec_pdf_path)
+
         # 1. 仕様書からテキスト抽出
-        spec_text = self.extract_text_from_pdf(spec_pdf_path)
+        spec_text = stage_results["spec_text"]
 
         # 2. 建物情報を詳細抽出
-        building_info = self.extract_building_info(spec_text)
+        building_info = stage_results["building_info"]
 
         # 仕様書テキストを全て追加（制限なし）
         building_info["spec_text_excerpt"] = spec_text
@@ -4003,7 +4387,7 @@ JSON配列形式で出力してください：
             building_info["legal_standards"] = legal_standards
 
         # 2.5. 諸元表から詳細な部屋・設備情報を抽出
-        spec_table_data = self.extract_specification_tables(spec_pdf_path, spec_text)
+        spec_table_data = stage_results["spec_tables"]
         if spec_table_data.get("rooms"):
             building_info["spec_table"] = spec_table_data
             equipment_summary = spec_table_data.get("equipment_summary", {})
@@ -4014,7 +4398,7 @@ JSON配列形式で出力してください：
 
         # 2.6. Vision抽出による諸元表データ取得
         if HAS_PYMUPDF:
-            vision_table_data = self.extract_specification_table_with_vision(spec_pdf_path)
+            vision_table_data = stage_results["spec_table_vision"]
             if vision_table_data.get("rooms"):
                 building_info["spec_table_vision"] = vision_table_data
                 totals = vision_table_data.get("totals", {})
@@ -4027,12 +4411,12 @@ JSON配列形式で出力してください：
 
         # 2.7. 図面から設備情報を抽出
         if HAS_PYMUPDF:
-            drawing_info = self.extract_drawing_info(spec_pdf_path)
+            drawing_info = stage_results["drawing_info"]
             if drawing_info.get("equipment_locations") or drawing_info.get("pipe_routes"):
                 building_info["drawing_info"] = drawing_info
 
         # 2.8. 仕様書から具体的な設備数量を抽出
-        extracted_quantities = self.extract_equipment_quantities(spec_text)
+        extracted_quantities = stage_results["equipment_quantities"]
         if extracted_quantities:
             building_info["extracted_quantities"] = extracted_quantities
             logger.info(f"Extracted specific quantities: {len(extracted_quantities.get('raw_mentions', []))} items")
@@ -4388,7 +4772,7 @@ JSON配列形式で出力してください：
         """
         spec_text = building_info.get("spec_text_excerpt", "")
 
-        prompt = f"""あなたは熟練の建築設備積算技術者です。以下の仕様書から全ての設備工事項目を抽出してください。
+        prompt = f"""あなたは熟練の建築設備積算技術者です。上記の仕様書から全ての設備工事項目を抽出してください。
 
 【重要な制約】
 1. **仕様書に明記されている項目**を中心に抽出してください
@@ -4411,9 +4795,6 @@ JSON配列形式で出力してください：
 - 階数: {building_info.get('building_info', {}).get('floors', '不明')}
 - 部屋数: {building_info.get('building_info', {}).get('num_rooms', '不明')}
 
-【仕様書（全文）】
-{spec_text}
-
 【出力形式】
 以下のJSON配列形式で出力してください：
 ```json
@@ -4445,15 +4826,10 @@ JSON配列形式で出力してください：
                 model=self.model_name,
                 max_tokens=16000,  # 大量の項目に対応
                 temperature=0,  # 決定的に（毎回同じ結果）
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            record_cost(
+                # 他の呼び出しと仕様書の先頭ブロックを共有しないため、従来どおり30000文字まで
+                messages=self._spec_context_messages(spec_text, prompt, max_chars=30000),
                 operation="統合見積項目生成",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"source": "generate_unified_items"}
+                cost_metadata={"source": "generate_unified_items"}
             )
 
             response_text = response.content[0].text
@@ -4523,7 +4899,11 @@ JSON配列形式で出力してください：
         enriched_items = []
         match_count = 0
 
-        for item in estimate_items:
+        # ベクトル検索は全項目分をまとめて実行（discipline制限なし）
+        vector_results = self._batch_vector_results(estimate_items, use_discipline=False) \
+            if vector_search_available else [None] * len(estimate_items)
+
+        for item, vector_result in zip(estimate_items, vector_results):
             # 親項目（level 0）のみスキップ - 数量nullでも単価マッチングは試行
             if item.level == 0:
                 enriched_items.append(item)
@@ -4540,41 +4920,34 @@ JSON配列形式で出力してください：
             match_type = ""
             best_score = 0.0
 
-            if vector_search_available:
-                # discipline=Noneで全カテゴリ検索、単位リランキング付き
-                vector_result = self._vector_search_match(
-                    item.name,
-                    item.specification or "",
-                    None,  # discipline制限なし
-                    target_unit=item.unit  # 単位リランキング用
-                )
-                if vector_result:
-                    kb_item = vector_result["kb_item"]
-                    kb_price = kb_item.get("unit_price")
-                    if self._check_unit_compatibility(item.unit, kb_item.get("unit", ""), kb_price, kb_item):
-                        if self._validate_price(item.name, kb_price):
-                            matched_item = kb_item
-                            match_type = "vector"
-                            best_score = vector_result["score"]
-                            match_count += 1
+            if vector_result:
+                kb_item = vector_result["kb_item"]
+                kb_price = kb_item.get("unit_price")
+                if self._check_unit_compatibility(item.unit, kb_item.get("unit", ""), kb_price, kb_item):
+                    if self._validate_price(item.name, kb_price):
+                        matched_item = kb_item
+                        match_type = "vector"
+                        best_score = vector_result["score"]
+                        match_count += 1
 
             # ===== フォールバック: 文字列マッチング（全KB検索） =====
             if not matched_item:
                 best_match = None
                 best_match_score = 0.0
 
-                for kb_item in self.price_kb:
-                    # discipline制限なし - 全KB項目を検索
+                kb_features = self._get_kb_features()
+                item_words = [word for word in item_name_norm.split() if len(word) > 1]
 
-                    kb_desc = kb_item.get("description", "")
-                    kb_spec = kb_item.get("features", {}).get("specification", "")
-                    kb_full_text = f"{kb_desc} {kb_spec}"
+                # 転置インデックスで候補行を絞り込み（候補外の行はスコア0で閾値2.0に届かない）
+                candidate_rows = kb_features.candidate_rows(item_name_norm, item_spec_norm, item_size, item_category)
+                scan_rows = range(len(kb_features.rows)) if candidate_rows is None else candidate_rows
 
-                    kb_desc_norm = self._normalize_text(kb_desc)
-                    kb_spec_norm = self._normalize_text(kb_spec)
-                    kb_full_norm = self._normalize_text(kb_full_text)
-                    kb_size = self._extract_size(kb_spec)
-                    kb_category = self._get_category(kb_desc)
+                for row_index in scan_rows:
+                    # discipline制限なし - 全KB項目を検索
+                    kb_item = self.price_kb[row_index]
+                    kb_row = kb_features.rows[row_index]
+                    kb_desc_norm = kb_row.desc_norm
+                    kb_spec_norm = kb_row.spec_norm
 
                     # 類似度計算
                     score = 0.0
@@ -4584,30 +4957,33 @@ JSON配列形式で出力してください：
                         score += 2.0
                     elif item_name_norm in kb_desc_norm or kb_desc_norm in item_name_norm:
                         score += 1.5
-                    elif any(word in kb_desc_norm for word in item_name_norm.split() if len(word) > 1):
+                    elif any(word in kb_desc_norm for word in item_words):
                         score += 1.0
 
                     # 2. カテゴリの一致
-                    if item_category and kb_category and item_category == kb_category:
+                    if item_category and item_category == kb_row.category:
                         score += 1.0
 
                     # 3. 仕様・サイズの一致
                     if item_spec_norm and kb_spec_norm:
                         if item_spec_norm == kb_spec_norm:
                             score += 1.5
-                        elif item_size and kb_size and item_size == kb_size:
+                        elif item_size and item_size == kb_row.size:
                             score += 1.2
-                        elif item_spec_norm in kb_full_norm or kb_spec_norm in item_spec_norm:
+                        elif item_spec_norm in kb_row.full_norm or kb_spec_norm in item_spec_norm:
                             score += 0.8
 
+                    # 閾値未満・現在の最良以下なら単位チェック不要
+                    if score < 2.0 or score <= best_match_score:
+                        continue
+
                     # 4. 単位互換性チェック（高額「式」単価を拒否）
                     kb_price = kb_item.get("unit_price")
                     if not self._check_unit_compatibility(item.unit, kb_item.get("unit", ""), kb_price, kb_item):
                         continue
 
-                    if score >= 2.0 and score > best_match_score:
-                        best_match = kb_item
-                        best_match_score = score
+                    best_match = kb_item
+                    best_match_score = score
 
                 if best_match:
                     matched_item = best_match
@@ -10,7 +10,6 @@
 """
 
 import os
-import json
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from datetime import datetime
@@ -22,6 +21,7 @@ from pipelines.schemas import (
 )
 from pipelines.estimate_extractor_v2 import EstimateExtractorV2
 from pipelines.legal_requirement_extractor import LegalRequirementExtractor
+from pipelines.kb_registry import get_kb_registry
 
 
 class EstimateGeneratorWithLegal:
@@ -41,15 +41,11 @@ class EstimateGeneratorWithLegal:
             kb_path = "kb/price_kb.json"
 
         self.kb_path = kb_path
-        self.price_kb: List[Dict[str, Any]] = []
 
-        # KBを読み込み
-        if Path(kb_path).exists():
-            with open(kb_path, 'r', encoding='utf-8') as f:
-                self.price_kb = json.load(f)
+        # KBを読み込み（プロセス共通の読み取り専用スナップショット）
+        self.price_kb: List[Dict[str, Any]] = get_kb_registry().get_kb(kb_path)
+        if self.price_kb:
             logger.info(f"Loaded {len(self.price_kb)} items from KB: {kb_path}")
-        else:
-            logger.warning(f"KB file not found: {kb_path}")
 
     def match_price_from_kb(
         self,
@@ -9,8 +9,8 @@ AI生成見積との整合性をチェックする機能を提供します。
 from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass, field
 from enum import Enum
-from pathlib import Path
-import json
+
+from pipelines.kb_registry import get_kb_registry
 
 
 class CalculationBasis(str, Enum):
@@ -101,12 +101,8 @@ class EstimateVerifier:
         self.kb_data = self._load_kb(kb_path)
 
     def _load_kb(self, kb_path: str) -> List[Dict]:
-        """KBを読み込み"""
-        path = Path(kb_path)
-        if path.exists():
-            with open(path, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        return []
+        """KBを読み込み（プロセス共通の読み取り専用スナップショット）"""
+        return get_kb_registry().get_kb(kb_path)
 
     def extract_spec_info(self, spec_text: str) -> SpecExtraction:
         """仕様書から情報を抽出"""
@@ -1,20 +1,67 @@
 """Document Ingest Pipeline - PDFからテキスト・テーブル・画像を抽出"""
 
-import fitz  # PyMuPDF
-import pdfplumber
+import threading
+from collections.abc import Sequence
 from pathlib import Path
-from typing import Dict, List, Any, Optional, Tuple
+from typing import Callable, Dict, Iterator, List, Any, Optional, Tuple
 from loguru import logger
 import re
 from PIL import Image
 import io
 
+from pipelines.pdf_cache import ENGINE_PYMUPDF, open_pdf
+
+
+class LazyList(Sequence):
+    """
+    最初にアクセスされた時に中身を計算する読み取り専用リスト
+
+    len()・インデックス・イテレーションは通常のリストと同じように使えます。
+    JSONに保存する場合は list() で変換してください。
+    """
+
+    def __init__(self, loader: Callable[[], List[Any]]):
+        self._loader = loader
+        self._items: Optional[List[Any]] = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> List[Any]:
+        if self._items is None:
+            with self._lock:
+                if self._items is None:
+                    self._items = list(self._loader())
+        return self._items
+
+    @property
+    def is_loaded(self) -> bool:
+        """計算済みかどうか"""
+        return self._items is not None
+
+    def __getitem__(self, index):
+        return self._load()[index]
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._load())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, LazyList):
+            other = other._load()
+        return self._load() == other
+
+    def __repr__(self) -> str:
+        if self._items is None:
+            return "LazyList(<not loaded>)"
+        return f"LazyList({self._items!r})"
+
 
 class DocumentIngestor:
     """入札書類からデータを抽出"""
 
     def __init__(self):
-        self.supported_formats = ['.pdf', '.docx', '.xlsx']
+        self.supported_formats = ['.pdf', '.docx', '.xlsx', '.xls', '.doc', '.msg', '.txt']
 
     def ingest(self, file_path: str) -> Dict[str, Any]:
         """
@@ -40,8 +87,14 @@ class DocumentIngestor:
             return self._ingest_pdf(str(path))
         elif path.suffix.lower() == '.docx':
             return self._ingest_docx(str(path))
-        elif path.suffix.lower() == '.xlsx':
+        elif path.suffix.lower() in ('.xlsx', '.xls'):
             return self._ingest_excel(str(path))
+        elif path.suffix.lower() == '.doc':
+            return self._ingest_doc(str(path))
+        elif path.suffix.lower() == '.msg':
+            return self._ingest_msg(str(path))
+        elif path.suffix.lower() == '.txt':
+            return self._ingest_text(str(path))
 
         raise ValueError(f"Handler not implemented for: {path.suffix}")
 
@@ -49,12 +102,16 @@ class DocumentIngestor:
         """
         PDFからテキスト、テーブル、画像を抽出
 
+        テキストはすぐに抽出します。テーブルと画像情報は重いため遅延評価（LazyList）にして、
+        最初に参照された時にページ単位で抽出します。テーブルはページ分類で
+        表の候補と判定されたページだけをpdfplumberで抽出します（図面ページなどは対象外）。
+
         Returns:
             {
                 'text': 全テキスト,
-                'pages': ページごとのデータ,
-                'tables': 抽出されたテーブル,
-                'images': 画像データ,
+                'pages': ページごとのデータ（'tables' は遅延評価）,
+                'tables': 抽出されたテーブル（遅延評価）,
+                'images': 画像データ（遅延評価）,
                 'metadata': PDFメタデータ
             }
         """
@@ -66,80 +123,85 @@ class DocumentIngestor:
             'metadata': {}
         }
 
-        # PyMuPDFでテキストと画像を抽出
-        doc = fitz.open(file_path)
+        # PDFキャッシュから開く（他の抽出処理と同じドキュメントを共有）
+        pdf = open_pdf(file_path)
+        metadata = pdf.metadata
         result['metadata'] = {
-            'page_count': len(doc),
-            'title': doc.metadata.get('title', ''),
-            'author': doc.metadata.get('author', ''),
-            'subject': doc.metadata.get('subject', ''),
+            'page_count': pdf.page_count,
+            'title': metadata.get('title', ''),
+            'author': metadata.get('author', ''),
+            'subject': metadata.get('subject', ''),
         }
 
         all_text = []
 
-        for page_num, page in enumerate(doc, start=1):
+        for page_num in range(1, pdf.page_count + 1):
             page_data = {
                 'page_number': page_num,
                 'text': '',
-                'tables': [],
+                'tables': LazyList(lambda page_num=page_num: self._extract_page_tables(pdf, page_num)),
                 'has_images': False
             }
 
-            # テキスト抽出
-            text = page.get_text()
+            # テキスト抽出（PyMuPDF）
+            text = pdf.page_text(page_num, engine=ENGINE_PYMUPDF)
             page_data['text'] = text
             all_text.append(text)
 
-            # 画像抽出
-            image_list = page.get_images()
-            if image_list:
-                page_data['has_images'] = True
-                for img_index, img in enumerate(image_list):
-                    xref = img[0]
-                    try:
-                        base_image = doc.extract_image(xref)
-                        result['images'].append({
-                            'page': page_num,
-                            'index': img_index,
-                            'ext': base_image['ext'],
-                            'size': len(base_image['image'])
-                        })
-                    except Exception as e:
-                        logger.warning(f"Failed to extract image on page {page_num}: {e}")
+            # 画像の有無（画像データの取り出しは遅延）
+            page_data['has_images'] = pdf.has_images(page_num)
 
             result['pages'].append(page_data)
 
-        doc.close()
-
         result['text'] = '\n\n'.join(all_text)
 
-        # pdfplumberでテーブルを抽出
+        pages = result['pages']
+        result['tables'] = LazyList(lambda: [
+            {
+                'page': page_data['page_number'],
+                'index': table['index'],
+                'data': table['data'],
+                'rows': len(table['data']),
+                'cols': len(table['data'][0]) if table['data'] else 0
+            }
+            for page_data in pages
+            for table in page_data['tables']
+        ])
+        result['images'] = LazyList(lambda: [
+            {'page': page_data['page_number'], **image_info}
+            for page_data in pages if page_data['has_images']
+            for image_info in pdf.page_images(page_data['page_number'])
+        ])
+
+        logger.info(f"Extracted {len(result['pages'])} pages "
+                    f"({sum(1 for p in pages if p['has_images'])} with images; tables/images are loaded on access)")
+
+        return result
+
+    def _extract_page_tables(self, pdf, page_num: int) -> List[Dict[str, Any]]:
+        """
+        1ページ分のテーブルを抽出（表の候補ページのみpdfplumberを実行）
+
+        Returns:
+            [{'index': テーブル番号, 'data': テーブルの行リスト}, ...]（空のテーブルは除く）
+        """
         try:
-            with pdfplumber.open(file_path) as pdf:
-                for page_num, page in enumerate(pdf.pages, start=1):
-                    tables = page.extract_tables()
-                    for table_index, table in enumerate(tables):
-                        if table:
-                            result['tables'].append({
-                                'page': page_num,
-                                'index': table_index,
-                                'data': table,
-                                'rows': len(table),
-                                'cols': len(table[0]) if table else 0
-                            })
-
-                            # ページデータにもテーブル情報を追加
-                            if page_num <= len(result['pages']):
-                                result['pages'][page_num - 1]['tables'].append({
-                                    'index': table_index,
-                                    'data': table
-                                })
+            features = pdf.page_features(page_num)
+            if not features.is_table_candidate:
+                logger.debug(f"Skip table extraction on page {page_num} "
+                             f"(rulings={features.horizontal_rulings}/{features.vertical_rulings}, "
+                             f"paths={features.path_count})")
+                return []
+            tables = pdf.page_tables(page_num)
         except Exception as e:
-            logger.error(f"Failed to extract tables: {e}")
-
-        logger.info(f"Extracted {len(result['pages'])} pages, {len(result['tables'])} tables, {len(result['images'])} images")
+            logger.error(f"Failed to extract tables on page {page_num}: {e}")
+            return []
 
-        return result
+        return [
+            {'index': table_index, 'data': table}
+            for table_index, table in enumerate(tables)
+            if table
+        ]
 
     def _ingest_docx(self, file_path: str) -> Dict[str, Any]:
         """Word文書からデータを抽出"""
@@ -223,6 +285,58 @@ class DocumentIngestor:
 
         return result
 
+    def _ingest_doc(self, file_path: str) -> Dict[str, Any]:
+        """旧形式のWord文書（.doc）からテキストを抽出（antiword または catdoc が必要）"""
+        import shutil
+        import subprocess
+
+        for command in (['antiword', '-m', 'UTF-8.txt', '-w', '0'], ['catdoc', '-w', '-d', 'utf-8']):
+            if shutil.which(command[0]):
+                completed = subprocess.run(command + [file_path], capture_output=True, check=True, timeout=120)
+                text = completed.stdout.decode('utf-8', errors='replace')
+                logger.info(f"Extracted {len(text)} characters from DOC ({command[0]})")
+                return {'text': text, 'tables': [], 'metadata': {'converter': command[0]}}
+
+        raise ImportError("antiword or catdoc is required to read .doc files")
+
+    def _ingest_msg(self, file_path: str) -> Dict[str, Any]:
+        """Outlookメール（.msg）から件名・本文・添付ファイル名を抽出（extract_msg が必要）"""
+        import extract_msg
+
+        msg = extract_msg.Message(file_path)
+        try:
+            attachments = [a.longFilename or a.shortFilename for a in msg.attachments]
+            result = {
+                'text': '\n\n'.join(part for part in (msg.subject, msg.body) if part),
+                'tables': [],
+                'metadata': {
+                    'subject': msg.subject or '',
+                    'sender': msg.sender or '',
+                    'date': str(msg.date or ''),
+                    'attachments': [name for name in attachments if name],
+                }
+            }
+        finally:
+            msg.close()
+
+        logger.info(f"Extracted {len(result['text'])} characters, "
+                    f"{len(result['metadata']['attachments'])} attachment names from MSG")
+        return result
+
+    def _ingest_text(self, file_path: str) -> Dict[str, Any]:
+        """テキストファイルを読み込み（UTF-8 / Shift_JIS）"""
+        data = Path(file_path).read_bytes()
+        for encoding in ('utf-8-sig', 'cp932'):
+            try:
+                text = data.decode(encoding)
+                break
+            except UnicodeDecodeError:
+                continue
+        else:
+            text = data.decode('utf-8', errors='replace')
+
+        return {'text': text, 'tables': [], 'metadata': {'encoding': encoding}}
+
     def extract_project_info(self, ingested_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         抽出されたデータから案件情報を抽出
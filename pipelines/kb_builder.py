@@ -4,21 +4,38 @@ import os
 import json
 import re
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Optional, Tuple, Union
 from datetime import datetime, date
 from collections import defaultdict
 import statistics
 from dotenv import load_dotenv
-from anthropic import Anthropic
 from loguru import logger
-import PyPDF2
 import openpyxl
 
 from pipelines.schemas import (
     PriceReference, DisciplineType, EstimateItem,
     Requirement, LegalReference
 )
-from pipelines.cost_tracker import record_cost
+from pipelines.llm_gateway import get_llm_gateway
+from pipelines.pdf_cache import open_pdf
+from pipelines.kb_registry import get_kb_registry
+from pipelines.kb_manifest import KBManifest, file_sha256, remove_items
+from pipelines.chunked_extraction import chunk_request_params, chunk_text, extract_items_chunked
+from pipelines.llm_batch import batch_request
+
+# 見積書からの抽出処理・プロンプトのバージョン（変更したら上げる）
+# KBマニフェストに記録し、一致するソースファイルは再構築時に再抽出しない
+EXTRACTOR_VERSIONS = {
+    "pdf": "1",
+    "excel": "1",
+}
+PROMPT_VERSIONS = {
+    # 見積書テキストをチャンクに分割して抽出するようにしたため更新
+    "pdf": "2",
+}
+
+# これより短いテキストしか抽出できないPDFはスキャンPDFとしてOCRで抽出する
+OCR_TEXT_THRESHOLD = 500
 
 
 class PriceKBBuilder:
@@ -32,29 +49,36 @@ class PriceKBBuilder:
     - 既存KBとのマージ
     """
 
+    PRICE_EXTRACTION_OPERATION = "KB抽出（単価）"
+
     def __init__(self, kb_path: str = "kb/price_kb.json"):
         load_dotenv()
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.client = get_llm_gateway()
         self.model_name = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
         self.kb_path = kb_path
-        self.kb_items: List[Dict[str, Any]] = []
 
-        # 既存KBを読み込み
+        # 既存KBを読み込み（プロセス共通のスナップショットを参照）
         if Path(kb_path).exists():
-            try:
-                with open(kb_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                    if content.strip():  # 空でない場合のみパース
-                        self.kb_items = json.loads(content)
-                        logger.info(f"Loaded {len(self.kb_items)} items from KB")
-                    else:
-                        logger.warning(f"KB file is empty: {kb_path}")
-            except json.JSONDecodeError as e:
-                logger.error(f"Invalid JSON in KB file: {e}")
-                self.kb_items = []
+            if self.kb_items:
+                logger.info(f"Loaded {len(self.kb_items)} items from KB")
         else:
             logger.info(f"No existing KB found at {kb_path}, starting fresh")
 
+    @property
+    def kb_items(self) -> List[Dict[str, Any]]:
+        """
+        現在のKB項目（読み取り専用スナップショット）
+
+        プロセス共通のKBレジストリから取得するため、ファイルが更新されれば
+        次回参照時に最新の内容になります。項目は変更できないdict（kb_registry.FrozenDict）です。
+        """
+        return get_kb_registry().get_kb(self.kb_path)
+
+    @kb_items.setter
+    def kb_items(self, items: List[Dict[str, Any]]):
+        """KB項目を置き換え（KBレジストリのスナップショットを更新。ファイルへの保存は save_kb_items）"""
+        get_kb_registry().set_kb(self.kb_path, items)
+
     def extract_estimate_from_pdf(self, pdf_path: str, project_name: str = None) -> List[PriceReference]:
         """見積書PDFから価格情報を抽出してKB化（OCR対応）
 
@@ -65,19 +89,16 @@ class PriceKBBuilder:
         logger.info(f"Building price KB from: {pdf_path}")
 
         # PDFからテキストを抽出（全ページ対応）
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            total_pages = len(pdf_reader.pages)
-            # 全ページを処理（制限なし）
-            for page_num in range(total_pages):
-                text += pdf_reader.pages[page_num].extract_text() + "\n"
+        pdf = open_pdf(pdf_path)
+        total_pages = pdf.page_count
+        # 全ページを処理（制限なし）
+        text = pdf.paged_text()
 
         logger.info(f"Extracted {len(text)} characters from PDF ({total_pages} pages)")
 
         # テキストがほとんど抽出できない場合はOCRを使用
         # 閾値を緩和: 100 → 500文字（スキャンPDFの検出精度向上）
-        if len(text.strip()) < 500:
+        if len(text.strip()) < OCR_TEXT_THRESHOLD:
             logger.warning("Text extraction failed, using OCR...")
             from pipelines.ocr_extractor import OCRExtractor
             ocr = OCRExtractor()
@@ -144,101 +165,17 @@ class PriceKBBuilder:
             logger.info(f"Extracted {len(price_refs)} items using OCR")
             return price_refs
 
-        # LLMで構造化データに変換
-        # テキスト制限を緩和: 最大60000文字（大規模PDF対応）
-        prompt = f"""以下の見積書PDFから、単価情報を抽出して単価データベース（KB）を構築します。
-
-見積書テキスト:
-{text[:60000]}
-
-【抽出する情報】
-各見積項目について：
-1. 項目名（name）- 具体的で検索可能な名称
-2. 仕様（specification）- サイズ、型番、材質等
-3. 数量（quantity）
-4. 単位（unit）
-5. 単価（unit_price）- 必須
-6. 金額（amount）
-7. 工事区分（discipline）- 下記から選択
-
-【工事区分の判定基準】
-- 電気: キュービクル、分電盤、配電盤、ケーブル、CV、配線、照明、コンセント、接地、ブレーカー
-- 機械: ダクト、換気扇、ファン、ポンプ、エレベーター、ボイラー
-- 空調: エアコン、パッケージ、室外機、室内機、冷媒配管、ヒートポンプ
-- 衛生: 給水管、排水管、給湯、トイレ、洗面、受水槽
-- ガス: ガス管、ガスコンセント、ガス栓、PE管、ガスメーター
-- 消防: スプリンクラー、感知器、消火栓、誘導灯、火災報知
-
-【重要な処理ルール】
-1. **「同上」「〃」「上記と同じ」などの省略表記は、直前の具体的な項目名に置き換えて出力してください**
-   例: 「同上施工費」→「架橋ポリエチレンケーブル施工費」
-   例: 「同上支持材」→「600Vビニル絶縁電線支持材」
-
-2. **以下の項目は除外してください:**
-   - 小計・合計・計行
-   - 項目名が空または「計」「小計」「合計」のみのもの
-   - 単価が0円または記載なしのもの
-   - 諸経費、法定福利費（率計算のため）
-
-3. **項目名は単独で意味が通じる形にしてください:**
-   悪い例: 「同上」「〃」「設置費」
-   良い例: 「気中開閉器設置費」「CVTケーブル布設費」
-
-【出力形式】
-JSON配列で出力してください：
-```json
-[
-  {{
-    "name": "架橋ポリエチレンケーブル",
-    "specification": "6KV CVT38sq",
-    "quantity": 153,
-    "unit": "m",
-    "unit_price": 10300,
-    "amount": 1575900,
-    "discipline": "電気"
-  }},
-  {{
-    "name": "架橋ポリエチレンケーブル布設費",
-    "specification": "6KV CVT38sq",
-    "quantity": 153,
-    "unit": "m",
-    "unit_price": 2500,
-    "amount": 382500,
-    "discipline": "電気"
-  }}
-]
-```"""
-
+        # LLMで構造化データに変換（ページ単位のチャンクに分割して並列に抽出し、境界の重複・同上を処理）
         try:
-            response = self.client.messages.create(
-                model=self.model_name,
-                max_tokens=16000,  # 詳細な抽出のため増加
-                temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            # コスト記録
-            record_cost(
-                operation="KB抽出（単価）",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
+            items_data = extract_items_chunked(
+                self.client,
+                self.model_name,
+                text,
+                self._build_price_prompt,
+                operation=self.PRICE_EXTRACTION_OPERATION,
                 metadata={"file": Path(pdf_path).name}
             )
 
-            response_text = response.content[0].text
-
-            # JSONを抽出
-            json_start = response_text.find('[')
-            json_end = response_text.rfind(']') + 1
-
-            if json_start == -1 or json_end == 0:
-                logger.error("No JSON found in response")
-                return []
-
-            json_str = response_text[json_start:json_end]
-            items_data = json.loads(json_str)
-
             logger.info(f"Extracted {len(items_data)} price items")
 
             # PriceReferenceオブジェクトに変換
@@ -305,14 +242,85 @@ JSON配列で出力してください：
             logger.error(f"Error extracting prices: {e}")
             return []
 
+    def _build_price_prompt(self, text: str) -> str:
+        """見積書テキスト（チャンク）から単価情報を抽出するプロンプト"""
+        return f"""以下の見積書PDFのテキスト（長い見積書はページ単位に分割した一部）から、単価情報を抽出して単価データベース（KB）を構築します。
+
+見積書テキスト:
+{text}
+
+【抽出する情報】
+各見積項目について：
+1. 項目名（name）- 具体的で検索可能な名称
+2. 仕様（specification）- サイズ、型番、材質等
+3. 数量（quantity）
+4. 単位（unit）
+5. 単価（unit_price）- 必須
+6. 金額（amount）
+7. 工事区分（discipline）- 下記から選択
+
+【工事区分の判定基準】
+- 電気: キュービクル、分電盤、配電盤、ケーブル、CV、配線、照明、コンセント、接地、ブレーカー
+- 機械: ダクト、換気扇、ファン、ポンプ、エレベーター、ボイラー
+- 空調: エアコン、パッケージ、室外機、室内機、冷媒配管、ヒートポンプ
+- 衛生: 給水管、排水管、給湯、トイレ、洗面、受水槽
+- ガス: ガス管、ガスコンセント、ガス栓、PE管、ガスメーター
+- 消防: スプリンクラー、感知器、消火栓、誘導灯、火災報知
+
+【重要な処理ルール】
+1. **「同上」「〃」「上記と同じ」などの省略表記は、直前の具体的な項目名に置き換えて出力してください**
+   例: 「同上施工費」→「架橋ポリエチレンケーブル施工費」
+   例: 「同上支持材」→「600Vビニル絶縁電線支持材」
+   参照先の項目がテキスト内にない場合（テキストの先頭など）は「同上」のまま出力してください
+
+2. **以下の項目は除外してください:**
+   - 小計・合計・計行
+   - 項目名が空または「計」「小計」「合計」のみのもの
+   - 単価が0円または記載なしのもの
+   - 諸経費、法定福利費（率計算のため）
+
+3. **項目名は単独で意味が通じる形にしてください:**
+   悪い例: 「同上」「〃」「設置費」
+   良い例: 「気中開閉器設置費」「CVTケーブル布設費」
+
+【出力形式】
+JSON配列で出力してください：
+```json
+[
+  {{
+    "name": "架橋ポリエチレンケーブル",
+    "specification": "6KV CVT38sq",
+    "quantity": 153,
+    "unit": "m",
+    "unit_price": 10300,
+    "amount": 1575900,
+    "discipline": "電気"
+  }},
+  {{
+    "name": "架橋ポリエチレンケーブル布設費",
+    "specification": "6KV CVT38sq",
+    "quantity": 153,
+    "unit": "m",
+    "unit_price": 2500,
+    "amount": 382500,
+    "discipline": "電気"
+  }}
+]
+```"""
+
     def save_kb_to_json(self, price_refs: List[PriceReference], output_path: str):
         """KBをJSONファイルに保存"""
-        kb_data = [ref.model_dump(mode='json') for ref in price_refs]
+        self.save_kb_items([ref.model_dump(mode='json') for ref in price_refs], output_path)
 
+    def save_kb_items(self, kb_data: List[Dict[str, Any]], output_path: str):
+        """KB項目（dict）をJSONファイルに保存"""
         with open(output_path, 'w', encoding='utf-8') as f:
             json.dump(kb_data, f, ensure_ascii=False, indent=2, default=str)
 
-        logger.info(f"Saved {len(price_refs)} price references to {output_path}")
+        # 共有スナップショットを次回参照時に読み直す
+        get_kb_registry().invalidate(output_path)
+
+        logger.info(f"Saved {len(kb_data)} price references to {output_path}")
 
     def load_kb_from_json(self, kb_path: str) -> List[PriceReference]:
         """JSONファイルからKBを読み込み（古いフォーマット対応）"""
@@ -746,18 +754,34 @@ JSON配列で出力してください：
 
             all_refs.extend(refs)
 
+        return self.aggregate_price_refs(all_refs, method)
+
+    @staticmethod
+    def _merge_key(ref: PriceReference) -> tuple:
+        """統合・マージで同一項目とみなすキー（description, specification, unit）"""
+        return (ref.description, ref.features.get("specification", ""), ref.unit)
+
+    def aggregate_price_refs(
+        self,
+        all_refs: List[PriceReference],
+        method: str = "median"
+    ) -> List[PriceReference]:
+        """抽出済みの価格情報から、同一項目（description, specification, unit）の価格を統合
+
+        Args:
+            all_refs: PriceReferenceのリスト（複数見積から抽出したもの）
+            method: 統合方法 ("median" | "average" | "time_weighted")
+
+        Returns:
+            統合されたPriceReferenceのリスト（同一項目ごとに1件）
+        """
         logger.info(f"Total items before aggregation: {len(all_refs)}")
 
         # 同一項目をグループ化（description, specification, unitで）
         grouped: Dict[tuple, List[PriceReference]] = defaultdict(list)
 
         for ref in all_refs:
-            key = (
-                ref.description,
-                ref.features.get("specification", ""),
-                ref.unit
-            )
-            grouped[key].append(ref)
+            grouped[self._merge_key(ref)].append(ref)
 
         # 価格を統合
         aggregated_refs = []
@@ -880,13 +904,195 @@ JSON配列で出力してください：
         logger.info(f"Merge complete: {added_count} added, {updated_count} updated, {len(merged_refs)} total")
         return merged_refs
 
+    def consolidate_sources(
+        self,
+        source_paths: List[str],
+        method: str = "median",
+        merge_strategy: str = "keep_new"
+    ) -> int:
+        """
+        ソースファイルから抽出したKB項目を統合し、既存KBとマージ
+
+        update_kb_from_sources で追加した項目（KBマニフェストの記録）について、
+        同一項目の価格を統合（aggregate_price_refs）し、既存KBの同一項目を置き換えて（merge_with_existing_kb）保存します。
+        マニフェストの各ソースファイルの item_id は、統合後の項目のIDに付け替えます。
+
+        Args:
+            source_paths: 統合するソースファイル（通常は update_kb_from_sources の "extracted"）
+            method: 統合方法（aggregate_price_refs）
+            merge_strategy: マージ戦略（merge_with_existing_kb）
+
+        Returns:
+            保存したKBの項目数（ソースファイルがなければ何もせず現在の項目数）
+        """
+        manifest = KBManifest.for_kb(self.kb_path)
+        source_ids = {path: set(manifest.entry(path)["item_ids"]) for path in source_paths if manifest.entry(path)}
+        if not source_ids:
+            return len(self.kb_items)
+
+        refs_by_source = {
+            path: [PriceReference(**item) for item in self.kb_items if item.get("item_id") in item_ids]
+            for path, item_ids in source_ids.items()
+        }
+        aggregated = self.aggregate_price_refs(
+            [ref for refs in refs_by_source.values() for ref in refs], method=method
+        )
+        merged = self.merge_with_existing_kb(aggregated, merge_strategy=merge_strategy)
+
+        # 統合後の項目IDに付け替え（KBを先に保存）
+        final_ids = {self._merge_key(ref): ref.item_id for ref in aggregated}
+        self.save_kb_to_json(merged, self.kb_path)
+        for path, refs in refs_by_source.items():
+            manifest.set_item_ids(path, list(dict.fromkeys(final_ids[self._merge_key(ref)] for ref in refs)))
+        manifest.save()
+        return len(merged)
+
+    def _source_extractor(self, path: str) -> Tuple[bool, str, Optional[str], Optional[str]]:
+        """ソースファイルの (Excelか, 抽出処理の名前, プロンプトのバージョン, モデル)（KBマニフェストの照合用）"""
+        is_excel = Path(path).suffix.lower() in ('.xlsx', '.xls')
+        if is_excel:
+            return True, "excel", None, None
+        return False, "pdf", PROMPT_VERSIONS["pdf"], self.model_name
+
+    def batch_requests_for_sources(self, source_paths: List[str], force: bool = False) -> List[Dict[str, Any]]:
+        """
+        新規・変更された見積書PDFの抽出リクエスト（Message Batches API で一括実行する用）
+
+        update_kb_from_sources が再抽出するPDFについて、チャンクごとの呼び出しを
+        extract_estimate_from_pdf と同じ引数で作ります。バッチの結果を応答キャッシュに取り込んでから
+        update_kb_from_sources を実行すると、APIを呼ばずにKBを更新できます。
+        Excel・スキャンPDF（OCR）はLLMのチャンク抽出を使わないため含めません。
+
+        Args:
+            source_paths: 見積ファイルパスのリスト（Excel/PDF）
+            force: マニフェストに関係なく全ファイルを対象にするか
+
+        Returns:
+            llm_batch.batch_request() のリスト
+        """
+        manifest = KBManifest.for_kb(self.kb_path)
+        requests = []
+        for path in source_paths:
+            is_excel, extractor, prompt_version, model = self._source_extractor(path)
+            if is_excel:
+                continue
+            if not force and manifest.is_current(path, file_sha256(path), extractor,
+                                                 EXTRACTOR_VERSIONS[extractor], prompt_version, model):
+                continue
+
+            text = open_pdf(path).paged_text()
+            if len(text.strip()) < OCR_TEXT_THRESHOLD:
+                logger.info(f"Skipping scanned PDF in batch (extracted with OCR later): {path}")
+                continue
+
+            chunks = chunk_text(text)
+            for chunk in chunks:
+                requests.append(batch_request(
+                    chunk_request_params(self.model_name, chunk, self._build_price_prompt),
+                    operation=self.PRICE_EXTRACTION_OPERATION,
+                    cost_metadata={"file": Path(path).name, "chunk": chunk.index + 1, "chunks": len(chunks),
+                                   "pages": f"{chunk.first_page}-{chunk.last_page}"}
+                ))
+        logger.info(f"Prepared {len(requests)} batch requests from {len(source_paths)} sources")
+        return requests
+
+    def update_kb_from_sources(
+        self,
+        source_paths: List[str],
+        project_names: Optional[Dict[str, str]] = None,
+        retract_missing: bool = True,
+        force: bool = False
+    ) -> Dict[str, Any]:
+        """見積ファイル群からKBを差分更新（KBマニフェストで新規・変更ファイルだけ再抽出）
+
+        ソースファイルごとに、内容のハッシュ・抽出処理とプロンプトのバージョン・モデルが
+        マニフェストの記録と一致すれば再抽出しません。変更されたファイルは、そのファイルから
+        作った項目を取り除いて新しい項目に置き換えます。項目の item_id はソースファイルごとに
+        一意にするため（KBManifest.scoped_item_id）、同じ案件名の別ファイルの項目は取り除きません。ファイルごとにKBとマニフェストを保存するため、
+        中断しても抽出済みのファイルは次回再抽出されません。
+
+        Args:
+            source_paths: 見積ファイルパスのリスト（Excel/PDF）
+            project_names: パス → プロジェクト名（省略時はファイル名）
+            retract_missing: 削除されたソースファイルの項目をKBから取り除くか
+            force: マニフェストに関係なく全ファイルを再抽出するか
+
+        Returns:
+            {"extracted": [...], "unchanged": [...], "failed": [...], "retracted": [...],
+             "added_items": 件数, "removed_items": 件数, "total_items": 件数}
+        """
+        project_names = project_names or {}
+        manifest = KBManifest.for_kb(self.kb_path)
+        items = list(self.kb_items)
+        summary = {"extracted": [], "unchanged": [], "failed": [], "retracted": [],
+                   "added_items": 0, "removed_items": 0}
+
+        def commit():
+            # KBを先に保存（マニフェストだけ新しくなると、次回その項目のないファイルを再抽出しなくなるため）
+            self.save_kb_items(items, self.kb_path)
+            manifest.save()
+
+        for path in source_paths:
+            is_excel, extractor, prompt_version, model = self._source_extractor(path)
+            file_hash = file_sha256(path)
+
+            if not force and manifest.is_current(path, file_hash, extractor, EXTRACTOR_VERSIONS[extractor],
+                                                 prompt_version, model):
+                summary["unchanged"].append(path)
+                continue
+
+            project_name = project_names.get(path)
+            if is_excel:
+                refs = self.extract_estimate_from_excel(path, project_name)
+            else:
+                refs = self.extract_estimate_from_pdf(path, project_name)
+
+            if not refs:
+                # 抽出に失敗したファイルは既存の項目を残し、次回再抽出する
+                logger.warning(f"No items extracted from {path}, keeping previous items")
+                summary["failed"].append(path)
+                continue
+
+            refs = [ref.model_copy(update={"item_id": manifest.scoped_item_id(path, ref.item_id)}) for ref in refs]
+            new_ids = [ref.item_id for ref in refs]
+            old_ids = manifest.retract_ids(path)
+            before = len(items)
+            items = remove_items(items, old_ids)
+            summary["removed_items"] += before - len(items)
+            items.extend(ref.model_dump(mode='json') for ref in refs)
+            summary["added_items"] += len(refs)
+
+            manifest.record(path, file_hash, extractor, EXTRACTOR_VERSIONS[extractor],
+                            prompt_version, model, new_ids, project_name=project_name)
+            summary["extracted"].append(path)
+            commit()
+
+        if retract_missing:
+            missing = manifest.missing_sources()
+            for path in missing:
+                retracted = manifest.retract_ids(path)
+                manifest.remove(path)
+                before = len(items)
+                items = remove_items(items, retracted)
+                summary["removed_items"] += before - len(items)
+                summary["retracted"].append(path)
+                logger.info(f"Retracted {before - len(items)} items from deleted source: {path}")
+            if missing:
+                commit()
+
+        summary["total_items"] = len(items)
+        logger.info(f"KB update: {len(summary['extracted'])} extracted, {len(summary['unchanged'])} unchanged, "
+                    f"{len(summary['failed'])} failed, {len(summary['retracted'])} retracted "
+                    f"({summary['total_items']} items)")
+        return summary
+
 
 class EnhancedEstimateExtractor:
     """EstimateExtractorに信頼度スコアと根拠情報を追加"""
 
     def __init__(self, price_kb: List[PriceReference]):
         load_dotenv()
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.client = get_llm_gateway()
         self.model_name = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
         self.price_kb = price_kb
         logger.info(f"Initialized with {len(price_kb)} price references")
@@ -968,16 +1174,9 @@ JSON配列形式で出力してください：
                 model=self.model_name,
                 max_tokens=16000,
                 temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            # コスト記録
-            record_cost(
+                messages=[{"role": "user", "content": prompt}],
                 operation="見積抽出（信頼度付き）",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"discipline": discipline.value}
+                cost_metadata={"discipline": discipline.value}
             )
 
             response_text = response.content[0].text
@@ -0,0 +1,282 @@
+"""
+KB特徴量テーブル
+
+価格KBの各項目について、文字列マッチングで使う正規化テキスト・サイズ・
+カテゴリ・類義語セットをKB読み込み時に一度だけ計算して保持します。
+見積項目ごとにKB全件を正規化し直す処理を避けるためのものです。
+
+あわせて文字bigram・サイズ・カテゴリ・類義語から行番号への転置インデックスを
+持ち、スコアが付きうるKB行（候補）だけを絞り込めるようにします。
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Set, Tuple
+
+# 正規化時に除去する接尾辞（「工事」「費」「材」等を除去して比較しやすく）
+NORMALIZE_SUFFIXES = ['工事', '費', '工', '材料', '材']
+
+# 正規化時の類義語統一
+NORMALIZE_SYNONYMS = {
+    '穴補修': '穴補修',
+    '穴あけ': '穴補修',
+    '壁穿孔': '穴補修',
+    '貫通': '穴補修',
+    '撤去': '撤去',
+    '解体': '撤去',
+    '取り外し': '撤去',
+    '取外し': '撤去',
+    '取付': '取付',
+    '設置': '取付',
+    '据付': '取付',
+}
+
+# カテゴリキーワード（先に一致したものを採用）
+CATEGORY_KEYWORDS = [
+    "白ガス管", "カラー鋼管", "PE管", "露出結び",
+    "ガスコンセント", "ネジコック", "分岐コック",
+    "ボールスライドジョイント", "ガスメーター",
+    "配管支持金具", "穴あけ", "埋戻し", "コンクリート",
+    "高所作業車", "運搬", "諸経費", "試験", "検査", "撤去"
+]
+
+# サイズパターン: 数値 + 単位（A, mm, cm等）
+SIZE_PATTERN = re.compile(r'(\d+)\s*([Aａmcm]{1,2})', re.IGNORECASE)
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+# 転置インデックスの文字n-gram長（日本語でも形態素解析なしで部分一致を拾える長さ）
+NGRAM_SIZE = 2
+
+
+@lru_cache(maxsize=65536)
+def normalize_text(text: str) -> str:
+    """テキストを正規化（空白・記号を統一、類義語統一）"""
+    if not text:
+        return ""
+    # 全角→半角
+    text = text.replace('（', '(').replace('）', ')').replace('　', ' ')
+    # 記号の統一
+    text = text.replace('・', '').replace('/', '').replace('-', '')
+    # 複数空白を1つに
+    text = WHITESPACE_PATTERN.sub(' ', text)
+    text = text.strip().lower()
+
+    for suffix in NORMALIZE_SUFFIXES:
+        if text.endswith(suffix) and len(text) > len(suffix):
+            text = text[:-len(suffix)]
+
+    for key, value in NORMALIZE_SYNONYMS.items():
+        if key in text:
+            text = text.replace(key, value)
+
+    return text
+
+
+@lru_cache(maxsize=65536)
+def extract_size(text: str) -> str:
+    """テキストからサイズ情報を抽出（例: 15A, 20mm）"""
+    if not text:
+        return ""
+    match = SIZE_PATTERN.search(text)
+    if match:
+        return f"{match.group(1)}{match.group(2).upper()}"
+    return ""
+
+
+@lru_cache(maxsize=65536)
+def get_category(item_name: str) -> str:
+    """項目名からカテゴリを抽出（例: 白ガス管、PE管）"""
+    for category in CATEGORY_KEYWORDS:
+        if category in item_name:
+            return category
+    return ""
+
+
+def char_ngrams(text: str, n: int = NGRAM_SIZE) -> Set[str]:
+    """文字n-gramのセット（n文字未満のテキストは空）"""
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class KBFeatureRow(NamedTuple):
+    """KB項目1件分の特徴量"""
+    desc_norm: str
+    spec_norm: str
+    full_norm: str
+    size: str
+    category: str
+    synonyms_norm: FrozenSet[str]
+    unit: Optional[str]
+    unit_norm: str
+    discipline: str
+
+
+class KBFeatureTable:
+    """
+    価格KBの特徴量テーブル
+
+    KB項目と同じ並びで KBFeatureRow を保持します。類義語の展開結果は
+    項目名ごとにメモ化し、見積項目側の類義語取得にも使えます。
+
+    転置インデックスのキー:
+        d:<bigram>  項目名（正規化後）の文字bigram
+        s:<bigram>  仕様（正規化後）の文字bigram
+        f:<bigram>  項目名+仕様（正規化後）の文字bigram
+        size:<15A>  サイズ
+        cat:<白ガス管>  カテゴリ
+        syn:<類義語>  類義語（正規化後）
+    """
+
+    def __init__(self, kb_items: List[Dict], synonym_dict: Dict[str, List[str]]):
+        """
+        Args:
+            kb_items: 価格KB項目のリスト
+            synonym_dict: 類義語辞書（キー → 類義語リスト）
+        """
+        self.kb_items = kb_items
+        # 類義語辞書を正規化済みの形で保持
+        self._synonym_entries: List[Tuple[str, List[str], str, List[str]]] = [
+            (key, values, normalize_text(key), [normalize_text(v) for v in values])
+            for key, values in synonym_dict.items()
+        ]
+        self._synonym_memo: Dict[str, List[str]] = {}
+        self._synonym_norm_memo: Dict[str, FrozenSet[str]] = {}
+        self.rows: List[KBFeatureRow] = [self._build_row(item) for item in kb_items]
+        self._build_postings()
+
+    def _build_row(self, kb_item: Dict) -> KBFeatureRow:
+        """KB項目1件の特徴量を計算"""
+        kb_desc = kb_item.get("description", "")
+        kb_spec = kb_item.get("features", {}).get("specification", "")
+        kb_unit = kb_item.get("unit")
+        return KBFeatureRow(
+            desc_norm=normalize_text(kb_desc),
+            spec_norm=normalize_text(kb_spec),
+            full_norm=normalize_text(f"{kb_desc} {kb_spec}"),
+            size=extract_size(kb_spec),
+            category=get_category(kb_desc),
+            synonyms_norm=self.synonyms_norm(kb_desc),
+            unit=kb_unit,
+            unit_norm=normalize_text(kb_unit or ""),
+            discipline=kb_item.get("discipline", ""),
+        )
+
+    def _build_postings(self):
+        """転置インデックスと単位グループを作成"""
+        postings: Dict[str, List[int]] = {}
+        always_rows = []
+        unit_groups: Dict[Tuple[str, Optional[str], str], List[int]] = {}
+
+        for row_index, row in enumerate(self.rows):
+            tokens = {f"d:{g}" for g in char_ngrams(row.desc_norm)}
+            tokens.update(f"s:{g}" for g in char_ngrams(row.spec_norm))
+            tokens.update(f"f:{g}" for g in char_ngrams(row.full_norm))
+            tokens.update(f"syn:{syn}" for syn in row.synonyms_norm)
+            if row.size:
+                tokens.add(f"size:{row.size}")
+            if row.category:
+                tokens.add(f"cat:{row.category}")
+            for token in tokens:
+                postings.setdefault(token, []).append(row_index)
+
+            # bigramを持たない短い項目名・仕様は部分一致判定をインデックスで表せないため常に候補
+            if len(row.desc_norm) < NGRAM_SIZE or len(row.spec_norm) == 1:
+                always_rows.append(row_index)
+
+            unit_groups.setdefault((row.discipline, row.unit, row.unit_norm), []).append(row_index)
+
+        self._postings = postings
+        self._always_rows = always_rows
+        self.unit_groups = unit_groups
+
+    def candidate_rows(
+        self,
+        name_norm: str,
+        spec_norm: str,
+        size: str = "",
+        category: str = "",
+        synonyms_norm: FrozenSet[str] = frozenset(),
+    ) -> Optional[List[int]]:
+        """
+        見積項目と転置インデックスのキーを1つ以上共有するKB行番号を取得
+
+        項目名・仕様・サイズ・カテゴリ・類義語のいずれかでスコアが付く行は
+        必ず含まれます（それ以外の行の項目スコアは0）。
+
+        Args:
+            name_norm: 正規化済みの項目名
+            spec_norm: 正規化済みの仕様
+            size: サイズ（例: 15A）
+            category: カテゴリ
+            synonyms_norm: 正規化済みの類義語セット
+
+        Returns:
+            昇順の行番号リスト。インデックスで絞り込めない場合（項目名が空、
+            または項目名・仕様がbigramを作れない長さ）はNone（全件走査）
+        """
+        if len(name_norm) < NGRAM_SIZE or len(spec_norm) == 1:
+            return None
+
+        tokens = [f"d:{g}" for g in char_ngrams(name_norm)]
+        for g in char_ngrams(spec_norm):
+            tokens.append(f"s:{g}")
+            tokens.append(f"f:{g}")
+        tokens.extend(f"syn:{syn}" for syn in synonyms_norm)
+        if size:
+            tokens.append(f"size:{size}")
+        if category:
+            tokens.append(f"cat:{category}")
+
+        candidates = set(self._always_rows)
+        for token in tokens:
+            candidates.update(self._postings.get(token, ()))
+        return sorted(candidates)
+
+    def find_synonyms(self, item_name: str) -> List[str]:
+        """
+        項目名の類義語を取得
+
+        Args:
+            item_name: 見積項目名
+
+        Returns:
+            類義語リスト（元の項目名を含む）
+        """
+        cached = self._synonym_memo.get(item_name)
+        if cached is not None:
+            return list(cached)
+
+        synonyms = [item_name]
+        item_name_norm = normalize_text(item_name)
+
+        for key, values, key_norm, values_norm in self._synonym_entries:
+            # キーが項目名に含まれる、または項目名がキーに含まれる
+            if key_norm in item_name_norm or item_name_norm in key_norm:
+                synonyms.extend(values)
+                synonyms.append(key)
+                continue
+
+            # 類義語が項目名に含まれる
+            for value_norm in values_norm:
+                if value_norm in item_name_norm or item_name_norm in value_norm:
+                    synonyms.append(key)
+                    synonyms.extend(values)
+                    break
+
+        result = list(set(synonyms))
+        self._synonym_memo[item_name] = result
+        return list(result)
+
+    def synonyms_norm(self, item_name: str) -> FrozenSet[str]:
+        """項目名の類義語（正規化済み）のセット"""
+        cached = self._synonym_norm_memo.get(item_name)
+        if cached is None:
+            cached = frozenset(normalize_text(s) for s in self.find_synonyms(item_name))
+            self._synonym_norm_memo[item_name] = cached
+        return cached
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def is_for(self, kb_items: Optional[List[Dict]]) -> bool:
+        """指定のKBリストから作られたテーブルかどうか"""
+        return kb_items is self.kb_items and len(kb_items) == len(self.rows)
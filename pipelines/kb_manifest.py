@@ -0,0 +1,187 @@
+"""
+価格KBのソースファイル別マニフェスト
+
+KBを構築したソースファイル（見積書PDF・Excel）ごとに、
+ファイル内容のハッシュ・抽出処理のバージョン・プロンプトのバージョン・モデル・抽出日時と、
+そのファイルから作ったKB項目の item_id を記録します。
+item_id はソースファイルごとに一意にします（scoped_item_id。同じ案件名の見積書が複数あっても衝突しない）。
+
+KBの再構築時は、記録と一致するファイル（内容・抽出処理・プロンプト・モデルが同じ）の再抽出を省き、
+変更されたファイルは古い項目を取り除いてから新しい項目に置き換え、
+削除されたファイルの項目はKBから取り除きます。
+
+マニフェストはKBの隣に保存します（kb/price_kb.json → kb/price_kb_manifest.json）。
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from loguru import logger
+
+MANIFEST_VERSION = 1
+
+# ソースファイルのキーの基準ディレクトリ（プロジェクトルート。カレントディレクトリに依存させない）
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+
+
+def file_sha256(path: str) -> str:
+    """ファイル内容のSHA-256"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def manifest_path_for(kb_path: str) -> str:
+    """KBファイルに対応するマニフェストのパス"""
+    path = Path(kb_path)
+    return str(path.with_name(f"{path.stem}_manifest.json"))
+
+
+def remove_items(items: Iterable[Dict[str, Any]], item_ids: Iterable[str]) -> List[Dict[str, Any]]:
+    """item_id が item_ids に含まれる項目を除いたリスト"""
+    item_ids = set(item_ids)
+    return [item for item in items if item.get('item_id') not in item_ids]
+
+
+class KBManifest:
+    """
+    ソースファイルごとの抽出記録
+
+    ソースファイルのキーはプロジェクトルート（PROJECT_ROOT）からの相対パス（プロジェクト外は絶対パス）です。
+    どのディレクトリから実行しても同じファイルは同じキーになります。
+    """
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: マニフェストファイルのパス
+        """
+        self.path = path
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self.load()
+
+    @classmethod
+    def for_kb(cls, kb_path: str) -> "KBManifest":
+        """KBファイルに対応するマニフェストを読み込み"""
+        return cls(manifest_path_for(kb_path))
+
+    @staticmethod
+    def source_key(source_path: str) -> str:
+        """ソースファイルのキー"""
+        resolved = Path(source_path).resolve()
+        try:
+            return resolved.relative_to(PROJECT_ROOT).as_posix()
+        except ValueError:
+            return resolved.as_posix()
+
+    @staticmethod
+    def source_path(key: str) -> str:
+        """キーに対応するソースファイルの絶対パス"""
+        return str(PROJECT_ROOT / key)
+
+    @classmethod
+    def scoped_item_id(cls, source_path: str, item_id: str) -> str:
+        """
+        ソースファイルごとに一意な item_id（抽出時の item_id にソースファイルのキーのハッシュを付ける）
+
+        抽出時の item_id は「案件名_連番」のため、同じ案件名で抽出した別のファイルと衝突します。
+        """
+        digest = hashlib.sha256(cls.source_key(source_path).encode('utf-8')).hexdigest()[:8]
+        return f"{item_id}_{digest}"
+
+    def load(self):
+        """マニフェストを読み込み（ファイルがなければ空）"""
+        if not Path(self.path).exists():
+            self.entries = {}
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.entries = data.get('sources', {})
+        logger.debug(f"KB manifest loaded: {len(self.entries)} sources from {self.path}")
+
+    def save(self):
+        """マニフェストを保存（一時ファイルに書いてから置き換え）"""
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': MANIFEST_VERSION, 'sources': self.entries},
+                      f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    def entry(self, source_path: str) -> Optional[Dict[str, Any]]:
+        """ソースファイルの記録（なければNone）"""
+        return self.entries.get(self.source_key(source_path))
+
+    def is_current(self, source_path: str, file_hash: str, extractor: str,
+                   extractor_version: str, prompt_version: Optional[str],
+                   model: Optional[str]) -> bool:
+        """
+        記録がファイル内容・抽出処理・プロンプト・モデルと一致するか（一致すれば再抽出不要）
+
+        Args:
+            source_path: ソースファイルのパス
+            file_hash: ファイル内容のSHA-256
+            extractor: 抽出処理の名前（"pdf" / "excel" など）
+            extractor_version: 抽出処理のバージョン
+            prompt_version: プロンプトのバージョン（LLMを使わない抽出はNone）
+            model: 抽出に使うモデル（LLMを使わない抽出はNone）
+        """
+        entry = self.entry(source_path)
+        return entry is not None and (
+            entry.get('file_hash') == file_hash
+            and entry.get('extractor') == extractor
+            and entry.get('extractor_version') == extractor_version
+            and entry.get('prompt_version') == prompt_version
+            and entry.get('model') == model
+        )
+
+    def record(self, source_path: str, file_hash: str, extractor: str,
+               extractor_version: str, prompt_version: Optional[str],
+               model: Optional[str], item_ids: List[str], project_name: Optional[str] = None):
+        """ソースファイルの抽出結果を記録（既存の記録は置き換え）"""
+        self.entries[self.source_key(source_path)] = {
+            'file_hash': file_hash,
+            'extractor': extractor,
+            'extractor_version': extractor_version,
+            'prompt_version': prompt_version,
+            'model': model,
+            'project_name': project_name,
+            'extracted_at': datetime.now().isoformat(timespec='seconds'),
+            'item_ids': list(item_ids),
+        }
+
+    def set_item_ids(self, source_path: str, item_ids: List[str]):
+        """ソースファイルの記録の item_id を置き換え（KB項目を統合・マージした後など）"""
+        self.entries[self.source_key(source_path)]['item_ids'] = list(item_ids)
+
+    def remove(self, source_path: str) -> List[str]:
+        """ソースファイルの記録を削除し、そのファイルから作った item_id を返す"""
+        entry = self.entries.pop(self.source_key(source_path), None)
+        return entry['item_ids'] if entry else []
+
+    def missing_sources(self) -> List[str]:
+        """記録のうち、ソースファイルが削除されたもののパス（絶対パス）"""
+        return [self.source_path(key) for key in self.entries if not Path(self.source_path(key)).exists()]
+
+    def retract_ids(self, source_path: str) -> Set[str]:
+        """
+        ソースファイルの項目のうち、KBから取り除いてよい item_id
+
+        同じ item_id を他のソースファイルの記録でも使っている場合（同じ案件名で抽出した場合など）は除きます。
+        """
+        key = self.source_key(source_path)
+        entry = self.entries.get(key)
+        if entry is None:
+            return set()
+        owned_elsewhere = {
+            item_id
+            for other_key, other in self.entries.items() if other_key != key
+            for item_id in other['item_ids']
+        }
+        return set(entry['item_ids']) - owned_elsewhere
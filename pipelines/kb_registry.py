@@ -0,0 +1,250 @@
+"""
+KBレジストリ（プロセス共通）
+
+価格KB（kb/price_kb.json）とそこから作る派生インデックス、埋め込みモデルを
+プロセス内で1つだけ保持し、各モジュール・Streamlitセッションで共有します。
+
+- KBは読み取り専用のスナップショット（tuple）として渡します。項目は変更できないdict（FrozenDict）で、
+  項目中のリストはtupleになります。変更する場合は dict(item) / copy.deepcopy(item) でコピーしてください
+- ファイルの mtime / サイズが変わった場合は内容ハッシュを確認し、
+  内容が変わっていればスナップショットと派生インデックスを作り直します
+- 派生インデックス（特徴量テーブル・ベクトル検索など）はスナップショットごとにキャッシュします
+"""
+
+import copy
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from loguru import logger
+
+
+class FrozenDict(dict):
+    """
+    変更できないdict（KBスナップショットの項目）
+
+    スナップショットはプロセス内で共有されるため、変更しようとすると TypeError になります。
+    copy.copy / copy.deepcopy は変更できる通常のdictを返します。
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("KB snapshot items are read-only; copy with dict(item) or copy.deepcopy(item) first")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return {key: copy.deepcopy(value, memo) for key, value in self.items()}
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+
+def freeze(value: Any) -> Any:
+    """dictをFrozenDictに、リストをtupleに（入れ子も）変換"""
+    if isinstance(value, dict):
+        return FrozenDict({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class _KBEntry:
+    """1つのKBファイルのキャッシュ"""
+
+    def __init__(self, signature: Optional[Tuple[int, int]], content_hash: str, items: tuple):
+        self.signature = signature
+        self.content_hash = content_hash
+        self.items = items
+        self.derived: Dict[str, Any] = {}
+        self.derived_locks: Dict[str, threading.Lock] = {}
+
+
+class KBRegistry:
+    """
+    KBスナップショット・派生インデックス・埋め込みモデルの共有レジストリ
+
+    スレッドセーフです。get_kb_registry() でプロセス共通のインスタンスを取得してください。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries: Dict[str, _KBEntry] = {}
+        self._models: Dict[str, Any] = {}
+        self._model_lock = threading.Lock()
+
+    @staticmethod
+    def _key(kb_path: str) -> str:
+        return str(Path(kb_path).resolve())
+
+    def _refresh(self, kb_path: str) -> Optional[_KBEntry]:
+        """ファイルの変更を確認し、必要ならスナップショットを読み直す（ロック内で呼ぶ）"""
+        key = self._key(kb_path)
+        entry = self._entries.get(key)
+
+        try:
+            stat = os.stat(key)
+        except FileNotFoundError:
+            # set_kb() で設定した未保存のKBはそのまま使う
+            if entry is not None and entry.signature is None:
+                return entry
+            if entry is not None or key not in self._entries:
+                logger.warning(f"KB file not found: {kb_path}")
+            self._entries[key] = None
+            return None
+
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if entry is not None and entry.signature == signature:
+            return entry
+
+        with open(key, 'rb') as f:
+            content = f.read()
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        # 保存し直されただけで内容が同じなら派生インデックスも使い回す
+        if entry is not None and entry.content_hash == content_hash:
+            entry.signature = signature
+            return entry
+
+        items: tuple = ()
+        if content.strip():
+            try:
+                items = freeze(json.loads(content.decode('utf-8')))
+            except (json.JSONDecodeError, UnicodeDecodeError) as e:
+                logger.error(f"Invalid JSON in KB file {kb_path}: {e}")
+        else:
+            logger.warning(f"KB file is empty: {kb_path}")
+
+        entry = _KBEntry(signature, content_hash, items)
+        self._entries[key] = entry
+        logger.info(f"KB snapshot loaded: {len(items)} items from {kb_path} (hash={content_hash[:12]})")
+        return entry
+
+    def get_kb(self, kb_path: str) -> tuple:
+        """
+        KBの読み取り専用スナップショットを取得
+
+        Args:
+            kb_path: KBファイルのパス
+
+        Returns:
+            KB項目のtuple（ファイルがない場合は空tuple）。項目は変更できないdict（FrozenDict）
+        """
+        with self._lock:
+            entry = self._refresh(kb_path)
+            return entry.items if entry else ()
+
+    def set_kb(self, kb_path: str, items) -> tuple:
+        """
+        KBのスナップショットを置き換え（ファイルには保存しない）
+
+        派生インデックスは次回参照時に作り直します。KBファイルが更新されれば、
+        次回参照時にファイルの内容を読み直します。
+
+        Args:
+            kb_path: KBファイルのパス
+            items: KB項目のリスト
+
+        Returns:
+            新しいスナップショット
+        """
+        frozen = freeze(list(items))
+        content_hash = hashlib.sha256(
+            json.dumps(frozen, ensure_ascii=False, indent=2, default=str).encode('utf-8')
+        ).hexdigest()
+        key = self._key(kb_path)
+        with self._lock:
+            try:
+                stat = os.stat(key)
+                signature = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                signature = None
+            self._entries[key] = _KBEntry(signature, content_hash, frozen)
+        logger.info(f"KB snapshot set: {len(frozen)} items for {kb_path} (hash={content_hash[:12]})")
+        return frozen
+
+    def get_content_hash(self, kb_path: str) -> Optional[str]:
+        """現在のKBスナップショットの内容ハッシュ（ファイルがない場合はNone）"""
+        with self._lock:
+            entry = self._refresh(kb_path)
+            return entry.content_hash if entry else None
+
+    def get_derived(self, kb_path: str, name: str, builder: Callable[[tuple], Any]) -> Any:
+        """
+        KBスナップショットから作る派生オブジェクトを取得（スナップショットごとに1回だけ構築）
+
+        Args:
+            kb_path: KBファイルのパス
+            name: 派生オブジェクトの名前（例: "kb_features", "vector_search"）
+            builder: スナップショットを受け取って派生オブジェクトを作る関数
+
+        Returns:
+            派生オブジェクト（KBファイルがない場合は空tupleから構築したもの）
+        """
+        with self._lock:
+            entry = self._refresh(kb_path)
+            if entry is None:
+                return builder(())
+            if name in entry.derived:
+                return entry.derived[name]
+            build_lock = entry.derived_locks.setdefault(name, threading.Lock())
+
+        # 構築に時間がかかる場合でも他のKB読み込みを止めないよう、派生ごとのロックで構築
+        with build_lock:
+            if name not in entry.derived:
+                entry.derived[name] = builder(entry.items)
+            return entry.derived[name]
+
+    def get_embedding_model(self, model_name: str):
+        """
+        SentenceTransformerモデルを取得（プロセス内で1回だけロード）
+
+        Raises:
+            ImportError: sentence-transformersがインストールされていない場合
+        """
+        with self._model_lock:
+            model = self._models.get(model_name)
+            if model is None:
+                from sentence_transformers import SentenceTransformer
+                logger.info(f"Loading embedding model: {model_name}")
+                model = SentenceTransformer(model_name)
+                self._models[model_name] = model
+            return model
+
+    def invalidate(self, kb_path: Optional[str] = None):
+        """
+        キャッシュを破棄（KBファイルを書き換えた直後など）
+
+        Args:
+            kb_path: 対象KBのパス（Noneで全KB）
+        """
+        with self._lock:
+            if kb_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(self._key(kb_path), None)
+
+
+# シングルトンインスタンス
+_registry: Optional[KBRegistry] = None
+_registry_lock = threading.Lock()
+
+
+def get_kb_registry() -> KBRegistry:
+    """プロセス共通のKBレジストリを取得"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = KBRegistry()
+        return _registry
+
+
+def load_kb_snapshot(kb_path: str) -> tuple:
+    """KBの読み取り専用スナップショットを取得（ショートカット関数）"""
+    return get_kb_registry().get_kb(kb_path)
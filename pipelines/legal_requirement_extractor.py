@@ -8,13 +8,12 @@ from pathlib import Path
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from dotenv import load_dotenv
-from anthropic import Anthropic
 from loguru import logger
 
 from pipelines.schemas import (
     DisciplineType, LegalReference, Requirement, EstimateItem
 )
-from pipelines.cost_tracker import record_cost
+from pipelines.llm_gateway import get_llm_gateway
 
 
 class LegalRequirementExtractor:
@@ -70,7 +69,7 @@ class LegalRequirementExtractor:
 
     def __init__(self):
         load_dotenv()
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.client = get_llm_gateway()
         self.model_name = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-20250514")
 
     def extract_legal_requirements(
@@ -183,16 +182,9 @@ class LegalRequirementExtractor:
                 model=self.model_name,
                 max_tokens=16000,
                 temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            # コスト記録
-            record_cost(
+                messages=[{"role": "user", "content": prompt}],
                 operation="法令要件抽出",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"source": "extract_legal_requirements", "discipline": discipline.value}
+                cost_metadata={"source": "extract_legal_requirements", "discipline": discipline.value}
             )
 
             response_text = response.content[0].text
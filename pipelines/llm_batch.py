@@ -0,0 +1,262 @@
+"""
+Message Batches API による一括実行
+
+KBの夜間再構築など、すぐに結果が要らない大量の呼び出し（temperature=0）を
+Message Batches API でまとめて送ります。料金は同期呼び出しの半額で、呼び出しを1件ずつ待つ必要がありません。
+
+- submit(): リクエストを1つのバッチで送信し、バッチIDとリクエストをジョブファイルに保存
+  （応答キャッシュにあるリクエストは送らない）
+- poll() / wait(): バッチの処理状況を確認（ジョブファイルがあればプロセスを再起動しても続きから確認できる）
+- ingest(): 完了したバッチの結果を応答キャッシュ（llm_response_cache）に保存し、コストをバッチ料金で記録
+  （LLMゲートウェイの record_batch_result。出力が max_tokens で切れた結果も保存する）
+
+結果は同期呼び出しと同じ引数をキーに応答キャッシュに入るため、その後の通常の処理
+（extract_items_chunked など）はAPIを呼ばずにキャッシュから結果を得ます。
+失敗・期限切れのリクエストはキャッシュに入らないため、通常の処理で同期呼び出しになります。
+"""
+
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from pipelines.llm_gateway import LLMGateway, call_with_rate_limit_retry, get_llm_gateway
+from pipelines.llm_response_cache import cache_key, is_cacheable
+
+# ジョブファイルの保存先・処理状況の確認間隔（秒）（環境変数で変更可能）
+BATCH_JOB_DIR = os.getenv("LLM_BATCH_JOB_DIR", "cache/batches")
+BATCH_POLL_INTERVAL = float(os.getenv("LLM_BATCH_POLL_SECONDS", "60"))
+
+# 1バッチあたりのリクエスト数の上限（API の制限）
+BATCH_MAX_REQUESTS = 100_000
+
+DEFAULT_OPERATION = "LLM呼び出し（バッチ）"
+
+
+def batch_request(params: Dict[str, Any], operation: Optional[str] = None,
+                  cost_metadata: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    submit() に渡すリクエスト
+
+    Args:
+        params: messages.create の引数（temperature=0 のもの）
+        operation: コスト記録の処理名
+        cost_metadata: コスト記録のメタデータ
+    """
+    return {"params": params, "operation": operation or DEFAULT_OPERATION, "metadata": cost_metadata or {}}
+
+
+class LLMBatchJob:
+    """
+    Message Batches API のジョブ（1つのバッチ）
+
+    ジョブファイル（JSON）にバッチID・処理状況・送信したリクエストを保存します。
+    custom_id は応答キャッシュのキー（リクエストの引数のSHA-256）です。
+    """
+
+    def __init__(self, path: str, client=None, gateway: Optional[LLMGateway] = None):
+        """
+        Args:
+            path: ジョブファイルのパス
+            client: Anthropic クライアント（Noneで LLMゲートウェイのクライアント）
+            gateway: 結果の保存・コスト記録を行うLLMゲートウェイ（Noneで get_llm_gateway()）
+        """
+        self.path = path
+        self._client = client
+        self.gateway = gateway or get_llm_gateway()
+        self.response_cache = self.gateway.response_cache
+        self.state: Dict[str, Any] = {}
+        self.load()
+
+    @classmethod
+    def named(cls, name: str, **kwargs) -> "LLMBatchJob":
+        """BATCH_JOB_DIR のジョブ（name.json）"""
+        return cls(str(Path(BATCH_JOB_DIR) / f"{name}.json"), **kwargs)
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = self.gateway.client
+        return self._client
+
+    @property
+    def batch_id(self) -> Optional[str]:
+        return self.state.get("batch_id")
+
+    @property
+    def status(self) -> Optional[str]:
+        """バッチの処理状況（"in_progress" / "canceling" / "ended"。未送信はNone）"""
+        return self.state.get("processing_status")
+
+    @property
+    def pending(self) -> bool:
+        """送信済みで、結果をまだ取り込んでいないか"""
+        return self.batch_id is not None and not self.state.get("ingested_at")
+
+    def load(self):
+        """ジョブファイルを読み込み（ファイルがなければ空）"""
+        if not Path(self.path).exists():
+            self.state = {}
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            self.state = json.load(f)
+
+    def save(self):
+        """ジョブファイルを保存（一時ファイルに書いてから置き換え）"""
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        """ジョブファイルを削除（次の submit() で新しいバッチを送れるようにする）"""
+        self.state = {}
+        Path(self.path).unlink(missing_ok=True)
+
+    def submit(self, requests: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        リクエストを1つのバッチで送信
+
+        同じ引数のリクエスト・応答キャッシュにあるリクエストは送りません。
+
+        Args:
+            requests: batch_request() のリスト
+
+        Returns:
+            バッチID（送るリクエストがなければNone）
+
+        Raises:
+            RuntimeError: 結果を取り込んでいないバッチがある場合・応答キャッシュが無効の場合
+            ValueError: temperature=0 でないリクエストがある場合・リクエスト数が上限を超える場合
+        """
+        if self.pending:
+            raise RuntimeError(f"Batch {self.batch_id} has not been ingested yet ({self.path})")
+        if not self.response_cache.enabled:
+            raise RuntimeError("Batch results are delivered through the LLM response cache, which is disabled")
+
+        entries: Dict[str, Dict[str, Any]] = {}
+        cached = 0
+        for request in requests:
+            params = request["params"]
+            if not is_cacheable(params):
+                raise ValueError("Only temperature=0 requests can be sent in a batch")
+            custom_id = cache_key(params)
+            if custom_id in entries:
+                continue
+            if self.response_cache.contains(params):
+                cached += 1
+                continue
+            entries[custom_id] = request
+
+        if not entries:
+            logger.info(f"Batch: all {cached} requests are already cached, nothing to submit")
+            return None
+        if len(entries) > BATCH_MAX_REQUESTS:
+            raise ValueError(f"Batch has {len(entries)} requests (limit {BATCH_MAX_REQUESTS})")
+
+        batch = call_with_rate_limit_retry(
+            lambda: self.client.messages.batches.create(requests=[
+                {"custom_id": custom_id, "params": request["params"]}
+                for custom_id, request in entries.items()
+            ]),
+            label="message batch",
+        )
+        self.state = {
+            "batch_id": batch.id,
+            "processing_status": batch.processing_status,
+            "submitted_at": datetime.now().isoformat(timespec='seconds'),
+            "request_counts": {},
+            "requests": entries,
+        }
+        self.save()
+        logger.info(f"Batch {batch.id} submitted: {len(entries)} requests ({cached} already cached)")
+        return batch.id
+
+    def poll(self) -> Optional[str]:
+        """
+        バッチの処理状況を確認してジョブファイルを更新
+
+        Returns:
+            処理状況（"in_progress" / "canceling" / "ended"。バッチがなければNone）
+        """
+        if self.batch_id is None:
+            return None
+        batch = call_with_rate_limit_retry(
+            lambda: self.client.messages.batches.retrieve(self.batch_id),
+            label="message batch",
+        )
+        self.state["processing_status"] = batch.processing_status
+        self.state["request_counts"] = batch.request_counts.model_dump()
+        self.save()
+        logger.info(f"Batch {self.batch_id}: {batch.processing_status} {self.state['request_counts']}")
+        return batch.processing_status
+
+    def wait(self, poll_interval: Optional[float] = None, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        バッチが完了するまで poll() を繰り返す
+
+        Args:
+            poll_interval: 確認間隔（秒。Noneで BATCH_POLL_INTERVAL）
+            timeout: 待つ時間の上限（秒。Noneで無制限）
+
+        Returns:
+            最後に確認した処理状況
+        """
+        poll_interval = BATCH_POLL_INTERVAL if poll_interval is None else poll_interval
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            status = self.poll()
+            if status in (None, "ended"):
+                return status
+            if deadline is not None and time.monotonic() >= deadline:
+                return status
+            time.sleep(poll_interval)
+
+    def ingest(self) -> Dict[str, int]:
+        """
+        完了したバッチの結果を応答キャッシュに保存し、コストをバッチ料金で記録
+
+        Returns:
+            結果の種類別の件数（succeeded / errored / canceled / expired）
+
+        Raises:
+            RuntimeError: バッチが完了していない場合
+        """
+        if not self.pending:
+            return {}
+        if self.status != "ended":
+            raise RuntimeError(f"Batch {self.batch_id} has not ended yet ({self.status})")
+
+        requests = self.state["requests"]
+        counts = {"succeeded": 0, "errored": 0, "canceled": 0, "expired": 0}
+        for entry in self.client.messages.batches.results(self.batch_id):
+            result_type = entry.result.type
+            counts[result_type] = counts.get(result_type, 0) + 1
+            request = requests.get(entry.custom_id)
+            if request is None:
+                logger.warning(f"Batch {self.batch_id}: unknown custom_id {entry.custom_id}")
+                continue
+            if result_type != "succeeded":
+                error = getattr(entry.result, "error", None)
+                logger.warning(f"Batch {self.batch_id}: {entry.custom_id[:12]} {result_type} {error or ''}")
+                continue
+
+            message = entry.result.message
+            if getattr(message, "stop_reason", None) == "max_tokens":
+                logger.warning(f"Batch {self.batch_id}: {entry.custom_id[:12]} output reached max_tokens")
+            self.gateway.record_batch_result(
+                request["params"], message,
+                operation=request["operation"],
+                cost_metadata={**request["metadata"], "batch_id": self.batch_id}
+            )
+
+        self.state["ingested_at"] = datetime.now().isoformat(timespec='seconds')
+        self.state["results"] = counts
+        self.save()
+        logger.info(f"Batch {self.batch_id} ingested: {counts}")
+        return counts
@@ -0,0 +1,382 @@
+"""
+LLMゲートウェイ（プロセス共通）
+
+Claude API の呼び出しをこのモジュールに集約します。
+
+- Anthropicクライアントはプロセスで1つだけ作成し、HTTP接続（コネクションプール）を共有
+- モデルごとの同時実行数の上限（LLM_MODEL_CONCURRENCY）
+- レート制限（429）・過負荷（529）・一時的なエラー（接続エラー・タイムアウト・408/409/5xx）は
+  retry-after または指数バックオフでリトライ（SDK のリトライは使わない）
+- 同じリクエスト（モデル・プロンプト・パラメータがすべて同じ）が実行中なら、API を呼ばずにその結果を共有
+- temperature=0 の応答はディスクにキャッシュし、同じリクエストでは API を呼ばない（llm_response_cache）
+- stream_text() でストリーミング応答のテキストを届いた順に受け取れる
+- コスト記録（record_cost。プロンプトキャッシュのトークン数・所要時間を含む）はここでだけ行う
+  （Message Batches API の結果も record_batch_result() で記録）
+
+各モジュールは get_llm_gateway() を self.client として持ち、これまでどおり
+client.messages.create(...) を呼びます。コスト記録用に operation（処理名）と
+cost_metadata（メタデータ）を追加の引数として渡せます。
+"""
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Iterator, Optional, TypeVar
+
+from anthropic import APIConnectionError, APIStatusError, RateLimitError
+from loguru import logger
+
+from pipelines.cost_tracker import record_cost
+from pipelines.llm_response_cache import LLMResponseCache, get_response_cache
+
+# モデルごとの同時実行数・タイムアウト（秒）（環境変数で変更可能）
+DEFAULT_MODEL_CONCURRENCY = int(os.getenv("LLM_MODEL_CONCURRENCY", "8"))
+DEFAULT_TIMEOUT = float(os.getenv("LLM_TIMEOUT_SECONDS", "600"))
+
+# レート制限時のリトライ回数・待ち時間（秒）
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("LLM_RATE_LIMIT_RETRIES", os.getenv("VISION_RATE_LIMIT_RETRIES", "5")))
+RATE_LIMIT_BASE_DELAY = 2.0
+RATE_LIMIT_MAX_DELAY = 60.0
+
+# リトライ対象のHTTPステータス（429: レート制限, 529: 過負荷）
+RETRYABLE_STATUS_CODES = (429, 529)
+
+# 一時的なエラーとしてリトライするHTTPステータス（408: タイムアウト, 409: 競合, 5xx: サーバーエラー）
+TRANSIENT_STATUS_CODES = (408, 409, 500, 502, 503, 504)
+
+# コスト記録の処理名（operation を指定しなかった場合）
+DEFAULT_OPERATION = "LLM呼び出し"
+
+T = TypeVar("T")
+
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """レート制限・過負荷エラーかどうか"""
+    if isinstance(error, RateLimitError):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code in RETRYABLE_STATUS_CODES
+
+
+def is_retryable_error(error: BaseException) -> bool:
+    """リトライすべきエラーか（レート制限・過負荷・接続エラー・タイムアウト・一時的なサーバーエラー）"""
+    if is_rate_limit_error(error) or isinstance(error, APIConnectionError):
+        return True
+    return isinstance(error, APIStatusError) and (
+        error.status_code in TRANSIENT_STATUS_CODES or error.status_code >= 500
+    )
+
+
+def _retry_after_seconds(error: BaseException) -> Optional[float]:
+    """レスポンスの retry-after ヘッダー（秒）を取得"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        value = response.headers.get("retry-after")
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_rate_limit_retry(
+    func: Callable[[], T],
+    label: str = "",
+    max_retries: Optional[int] = None,
+    base_delay: float = RATE_LIMIT_BASE_DELAY,
+    max_delay: float = RATE_LIMIT_MAX_DELAY,
+) -> T:
+    """
+    API呼び出しを実行し、レート制限・過負荷・一時的なエラーの場合はバックオフしてリトライ
+
+    Anthropicクライアントは max_retries=0 で作成するため、SDK がリトライしていたエラー
+    （接続エラー・タイムアウト・408/409/5xx）もここでリトライします（is_retryable_error）。
+    待ち時間は retry-after ヘッダーがあればそれに従い、なければ指数バックオフ（ジッター付き）。
+    それ以外のエラーはそのまま送出します。
+
+    Args:
+        func: API呼び出し（引数なし）
+        label: ログ用のラベル（例: "OCR page 3"）
+        max_retries: 最大リトライ回数（Noneで RATE_LIMIT_MAX_RETRIES）
+        base_delay: 初回の待ち時間（秒）
+        max_delay: 待ち時間の上限（秒）
+
+    Returns:
+        func の戻り値
+    """
+    retries = RATE_LIMIT_MAX_RETRIES if max_retries is None else max_retries
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if not is_retryable_error(e) or attempt >= retries:
+                raise
+            delay = _retry_after_seconds(e)
+            if delay is None:
+                delay = base_delay * (2 ** attempt) * (0.5 + random.random() / 2)
+            delay = min(delay, max_delay)
+            attempt += 1
+            reason = "Rate limited" if is_rate_limit_error(e) else f"Transient error {type(e).__name__}"
+            logger.warning(f"{reason} ({label}): retry {attempt}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def request_key(params: Dict[str, Any]) -> str:
+    """リクエストの同一性を判定するキー（パラメータのJSONのハッシュ）"""
+    canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class _Messages:
+    """Anthropicクライアントの messages と同じ呼び出し方をするためのラッパー"""
+
+    def __init__(self, gateway: "LLMGateway"):
+        self._gateway = gateway
+
+    def create(self, operation: Optional[str] = None, cost_metadata: Optional[Dict[str, Any]] = None,
+               **params):
+        """client.messages.create と同じ引数でメッセージを作成（operation・cost_metadata はコスト記録用）"""
+        return self._gateway.create_message(operation=operation, cost_metadata=cost_metadata, **params)
+
+
+class LLMGateway:
+    """
+    Claude API の共有ゲートウェイ
+
+    スレッドセーフです。get_llm_gateway() でプロセス共通のインスタンスを取得してください。
+    """
+
+    def __init__(self, api_key: Optional[str] = None, timeout: float = DEFAULT_TIMEOUT,
+                 model_concurrency: int = DEFAULT_MODEL_CONCURRENCY,
+                 max_retries: Optional[int] = None,
+                 response_cache: Optional[LLMResponseCache] = None):
+        """
+        Args:
+            api_key: Anthropic API key（Noneの場合は環境変数 ANTHROPIC_API_KEY）
+            timeout: 1回の呼び出しのタイムアウト（秒）
+            model_concurrency: モデルごとの同時実行数の上限
+            max_retries: レート制限時の最大リトライ回数（Noneで RATE_LIMIT_MAX_RETRIES）
+            response_cache: 応答キャッシュ（Noneで get_response_cache()）
+        """
+        self.api_key = api_key
+        self.timeout = timeout
+        self.model_concurrency = max(1, model_concurrency)
+        self.max_retries = max_retries
+        self.response_cache = response_cache or get_response_cache()
+        self.messages = _Messages(self)
+
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, Future] = {}
+        self._stats = {"requests": 0, "api_calls": 0, "coalesced": 0}
+
+    @property
+    def client(self):
+        """共有のAnthropicクライアント（最初に使う時に作成。リトライはゲートウェイで行う）"""
+        with self._client_lock:
+            if self._client is None:
+                from anthropic import Anthropic
+                from dotenv import load_dotenv
+                load_dotenv()
+                self._client = Anthropic(
+                    api_key=self.api_key or os.getenv("ANTHROPIC_API_KEY"),
+                    timeout=self.timeout,
+                    max_retries=0,
+                )
+            return self._client
+
+    def _semaphore(self, model: str) -> threading.BoundedSemaphore:
+        """モデルごとの同時実行数の上限"""
+        with self._lock:
+            semaphore = self._semaphores.get(model)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.model_concurrency)
+                self._semaphores[model] = semaphore
+            return semaphore
+
+    def _send(self, params: Dict[str, Any]):
+        """APIを1回呼び出す（同時実行数の上限内で）"""
+        with self._semaphore(params.get("model", "")):
+            with self._lock:
+                self._stats["api_calls"] += 1
+            return self.client.messages.create(**params)
+
+    def create_message(self, operation: Optional[str] = None,
+                       cost_metadata: Optional[Dict[str, Any]] = None, **params):
+        """
+        メッセージを作成（応答キャッシュ・リトライ・同一リクエストの共有・コスト記録付き）
+
+        応答キャッシュにヒットした場合は API を呼ばず、コストも記録しません。
+
+        Args:
+            operation: コスト記録の処理名
+            cost_metadata: コスト記録のメタデータ
+            **params: client.messages.create の引数（model, max_tokens, messages など）
+
+        Returns:
+            Anthropic の Message（同じリクエストが実行中だった場合はその結果と同じオブジェクト）
+        """
+        if params.get("stream"):
+            raise ValueError("Streaming requests are not supported by LLMGateway.create_message")
+
+        cached = self.response_cache.get(params)
+        if cached is not None:
+            return cached
+
+        key = request_key(params)
+        with self._lock:
+            self._stats["requests"] += 1
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._in_flight[key] = future
+            else:
+                self._stats["coalesced"] += 1
+
+        if not leader:
+            # 同じリクエストが実行中: 結果（または例外）を共有し、コストは記録しない
+            logger.debug(f"Coalesced identical in-flight request ({operation or DEFAULT_OPERATION})")
+            return future.result()
+
+        start = time.perf_counter()
+        try:
+            response = call_with_rate_limit_retry(
+                lambda: self._send(params),
+                label=operation or params.get("model", ""),
+                max_retries=self.max_retries,
+            )
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(response)
+            self.response_cache.put(params, response)
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+
+        self._record_cost(response, params, operation, cost_metadata, time.perf_counter() - start)
+        return response
+
+    def stream_text(self, operation: Optional[str] = None,
+                    cost_metadata: Optional[Dict[str, Any]] = None, **params) -> Iterator[str]:
+        """
+        メッセージをストリーミングで作成し、応答テキストを届いた順に返すジェネレータ
+
+        応答キャッシュにヒットした場合は、キャッシュ済みの応答テキストを1回で返します。
+        レート制限のリトライは応答の受信開始前のみ行い、同じリクエストの共有は行いません。
+        コストは応答を最後まで受信した時点で記録します。
+
+        Args:
+            operation: コスト記録の処理名
+            cost_metadata: コスト記録のメタデータ
+            **params: client.messages.stream の引数（model, max_tokens, messages など）
+
+        Yields:
+            応答テキストの断片
+        """
+        with self._lock:
+            self._stats["requests"] += 1
+
+        cached = self.response_cache.get(params)
+        if cached is not None:
+            yield "".join(getattr(block, "text", "") for block in cached.content)
+            return
+
+        semaphore = self._semaphore(params.get("model", ""))
+
+        def open_stream():
+            semaphore.acquire()
+            try:
+                with self._lock:
+                    self._stats["api_calls"] += 1
+                manager = self.client.messages.stream(**params)
+                return manager, manager.__enter__()
+            except BaseException:
+                semaphore.release()
+                raise
+
+        start = time.perf_counter()
+        manager, stream = call_with_rate_limit_retry(
+            open_stream,
+            label=operation or params.get("model", ""),
+            max_retries=self.max_retries,
+        )
+        try:
+            for text in stream.text_stream:
+                yield text
+            response = stream.get_final_message()
+        finally:
+            manager.__exit__(None, None, None)
+            semaphore.release()
+
+        self.response_cache.put(params, response)
+        self._record_cost(response, params, operation, cost_metadata, time.perf_counter() - start)
+
+    def record_batch_result(self, params: Dict[str, Any], response, operation: Optional[str] = None,
+                            cost_metadata: Optional[Dict[str, Any]] = None):
+        """
+        Message Batches API の結果を応答キャッシュに保存し、コストをバッチ料金で記録（llm_batch から使う）
+
+        出力が max_tokens で切れた応答も保存します（同じリクエストを同期呼び出しで再実行すると
+        料金を二重に払い、同じように切れた結果になるため。切れたJSONの復元は呼び出し側で行う）。
+
+        Args:
+            params: バッチで送った messages.create の引数
+            response: 結果の Anthropic の Message
+            operation: コスト記録の処理名
+            cost_metadata: コスト記録のメタデータ
+        """
+        self.response_cache.put(params, response, allow_truncated=True)
+        self._record_cost(response, params, operation, cost_metadata, None, batch=True)
+
+    def _record_cost(self, response, params: Dict[str, Any], operation: Optional[str],
+                     cost_metadata: Optional[Dict[str, Any]], latency_seconds: Optional[float],
+                     batch: bool = False):
+        """応答のトークン数でコストを記録（batch=True は Message Batches API の料金）"""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return
+        record_cost(
+            operation=operation or DEFAULT_OPERATION,
+            model_name=params.get("model", ""),
+            input_tokens=usage.input_tokens,
+            output_tokens=usage.output_tokens,
+            metadata=cost_metadata or {},
+            cache_creation_input_tokens=getattr(usage, "cache_creation_input_tokens", None) or 0,
+            cache_read_input_tokens=getattr(usage, "cache_read_input_tokens", None) or 0,
+            latency_seconds=round(latency_seconds, 2) if latency_seconds is not None else None,
+            batch=batch
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """呼び出し回数の集計（requests: 要求数, api_calls: API呼び出し数（リトライを含む）, coalesced: 共有した要求数）"""
+        with self._lock:
+            return dict(self._stats)
+
+
+# シングルトンインスタンス（API keyごと）
+_gateways: Dict[Optional[str], LLMGateway] = {}
+_gateways_lock = threading.Lock()
+
+
+def get_llm_gateway(api_key: Optional[str] = None) -> LLMGateway:
+    """
+    プロセス共通のLLMゲートウェイを取得
+
+    Args:
+        api_key: Anthropic API key（Noneで環境変数。指定したキーごとに別のゲートウェイ）
+    """
+    with _gateways_lock:
+        gateway = _gateways.get(api_key)
+        if gateway is None:
+            gateway = LLMGateway(api_key=api_key)
+            _gateways[api_key] = gateway
+        return gateway
@@ -0,0 +1,326 @@
+"""
+LLM応答の永続キャッシュ（SQLite）
+
+temperature=0 の呼び出し（建物情報抽出・諸元表抽出・見積書PDFのKB化・法令要件抽出など）は、
+同じ入力なら同じ結果になるため、開発中や再見積で同じプロンプトを繰り返し送らないよう
+応答をディスクに保存して再利用します。
+
+- キー: リクエストのパラメータ全体（モデル・max_tokens・system・画像のBase64を含むメッセージ）のSHA-256
+- 容量の上限（LLM_RESPONSE_CACHE_MAX_MB）を超えたら、最後に使ってから長いものから削除（LRU）
+- 有効期限（LLM_RESPONSE_CACHE_TTL_DAYS）を過ぎた応答は使わない
+- LLM_RESPONSE_CACHE=0 または set_enabled(False) で無効化（読み書きしない）
+- ヒット・ミスの回数と、ヒットで節約したトークン数（モデル別）を記録（pages/4.py の利用状況に表示）
+
+LLMゲートウェイ（llm_gateway）から使います。複数プロセス（一括取り込みのワーカーなど）から同時に使えます。
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from loguru import logger
+
+# キャッシュの有効・保存先・容量（MB）・有効期限（日）（環境変数で変更可能）
+RESPONSE_CACHE_ENABLED = os.getenv("LLM_RESPONSE_CACHE", "1").lower() not in ("0", "false", "off", "no")
+RESPONSE_CACHE_PATH = os.getenv("LLM_RESPONSE_CACHE_PATH", "cache/llm_responses.sqlite3")
+RESPONSE_CACHE_MAX_MB = float(os.getenv("LLM_RESPONSE_CACHE_MAX_MB", "512"))
+RESPONSE_CACHE_TTL_DAYS = float(os.getenv("LLM_RESPONSE_CACHE_TTL_DAYS", "30"))
+
+# 容量を超えた場合に、上限のこの割合まで削除する
+EVICTION_TARGET_RATIO = 0.9
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT NOT NULL,
+    body TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    input_tokens INTEGER NOT NULL DEFAULT 0,
+    output_tokens INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_last_access ON responses (last_access);
+CREATE TABLE IF NOT EXISTS stats (
+    model TEXT PRIMARY KEY,
+    hits INTEGER NOT NULL DEFAULT 0,
+    misses INTEGER NOT NULL DEFAULT 0,
+    saved_input_tokens INTEGER NOT NULL DEFAULT 0,
+    saved_output_tokens INTEGER NOT NULL DEFAULT 0,
+    evictions INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def is_cacheable(params: Dict[str, Any]) -> bool:
+    """キャッシュしてよいリクエストか（temperature=0 を指定した、ストリーミングでない呼び出し）"""
+    return params.get("temperature") == 0 and not params.get("stream")
+
+
+def cache_key(params: Dict[str, Any]) -> str:
+    """キャッシュキー（パラメータ全体のJSONのSHA-256。画像はBase64のまま含む）"""
+    canonical = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _serialize(response: Any) -> Optional[str]:
+    """Anthropic の Message をJSON文字列に変換（変換できない応答はNone）"""
+    dump = getattr(response, "model_dump_json", None)
+    return dump() if callable(dump) else None
+
+
+def _deserialize(body: str):
+    """JSON文字列から Anthropic の Message を復元"""
+    from anthropic.types import Message
+    return Message.model_validate_json(body)
+
+
+class LLMResponseCache:
+    """
+    SQLiteによるLLM応答キャッシュ
+
+    接続はプロセスごとに1つ作り、スレッド間ではロックで共有します。
+    複数の文を実行する操作はトランザクション（_transaction）で囲み、他のプロセスの書き込みと混ざらないようにします。
+    """
+
+    def __init__(self, path: str = RESPONSE_CACHE_PATH, enabled: bool = RESPONSE_CACHE_ENABLED,
+                 max_bytes: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        """
+        Args:
+            path: SQLiteファイルのパス
+            enabled: Falseの場合は読み書きしない
+            max_bytes: 保存する応答の合計サイズの上限（Noneで LLM_RESPONSE_CACHE_MAX_MB）
+            ttl_seconds: 有効期限（秒。Noneで LLM_RESPONSE_CACHE_TTL_DAYS。0以下で無期限）
+        """
+        self.path = path
+        self.enabled = enabled
+        self.max_bytes = int(RESPONSE_CACHE_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self.ttl_seconds = RESPONSE_CACHE_TTL_DAYS * 86400 if ttl_seconds is None else ttl_seconds
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._conn_pid: Optional[int] = None
+
+    def set_enabled(self, enabled: bool):
+        """キャッシュの有効・無効を切り替え（無効の間は読み書きしない）"""
+        self.enabled = enabled
+        logger.info(f"LLM response cache {'enabled' if enabled else 'disabled'}")
+
+    def _connection(self) -> sqlite3.Connection:
+        """このプロセスの接続（fork後は作り直す）。呼び出し側で self._lock を取得すること"""
+        if self._conn is None or self._conn_pid != os.getpid():
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._conn_pid = os.getpid()
+        return self._conn
+
+    @contextmanager
+    def _transaction(self, write: bool = True):
+        """
+        このプロセスの接続でトランザクションを実行（self._lock を取得して接続を返す）
+
+        Args:
+            write: Trueで書き込みトランザクション（BEGIN IMMEDIATE）、
+                Falseで読み取りトランザクション（BEGIN。すべての読み取りが同じ時点のスナップショットになる）
+        """
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _count(self, conn: sqlite3.Connection, model: str, **increments: int):
+        """モデル別の集計を加算"""
+        columns = ", ".join(increments)
+        updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in increments)
+        placeholders = ", ".join("?" for _ in increments)
+        conn.execute(
+            f"INSERT INTO stats (model, {columns}) VALUES (?, {placeholders}) "
+            f"ON CONFLICT(model) DO UPDATE SET {updates}",
+            (model, *increments.values()),
+        )
+
+    def get(self, params: Dict[str, Any]):
+        """
+        キャッシュ済みの応答を取得
+
+        Args:
+            params: messages.create の引数
+
+        Returns:
+            Anthropic の Message。キャッシュがない・期限切れ・無効・キャッシュ対象外の場合はNone
+        """
+        if not self.enabled or not is_cacheable(params):
+            return None
+        key = cache_key(params)
+        model = params.get("model", "")
+        now = time.time()
+        try:
+            # 検索は読み取りだけ（書き込みロックを待たない）
+            with self._lock:
+                row = self._connection().execute(
+                    "SELECT body, input_tokens, output_tokens, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+            expired = row is not None and self.ttl_seconds > 0 and now - row[3] > self.ttl_seconds
+
+            # 最終利用日時と集計の更新だけを書き込みトランザクションで行う
+            with self._transaction() as conn:
+                if expired:
+                    # 検索後に他のプロセスが保存し直した応答は消さない
+                    conn.execute("DELETE FROM responses WHERE key = ? AND created_at = ?", (key, row[3]))
+                if row is None or expired:
+                    self._count(conn, model, misses=1)
+                    return None
+                conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+                self._count(conn, model, hits=1, saved_input_tokens=row[1], saved_output_tokens=row[2])
+            response = _deserialize(row[0])
+        except Exception as e:
+            logger.warning(f"LLM response cache read error: {e}")
+            return None
+        logger.info(f"✓ LLM response cache hit ({model}, {row[1]:,} in / {row[2]:,} out tokens saved)")
+        return response
+
+    def contains(self, params: Dict[str, Any]) -> bool:
+        """有効期限内の応答が保存されているか（ヒット・ミスの集計には数えない）"""
+        if not self.enabled or not is_cacheable(params):
+            return False
+        try:
+            with self._lock:
+                row = self._connection().execute(
+                    "SELECT created_at FROM responses WHERE key = ?", (cache_key(params),)
+                ).fetchone()
+        except Exception as e:
+            logger.warning(f"LLM response cache read error: {e}")
+            return False
+        return row is not None and (self.ttl_seconds <= 0 or time.time() - row[0] <= self.ttl_seconds)
+
+    def put(self, params: Dict[str, Any], response: Any, allow_truncated: bool = False):
+        """
+        応答を保存（キャッシュ対象外のリクエストは保存しない）
+
+        Args:
+            params: messages.create の引数
+            response: Anthropic の Message
+            allow_truncated: 出力が max_tokens で切れた応答も保存するか
+                （通常は保存しない。Message Batches API の結果は同期呼び出しで再実行しないよう保存する）
+        """
+        if not self.enabled or not is_cacheable(params):
+            return
+        if not allow_truncated and getattr(response, "stop_reason", None) == "max_tokens":
+            return
+        body = _serialize(response)
+        if body is None:
+            return
+        usage = getattr(response, "usage", None)
+        now = time.time()
+        try:
+            with self._transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO responses "
+                    "(key, model, body, size, input_tokens, output_tokens, created_at, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (cache_key(params), params.get("model", ""), body, len(body.encode("utf-8")),
+                     getattr(usage, "input_tokens", 0) or 0, getattr(usage, "output_tokens", 0) or 0, now, now),
+                )
+                self._evict(conn)
+        except Exception as e:
+            logger.warning(f"LLM response cache write error: {e}")
+
+    def _evict(self, conn: sqlite3.Connection):
+        """容量の上限を超えていれば、最後に使ってから長いものから削除"""
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICTION_TARGET_RATIO
+        evicted = 0
+        for key, model, size in conn.execute(
+            "SELECT key, model, size FROM responses ORDER BY last_access"
+        ).fetchall():
+            if total <= target:
+                break
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._count(conn, model, evictions=1)
+            total -= size
+            evicted += 1
+        logger.info(f"LLM response cache: evicted {evicted} entries ({total / 1024 / 1024:.1f} MB left)")
+
+    def purge_expired(self) -> int:
+        """有効期限を過ぎた応答を削除し、削除した件数を返す"""
+        if self.ttl_seconds <= 0:
+            return 0
+        with self._lock:
+            cursor = self._connection().execute(
+                "DELETE FROM responses WHERE created_at < ?", (time.time() - self.ttl_seconds,)
+            )
+        return cursor.rowcount
+
+    def clear(self):
+        """保存した応答と集計をすべて削除（1つのトランザクションで削除）"""
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM responses")
+            conn.execute("DELETE FROM stats")
+        logger.info("LLM response cache cleared")
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        キャッシュの集計
+
+        Returns:
+            hits, misses, hit_rate, saved_input_tokens, saved_output_tokens, evictions,
+            entries, size_bytes, by_model（モデル別の hits, misses, saved_input_tokens, saved_output_tokens）
+            （応答と集計は同じ時点のスナップショットから読み取る）
+        """
+        with self._transaction(write=False) as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+            rows = conn.execute(
+                "SELECT model, hits, misses, saved_input_tokens, saved_output_tokens, evictions FROM stats"
+            ).fetchall()
+
+        by_model = {
+            model: {"hits": hits, "misses": misses,
+                    "saved_input_tokens": saved_in, "saved_output_tokens": saved_out}
+            for model, hits, misses, saved_in, saved_out, _ in rows
+        }
+        hits = sum(row[1] for row in rows)
+        misses = sum(row[2] for row in rows)
+        return {
+            "enabled": self.enabled,
+            "path": self.path,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "saved_input_tokens": sum(row[3] for row in rows),
+            "saved_output_tokens": sum(row[4] for row in rows),
+            "evictions": sum(row[5] for row in rows),
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+            "by_model": by_model,
+        }
+
+
+# シングルトンインスタンス
+_response_cache: Optional[LLMResponseCache] = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> LLMResponseCache:
+    """プロセス共通のLLM応答キャッシュを取得"""
+    global _response_cache
+    with _response_cache_lock:
+        if _response_cache is None:
+            _response_cache = LLMResponseCache()
+        return _response_cache
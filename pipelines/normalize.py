@@ -79,10 +79,11 @@ class FMTNormalizer:
             legal_references=[],
             qa_items=[],
             raw_text=ingested_data.get('text', ''),
-            extracted_tables=ingested_data.get('tables', []),
+            extracted_tables=list(ingested_data.get('tables', [])),
             metadata={
                 'page_count': ingested_data.get('metadata', {}).get('page_count', 0),
-                'has_images': len(ingested_data.get('images', [])) > 0
+                # 画像データ（遅延評価）は取り出さずにページの画像有無で判定
+                'has_images': any(page.get('has_images') for page in ingested_data.get('pages', []))
             }
         )
 
@@ -4,14 +4,17 @@ OCR処理を使って画像ベースPDFから見積データを抽出
 import os
 import base64
 import io
-from typing import List, Dict, Any
+import json
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 from pathlib import Path
 import fitz  # PyMuPDF
 from PIL import Image
-from anthropic import Anthropic
 from loguru import logger
 from dotenv import load_dotenv
-from pipelines.cost_tracker import record_cost
+from pipelines.llm_gateway import get_llm_gateway
+from pipelines.pdf_cache import open_pdf
+from pipelines.page_pipeline import iter_rendered_pages, run_page_pipeline
+from pipelines.render_policy import CONTENT_SCAN, RenderedPage, RenderPolicy
 
 # 環境変数をロード
 load_dotenv()
@@ -21,7 +24,7 @@ class OCRExtractor:
     """画像ベースPDFからOCRで見積データを抽出"""
 
     def __init__(self):
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.client = get_llm_gateway()
         self.model_name = "claude-sonnet-4-20250514"
 
     def pdf_to_images(self, pdf_path: str, dpi: int = 200) -> List[Image.Image]:
@@ -34,6 +37,10 @@ class OCRExtractor:
 
         Returns:
             PIL Image のリスト
+
+        Note:
+            全ページの画像をメモリに保持します。見積抽出には
+            ページを1枚ずつ変換する iter_rendered_pages() を使う extract_from_pdf() を使用してください。
         """
         logger.info(f"Converting PDF to images: {pdf_path}")
 
@@ -58,11 +65,15 @@ class OCRExtractor:
         logger.info(f"Converted {len(images)} pages to images")
         return images
 
-    def image_to_base64(self, image: Image.Image) -> str:
-        """PIL ImageをBase64エンコード"""
+    def image_to_png_bytes(self, image: Image.Image) -> bytes:
+        """PIL ImageをPNGバイト列に変換"""
         buffered = io.BytesIO()
         image.save(buffered, format="PNG")
-        return base64.b64encode(buffered.getvalue()).decode('utf-8')
+        return buffered.getvalue()
+
+    def image_to_base64(self, image: Image.Image) -> str:
+        """PIL ImageをBase64エンコード"""
+        return base64.b64encode(self.image_to_png_bytes(image)).decode('utf-8')
 
     def extract_estimate_from_images(
         self,
@@ -79,18 +90,37 @@ class OCRExtractor:
         Returns:
             見積項目のリスト
         """
-        logger.info(f"Extracting estimate items from {len(images)} images using Claude Vision API")
+        pages = (
+            (i, RenderedPage(i, self.image_to_png_bytes(image), "image/png", image.width, image.height, 0.0, CONTENT_SCAN))
+            for i, image in enumerate(images, 1)
+        )
+        return self.extract_estimate_from_pages(pages, discipline=discipline, total_pages=len(images))
 
-        all_items = []
+    def extract_estimate_from_pages(
+        self,
+        pages: Iterable[Tuple[int, RenderedPage]],
+        discipline: str = "ガス設備工事",
+        total_pages: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        ページ画像から見積項目を抽出（Claude Vision API使用）
 
-        for i, image in enumerate(images, 1):
-            logger.info(f"Processing image {i}/{len(images)}")
+        pages はジェネレータで渡すと、同時実行数を超えるページは変換されずに待つため、
+        メモリ上のページ画像は VISION_PAGE_CONCURRENCY 程度に抑えられます。
 
-            # 画像をBase64エンコード
-            image_base64 = self.image_to_base64(image)
+        Args:
+            pages: (ページ番号, RenderedPage) のイテラブル
+            discipline: 工事区分
+            total_pages: 総ページ数（ログ表示用）
 
-            # Claude Vision APIで画像から見積項目を抽出
-            prompt = f"""
+        Returns:
+            見積項目のリスト（ページ順）
+        """
+        page_label = f"{total_pages} pages" if total_pages is not None else "pages"
+        logger.info(f"Extracting estimate items from {page_label} using Claude Vision API")
+
+        # 見積書の各ページで共通のプロンプト
+        prompt = f"""
 この画像は「{discipline}」の見積書の一部です。
 
 以下の情報を **すべて** 抽出してJSON配列で出力してください：
@@ -126,6 +156,13 @@ JSON形式（配列）：
 
 画像内のすべての項目を抽出してください。"""
 
+        def extract_page(i: int, rendered: RenderedPage) -> List[Dict[str, Any]]:
+            """1ページ分の見積項目を抽出（ワーカースレッドで実行）"""
+            logger.info(f"Processing page {i}/{total_pages or '?'}")
+
+            # 画像コンテンツブロック（Base64エンコード）
+            image_block = rendered.to_content_block()
+
             try:
                 response = self.client.messages.create(
                     model=self.model_name,
@@ -133,29 +170,15 @@ JSON形式（配列）：
                     messages=[{
                         "role": "user",
                         "content": [
-                            {
-                                "type": "image",
-                                "source": {
-                                    "type": "base64",
-                                    "media_type": "image/png",
-                                    "data": image_base64
-                                }
-                            },
+                            image_block,
                             {
                                 "type": "text",
                                 "text": prompt
                             }
                         ]
-                    }]
-                )
-
-                # コスト記録
-                record_cost(
+                    }],
                     operation="OCR見積抽出",
-                    model_name=self.model_name,
-                    input_tokens=response.usage.input_tokens,
-                    output_tokens=response.usage.output_tokens,
-                    metadata={"source": "extract_estimate_from_images", "page": i, "discipline": discipline}
+                    cost_metadata={"source": "extract_estimate_from_images", "page": i, "discipline": discipline}
                 )
 
                 # レスポンスからJSONを抽出
@@ -168,15 +191,19 @@ JSON形式（配列）：
                     content = content.split("```")[1].split("```")[0]
 
                 # JSONパース
-                import json
                 items = json.loads(content.strip())
 
                 logger.debug(f"Extracted {len(items)} items from page {i}")
-                all_items.extend(items)
+                return items
 
             except Exception as e:
                 logger.error(f"Failed to extract from page {i}: {e}")
-                continue
+                return []
+
+        # ページ間で並列に抽出し、ページ順に結合
+        all_items = []
+        for _, items in run_page_pipeline(pages, extract_page):
+            all_items.extend(items)
 
         logger.info(f"Total extracted items: {len(all_items)}")
         return all_items
@@ -185,7 +212,7 @@ JSON形式（配列）：
         self,
         pdf_path: str,
         discipline: str = "ガス設備工事",
-        dpi: int = 200
+        dpi: Optional[int] = None
     ) -> List[Dict[str, Any]]:
         """
         PDFから見積項目を抽出（エンドツーエンド）
@@ -193,18 +220,18 @@ JSON形式（配列）：
         Args:
             pdf_path: PDFファイルパス
             discipline: 工事区分
-            dpi: 画像解像度
+            dpi: 画像解像度（Noneでページの内容に応じて選ぶ。RenderPolicy を参照）
 
         Returns:
             見積項目のリスト
         """
         logger.info(f"Extracting estimate from PDF: {pdf_path}")
 
-        # PDFを画像に変換
-        images = self.pdf_to_images(pdf_path, dpi=dpi)
-
-        # 画像から見積項目を抽出
-        items = self.extract_estimate_from_images(images, discipline=discipline)
+        # ページを1枚ずつ画像化しながら見積項目を抽出（全ページの画像は保持しない）
+        total_pages = open_pdf(pdf_path).page_count
+        policy = RenderPolicy.fixed(dpi) if dpi is not None else None
+        pages = iter_rendered_pages(pdf_path, policy=policy)
+        items = self.extract_estimate_from_pages(pages, discipline=discipline, total_pages=total_pages)
 
         return items
 
@@ -276,7 +303,7 @@ if __name__ == "__main__":
     pdf_path = "test-files/250918_送付状　見積書（都市ｶﾞｽ).pdf"
 
     if Path(pdf_path).exists():
-        items = extractor.extract_from_pdf(pdf_path, discipline="ガス設備工事", dpi=200)
+        items = extractor.extract_from_pdf(pdf_path, discipline="ガス設備工事")
 
         print(f"\n抽出された項目数: {len(items)}")
         print("\n=== 抽出結果（最初の10項目）===")
@@ -0,0 +1,229 @@
+"""
+ページ分類（ローカル・API不要）
+
+PDFの各ページについて、テキスト量・罫線の本数・ベクター描画のパス数・キーワード一致数・
+画像の占有率をPyMuPDFで軽く計算し、表のページか図面のページかを判定します。
+pdfplumberの表抽出のような重い処理を表の候補ページだけに絞るほか、
+Vision APIに送る諸元表ページ・図面ページの選定（スコア順）に使います。
+"""
+
+import os
+import unicodedata
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+# 諸元表ページのキーワード（detect_specification_table_pages と共通）
+SPEC_TABLE_KEYWORDS = ["諸元表", "室名", "床面積", "天井高", "空調", "給排水", "ガス栓"]
+
+# 図面ページのキーワード（全角・半角はNFKCで正規化して照合）
+DRAWING_KEYWORDS = ["配置図", "平面図", "立面図", "断面図", "系統図", "詳細図", "求積図", "S=1/"]
+
+# 表の候補とみなす罫線の本数（水平・垂直それぞれ）
+MIN_TABLE_RULINGS = 2
+
+# 表の候補とみなすキーワード一致数
+MIN_TABLE_KEYWORD_HITS = 3
+
+# 図面とみなすベクター描画のパス数と、パスあたりの文字数の上限
+DRAWING_MIN_PATHS = 1000
+DRAWING_MAX_CHARS_PER_PATH = 1.0
+
+# 罫線とみなす線分の最小長さ・太さの許容値（pt）
+RULING_MIN_LENGTH = 5.0
+RULING_TOLERANCE = 2.0
+
+# 諸元表スコア: キーワード1種類につき1点 + 表の格子（罫線）で最大 TABLE_GRID_WEIGHT 点
+# 格子の点数は水平・垂直の少ない方の罫線数 / TABLE_GRID_RULINGS（上限1）
+TABLE_GRID_RULINGS = 200
+TABLE_GRID_WEIGHT = 3.0
+SPEC_TABLE_MIN_SCORE = 3.0
+
+# 図面スコア: ベクター図面 DRAWING_VECTOR_WEIGHT 点 + 画像の占有率 × DRAWING_IMAGE_WEIGHT 点
+# + 図面キーワード（最大 DRAWING_MAX_KEYWORD_POINTS 点）。画像・キーワードは文字の少ないページのみ数える
+DRAWING_VECTOR_WEIGHT = 2.0
+DRAWING_IMAGE_WEIGHT = 2.0
+DRAWING_MAX_KEYWORD_POINTS = 2
+DRAWING_MAX_TEXT_DENSITY = 5.0
+DRAWING_MIN_SCORE = 2.0
+
+# Vision APIに送るページ数の上限（環境変数で変更可能）
+SPEC_TABLE_MAX_PAGES = int(os.getenv("VISION_SPEC_TABLE_MAX_PAGES", "6"))
+DRAWING_MAX_PAGES = int(os.getenv("VISION_DRAWING_MAX_PAGES", "5"))
+
+
+class PageFeatures(NamedTuple):
+    """1ページ分の分類用の特徴量"""
+    page_num: int
+    char_count: int
+    text_density: float  # 100pt四方あたりの文字数
+    horizontal_rulings: int
+    vertical_rulings: int
+    path_count: int
+    keyword_hits: int
+    drawing_keyword_hits: int = 0
+    image_coverage: float = 0.0  # 埋め込み画像がページ面積に占める割合（0〜1）
+
+    @property
+    def is_drawing(self) -> bool:
+        """図面ページらしいか（ベクター描画が多く、文字が少ない）"""
+        return (
+            self.path_count >= DRAWING_MIN_PATHS
+            and self.char_count < self.path_count * DRAWING_MAX_CHARS_PER_PATH
+        )
+
+    @property
+    def is_table_candidate(self) -> bool:
+        """表を含む可能性があるか（pdfplumberで表抽出する対象）"""
+        if self.keyword_hits >= MIN_TABLE_KEYWORD_HITS:
+            return True
+        if self.is_drawing or self.char_count == 0:
+            return False
+        return (
+            self.horizontal_rulings >= MIN_TABLE_RULINGS
+            and self.vertical_rulings >= MIN_TABLE_RULINGS
+        )
+
+    @property
+    def spec_table_score(self) -> float:
+        """諸元表ページらしさ（SPEC_TABLE_MIN_SCORE 以上で諸元表の候補）"""
+        if self.is_drawing or self.char_count == 0:
+            return 0.0
+        grid = min(self.horizontal_rulings, self.vertical_rulings) / TABLE_GRID_RULINGS
+        return self.keyword_hits + TABLE_GRID_WEIGHT * min(grid, 1.0)
+
+    @property
+    def drawing_score(self) -> float:
+        """図面ページらしさ（DRAWING_MIN_SCORE 以上で図面の候補）"""
+        score = DRAWING_VECTOR_WEIGHT if self.is_drawing else 0.0
+        # 本文ページの挿絵や図面名の言及で加点しないよう、文字の少ないページに限る
+        if self.is_drawing or self.text_density < DRAWING_MAX_TEXT_DENSITY:
+            score += DRAWING_IMAGE_WEIGHT * self.image_coverage
+            score += min(self.drawing_keyword_hits, DRAWING_MAX_KEYWORD_POINTS)
+        return score
+
+
+def count_rulings(drawings: Sequence[dict]) -> Tuple[int, int]:
+    """
+    ベクター描画から水平・垂直の罫線の本数を数える
+
+    Args:
+        drawings: PyMuPDFの page.get_drawings() の結果
+
+    Returns:
+        (水平線の本数, 垂直線の本数)。矩形は4辺として数える
+    """
+    horizontal = vertical = 0
+    for path in drawings:
+        for item in path.get("items", ()):
+            kind = item[0]
+            if kind == "l":
+                p1, p2 = item[1], item[2]
+                dx, dy = abs(p1.x - p2.x), abs(p1.y - p2.y)
+                if dy < RULING_TOLERANCE and dx >= RULING_MIN_LENGTH:
+                    horizontal += 1
+                elif dx < RULING_TOLERANCE and dy >= RULING_MIN_LENGTH:
+                    vertical += 1
+            elif kind == "re":
+                rect = item[1]
+                if rect.height < RULING_TOLERANCE and rect.width >= RULING_MIN_LENGTH:
+                    horizontal += 1
+                elif rect.width < RULING_TOLERANCE and rect.height >= RULING_MIN_LENGTH:
+                    vertical += 1
+                elif rect.width >= RULING_MIN_LENGTH and rect.height >= RULING_MIN_LENGTH:
+                    horizontal += 2
+                    vertical += 2
+    return horizontal, vertical
+
+
+def count_keyword_hits(text: str, keywords: Sequence[str] = SPEC_TABLE_KEYWORDS) -> int:
+    """テキストに含まれるキーワードの種類数"""
+    return sum(1 for kw in keywords if kw in text)
+
+
+def image_coverage(page) -> float:
+    """埋め込み画像がページ面積に占める割合（画像同士の重なりは考慮せず、上限1）"""
+    page_rect = page.rect
+    area = max(page_rect.width * page_rect.height, 1.0)
+    covered = 0.0
+    for info in page.get_image_info():
+        x0, y0, x1, y1 = info["bbox"]
+        # ページ外にはみ出した部分は数えない
+        width = min(x1, page_rect.x1) - max(x0, page_rect.x0)
+        height = min(y1, page_rect.y1) - max(y0, page_rect.y0)
+        if width > 0 and height > 0:
+            covered += width * height
+    return min(covered / area, 1.0)
+
+
+def classify_page(page, page_num: int, text: Optional[str] = None,
+                  keywords: Sequence[str] = SPEC_TABLE_KEYWORDS) -> PageFeatures:
+    """
+    ページの特徴量を計算
+
+    Args:
+        page: PyMuPDFのページ
+        page_num: ページ番号（1始まり）
+        text: ページのテキスト（Noneの場合は page.get_text() で取得）
+        keywords: 一致数を数えるキーワード
+
+    Returns:
+        PageFeatures
+    """
+    if text is None:
+        text = page.get_text()
+    char_count = len("".join(text.split()))
+    area = max(page.rect.width * page.rect.height, 1.0)
+    drawings = page.get_drawings()
+    horizontal, vertical = count_rulings(drawings)
+    return PageFeatures(
+        page_num=page_num,
+        char_count=char_count,
+        text_density=char_count / (area / 10000.0),
+        horizontal_rulings=horizontal,
+        vertical_rulings=vertical,
+        path_count=len(drawings),
+        keyword_hits=count_keyword_hits(text, keywords),
+        drawing_keyword_hits=count_keyword_hits(unicodedata.normalize("NFKC", text), DRAWING_KEYWORDS),
+        image_coverage=image_coverage(page),
+    )
+
+
+def _select_pages(scored: Iterable[Tuple[int, float]], min_score: float, max_pages: int) -> List[int]:
+    """スコアが min_score 以上のページを高い順に max_pages 件選び、ページ順で返す"""
+    candidates = [(page_num, score) for page_num, score in scored if score >= min_score]
+    candidates.sort(key=lambda item: (-item[1], item[0]))
+    return sorted(page_num for page_num, _ in candidates[:max(max_pages, 0)])
+
+
+def select_spec_table_pages(features: Iterable[PageFeatures],
+                            max_pages: Optional[int] = None) -> List[int]:
+    """
+    Vision APIで読み取る諸元表ページを選定
+
+    Args:
+        features: 各ページの PageFeatures
+        max_pages: 選ぶページ数の上限（Noneで SPEC_TABLE_MAX_PAGES）
+
+    Returns:
+        ページ番号（1始まり）のリスト（ページ順）
+    """
+    max_pages = SPEC_TABLE_MAX_PAGES if max_pages is None else max_pages
+    return _select_pages(((f.page_num, f.spec_table_score) for f in features),
+                         SPEC_TABLE_MIN_SCORE, max_pages)
+
+
+def select_drawing_pages(features: Iterable[PageFeatures],
+                         max_pages: Optional[int] = None) -> List[int]:
+    """
+    Vision APIで読み取る図面ページを選定
+
+    Args:
+        features: 各ページの PageFeatures
+        max_pages: 選ぶページ数の上限（Noneで DRAWING_MAX_PAGES）
+
+    Returns:
+        ページ番号（1始まり）のリスト（ページ順）
+    """
+    max_pages = DRAWING_MAX_PAGES if max_pages is None else max_pages
+    return _select_pages(((f.page_num, f.drawing_score) for f in features),
+                         DRAWING_MIN_SCORE, max_pages)
+
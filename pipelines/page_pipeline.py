@@ -0,0 +1,128 @@
+"""
+ページ単位のVision API並列パイプライン
+
+スキャンPDFのOCRなど、ページごとに「画像化 → Vision API呼び出し」を行う処理を
+ページ間で並列化します。
+
+- 呼び出し側のスレッドでページを順に画像化しながら、API呼び出しはスレッドプールで並列実行
+  （画像化とAPI待ちが重なるため、ページ数分の往復を待たずに済みます）
+- 同時実行数（処理中のページ数）は上限付き（環境変数 VISION_PAGE_CONCURRENCY）
+- レート制限（429）・過負荷（529）のリトライは LLMゲートウェイ（llm_gateway）で行う
+- 結果はページ順に並べ直して返す
+- ページ画像はジェネレータで1ページずつ生成（全ページをメモリに保持しない）。解像度・切り出し・形式は RenderPolicy
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+from loguru import logger
+
+# レート制限のリトライは LLMゲートウェイに移動（互換のため再エクスポート）
+from pipelines.llm_gateway import (  # noqa: F401
+    RATE_LIMIT_BASE_DELAY,
+    RATE_LIMIT_MAX_DELAY,
+    RATE_LIMIT_MAX_RETRIES,
+    RETRYABLE_STATUS_CODES,
+    call_with_rate_limit_retry,
+    is_rate_limit_error,
+)
+from pipelines.pdf_cache import open_pdf
+from pipelines.render_policy import DEFAULT_RENDER_POLICY, RenderedPage, RenderPolicy
+
+# 同時に処理するページ数の上限（環境変数で変更可能）
+DEFAULT_PAGE_CONCURRENCY = int(os.getenv("VISION_PAGE_CONCURRENCY", "4"))
+
+T = TypeVar("T")
+
+
+def run_page_pipeline(
+    pages: Iterable[Tuple[int, Any]],
+    process: Callable[[int, Any], T],
+    max_workers: Optional[int] = None,
+) -> List[Tuple[int, T]]:
+    """
+    ページを並列に処理し、ページ順に結果を返す
+
+    pages はジェネレータで渡すと、処理中のページが上限に達している間は次のページの
+    画像化を待つため、メモリ上の画像は同時実行数程度に抑えられます。
+
+    Args:
+        pages: (ページ番号, ページデータ) のイテラブル。呼び出し側のスレッドで順に取り出す
+        process: ページ番号とページデータを受け取って結果を返す関数（ワーカースレッドで実行）
+        max_workers: 同時実行数の上限（Noneで VISION_PAGE_CONCURRENCY）
+
+    Returns:
+        (ページ番号, 結果) のリスト（pages の順）
+
+    Raises:
+        process 内で発生した例外（ページ順で最初に失敗したもの）。
+        失敗後は新しいページを投入せず、処理中のページの完了を待ってから送出します。
+    """
+    max_workers = max(1, max_workers or DEFAULT_PAGE_CONCURRENCY)
+    results = {}
+    errors = {}
+    running = {}
+    submitted = 0
+
+    def collect(done):
+        for future in done:
+            position, page_num = running.pop(future)
+            try:
+                results[position] = (page_num, future.result())
+            except Exception as e:
+                errors[position] = e
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="vision-page") as executor:
+        for page_num, payload in pages:
+            # 処理中のページが上限に達していれば1件終わるまで待つ
+            while len(running) >= max_workers:
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                collect(done)
+            if errors:
+                break
+            running[executor.submit(process, page_num, payload)] = (submitted, page_num)
+            submitted += 1
+
+        if running:
+            done, _ = wait(list(running))
+            collect(done)
+
+    if errors:
+        raise errors[min(errors)]
+
+    return [results[position] for position in range(submitted)]
+
+
+def iter_rendered_pages(
+    pdf_path: str,
+    policy: Optional[RenderPolicy] = None,
+    page_numbers: Optional[Iterable[int]] = None,
+) -> Iterator[Tuple[int, RenderedPage]]:
+    """
+    PDFのページを1ページずつ画像化して返すジェネレータ
+
+    PDFはキャッシュ（pdf_cache）から開き、PyMuPDFのPixmapを直接エンコードするため、
+    PIL Imageへのデコードと再エンコードは行いません。run_page_pipeline() に渡すと、メモリ上のページ画像は
+    ページ数ではなく同時実行数で抑えられます。
+
+    Args:
+        pdf_path: PDFファイルパス
+        policy: 画像化ポリシー（Noneで DEFAULT_RENDER_POLICY。固定解像度は RenderPolicy.fixed(dpi)）
+        page_numbers: 変換するページ番号（1始まり）。Noneで全ページ、範囲外のページは無視
+
+    Yields:
+        (ページ番号（1始まり）, RenderedPage)
+    """
+    policy = policy or DEFAULT_RENDER_POLICY
+    pdf = open_pdf(pdf_path)
+    numbers = range(1, pdf.page_count + 1) if page_numbers is None else page_numbers
+    for page_num in numbers:
+        if not 1 <= page_num <= pdf.page_count:
+            continue
+        rendered = policy.render(pdf, page_num)
+        logger.debug(
+            f"Rendered page {page_num}/{pdf.page_count} ({rendered.content_type}, {rendered.dpi:.0f} DPI, "
+            f"{rendered.width}x{rendered.height}, {len(rendered.data) // 1024} KB)"
+        )
+        yield page_num, rendered
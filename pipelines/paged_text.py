@@ -0,0 +1,148 @@
+"""
+ページ単位のテキスト
+
+PDFから抽出したテキストを、ページごとのテキストと各ページの開始位置（文字オフセット）を
+持ったまま1つの文字列として扱います。
+
+str のサブクラスなので、これまで通りプロンプトへの埋め込みや spec_text[:60000] のような
+スライスにそのまま使えます。ページ単位の検索（諸元表ページの検出など）は、結合済みの
+文字列を [PAGE n] マーカーで分割し直さずにページ配列に対して行います。
+"""
+
+import re
+from bisect import bisect_right
+from typing import Iterable, List, Optional, Sequence, Tuple
+
+# ページ番号マーカー（例: [PAGE 3/49]、[PAGE 3]）
+PAGE_MARKER_PATTERN = re.compile(r'\[PAGE (\d+)(?:/\d+)?\]')
+
+
+class PagedText(str):
+    """
+    ページ配列と文字オフセットを持つテキスト
+
+    Attributes:
+        page_numbers: ページ番号（1始まり）のリスト
+        page_texts: 各ページのテキスト（マーカーを含まない）
+        offsets: 各ページのテキストの開始位置（結合後の文字列でのオフセット）
+    """
+
+    page_numbers: Tuple[int, ...]
+    page_texts: Tuple[str, ...]
+    offsets: Tuple[int, ...]
+
+    def __new__(cls, text: str = "", page_numbers: Sequence[int] = (),
+                page_texts: Sequence[str] = (), offsets: Sequence[int] = ()):
+        obj = super().__new__(cls, text)
+        obj.page_numbers = tuple(page_numbers)
+        obj.page_texts = tuple(page_texts)
+        obj.offsets = tuple(offsets)
+        return obj
+
+    @classmethod
+    def from_pages(cls, pages: Iterable[Tuple[int, str]], marker: Optional[str] = None,
+                   total: Optional[int] = None) -> "PagedText":
+        """
+        ページごとのテキストから作成
+
+        各ページは「\\n<マーカー>\\n<テキスト>\\n」（マーカーなしの場合は「<テキスト>\\n」）の形で結合します。
+
+        Args:
+            pages: (ページ番号, テキスト) のイテラブル
+            marker: ページ番号マーカーの書式（例: "[PAGE {page}/{total}]"）。Noneでマーカーなし
+            total: マーカーの {total} に入れる総ページ数（Noneでページ数）
+
+        Returns:
+            PagedText
+        """
+        pages = list(pages)
+        if total is None:
+            total = len(pages)
+
+        parts: List[str] = []
+        offsets: List[int] = []
+        position = 0
+        for page_num, page_text in pages:
+            if marker is not None:
+                prefix = "\n" + marker.format(page=page_num, total=total) + "\n"
+                parts.append(prefix)
+                position += len(prefix)
+            offsets.append(position)
+            parts.append(page_text)
+            parts.append("\n")
+            position += len(page_text) + 1
+
+        return cls(
+            "".join(parts),
+            page_numbers=[page_num for page_num, _ in pages],
+            page_texts=[page_text for _, page_text in pages],
+            offsets=offsets,
+        )
+
+    @classmethod
+    def parse(cls, text: str) -> "PagedText":
+        """
+        [PAGE n] マーカー付きの文字列から作成（キャッシュから読み込んだテキストなど）
+
+        既に PagedText の場合はそのまま返します。マーカーより前のテキストはページに含めません。
+        """
+        if isinstance(text, PagedText):
+            return text
+
+        page_numbers: List[int] = []
+        page_texts: List[str] = []
+        offsets: List[int] = []
+        matches = list(PAGE_MARKER_PATTERN.finditer(text or ""))
+        for i, match in enumerate(matches):
+            # from_pages() の書式（マーカー後の改行・ページ末尾の改行・次のマーカー前の改行）を除く
+            start = match.end()
+            if text.startswith("\n", start):
+                start += 1
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+            if i + 1 < len(matches) and end > start and text[end - 1] == "\n":
+                end -= 1
+            if end > start and text[end - 1] == "\n":
+                end -= 1
+            page_numbers.append(int(match.group(1)))
+            page_texts.append(text[start:end])
+            offsets.append(start)
+        return cls(text or "", page_numbers, page_texts, offsets)
+
+    def page(self, page_num: int) -> str:
+        """指定ページのテキスト（ページがない場合は空文字）"""
+        for number, page_text in zip(self.page_numbers, self.page_texts):
+            if number == page_num:
+                return page_text
+        return ""
+
+    def pages(self) -> List[Tuple[int, str]]:
+        """(ページ番号, テキスト) のリスト"""
+        return list(zip(self.page_numbers, self.page_texts))
+
+    def page_at(self, offset: int) -> Optional[int]:
+        """文字オフセットを含むページ番号（最初のページより前ならNone）"""
+        index = bisect_right(self.offsets, offset) - 1
+        return self.page_numbers[index] if index >= 0 else None
+
+    def pages_in_window(self, max_chars: int) -> List[int]:
+        """先頭 max_chars 文字（self[:max_chars]）に含まれるページ番号"""
+        count = bisect_right(self.offsets, max(max_chars - 1, 0)) if max_chars > 0 else 0
+        return list(self.page_numbers[:count])
+
+    def keyword_hits(self, keywords: Sequence[str]) -> List[Tuple[int, int]]:
+        """
+        ページごとのキーワード一致数
+
+        Args:
+            keywords: キーワードのリスト
+
+        Returns:
+            (ページ番号, 含まれるキーワードの種類数) のリスト（ページ順）
+        """
+        return [
+            (page_num, sum(1 for kw in keywords if kw in page_text))
+            for page_num, page_text in zip(self.page_numbers, self.page_texts)
+        ]
+
+    def __reduce__(self):
+        return (self.__class__, (str(self), self.page_numbers, self.page_texts, self.offsets))
@@ -7,12 +7,13 @@
 - 項目間の関係性
 """
 
-import json
 from pathlib import Path
 from typing import Dict, List, Any, Optional
 from collections import defaultdict
 from loguru import logger
 
+from pipelines.kb_registry import get_kb_registry
+
 
 class PatternLearner:
     """
@@ -35,13 +36,8 @@ class PatternLearner:
         self.patterns = {}
 
     def _load_kb(self) -> List[Dict[str, Any]]:
-        """KBデータを読み込み"""
-        if not self.kb_path.exists():
-            logger.warning(f"KB file not found: {self.kb_path}")
-            return []
-
-        with open(self.kb_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        """KBデータを読み込み（プロセス共通の読み取り専用スナップショット）"""
+        return get_kb_registry().get_kb(str(self.kb_path))
 
     def analyze_project_patterns(self) -> Dict[str, Any]:
         """
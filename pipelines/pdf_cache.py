@@ -0,0 +1,572 @@
+"""
+PDFドキュメントキャッシュ（プロセス共通）
+
+同じ仕様書PDFを、テキスト抽出・ページ範囲抽出・Vision用の画像化（PyMuPDF）・
+テーブル抽出（pdfplumber）のたびに開き直して解析する処理をまとめます。
+
+- ファイル内容のハッシュをキーに、PDFを1回だけ読み込んで各ライブラリで必要時に開く
+- ページテキストはページ単位で必要になった時に抽出してキャッシュ（ページのレイアウトは各エンジンの出力のまま）
+- 1つのドキュメントへのアクセスはロックで直列化（PyPDF2・PyMuPDFはスレッドセーフではないため）
+- テキスト抽出の既定エンジンは高速なPyMuPDF（使えないページ・環境ではPyPDF2にフォールバック）
+- 大きなPDFはページ範囲をプロセスプールに分散して抽出可能（PDF_TEXT_WORKERS）
+- Vision用の画像化は範囲の切り出し・JPEG/WebP・グレースケールに対応（render_policy）
+"""
+
+import hashlib
+import io
+import math
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import PyPDF2
+from loguru import logger
+
+from pipelines.page_classifier import PageFeatures, classify_page
+from pipelines.paged_text import PagedText
+from pipelines.render_policy import DEFAULT_IMAGE_QUALITY, FORMAT_PNG, encode_pixmap
+
+try:
+    import fitz  # PyMuPDF
+    HAS_PYMUPDF = True
+except ImportError:
+    HAS_PYMUPDF = False
+
+# テキスト抽出エンジン
+ENGINE_PYPDF2 = "pypdf2"
+ENGINE_PYMUPDF = "pymupdf"
+TEXT_ENGINES = (ENGINE_PYPDF2, ENGINE_PYMUPDF)
+
+# 既定のテキスト抽出エンジン（PyMuPDFはPyPDF2より1桁以上高速）
+DEFAULT_TEXT_ENGINE = os.getenv("PDF_TEXT_ENGINE", ENGINE_PYMUPDF)
+
+# メモリに保持するドキュメント数の上限（環境変数で変更可能）
+DEFAULT_MAX_DOCUMENTS = int(os.getenv("PDF_CACHE_MAX_DOCUMENTS", "4"))
+
+# テキスト抽出のワーカープロセス数（1以下でプロセスプールを使わない）
+PDF_TEXT_WORKERS = int(os.getenv("PDF_TEXT_WORKERS", "1"))
+
+# プロセスプールを使う最小ページ数（ワーカー起動・受け渡しのコストがあるため大きなPDFのみ）
+PARALLEL_MIN_PAGES = int(os.getenv("PDF_TEXT_PARALLEL_MIN_PAGES", "32"))
+
+
+def resolve_text_engine(engine: Optional[str] = None) -> str:
+    """
+    テキスト抽出エンジンを決定
+
+    Args:
+        engine: "pymupdf" / "pypdf2"。Noneで DEFAULT_TEXT_ENGINE
+
+    Returns:
+        使用するエンジン（PyMuPDFがない場合は "pypdf2"）
+    """
+    engine = engine or DEFAULT_TEXT_ENGINE
+    if engine not in TEXT_ENGINES:
+        raise ValueError(f"Unknown text engine: {engine}")
+    if engine == ENGINE_PYMUPDF and not HAS_PYMUPDF:
+        return ENGINE_PYPDF2
+    return engine
+
+
+def extract_page_range(pdf_path: str, start_page: int, end_page: int,
+                       engine: str = ENGINE_PYMUPDF) -> List[str]:
+    """
+    ページ範囲のテキストを抽出（プロセスプールのワーカーでも実行されるため状態を持たない）
+
+    PyMuPDFで抽出できなかったページはPyPDF2で抽出し直します。
+
+    Args:
+        pdf_path: PDFファイルパス
+        start_page: 開始ページ（1始まり）
+        end_page: 終了ページ（この番号を含む）
+        engine: 抽出エンジン
+
+    Returns:
+        ページ順のテキストのリスト
+    """
+    page_indexes = range(start_page - 1, end_page)
+    texts: List[Optional[str]] = [None] * len(page_indexes)
+
+    if resolve_text_engine(engine) == ENGINE_PYMUPDF:
+        with fitz.open(pdf_path) as doc:
+            for i, page_index in enumerate(page_indexes):
+                try:
+                    texts[i] = doc[page_index].get_text()
+                except Exception:
+                    texts[i] = None
+
+    if any(text is None for text in texts):
+        reader = PyPDF2.PdfReader(pdf_path)
+        for i, page_index in enumerate(page_indexes):
+            if texts[i] is None:
+                texts[i] = reader.pages[page_index].extract_text() or ""
+
+    return texts
+
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+
+def _get_process_pool(workers: int) -> ProcessPoolExecutor:
+    """テキスト抽出用のプロセスプール（プロセス内で使い回す）"""
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False)
+            # スレッドを使うアプリ（Streamlit・ステージ並列実行）からforkしないようspawnで起動
+            _process_pool = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+            _process_pool_workers = workers
+        return _process_pool
+
+
+def _reset_process_pool():
+    """壊れたプロセスプールを破棄"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=False, cancel_futures=True)
+            _process_pool = None
+
+
+def extract_page_texts_parallel(pdf_path: str, start_page: int, end_page: int,
+                                engine: Optional[str] = None,
+                                workers: Optional[int] = None) -> List[str]:
+    """
+    ページ範囲をワーカープロセスに分割してテキストを抽出（結果はページ順）
+
+    ワーカーごとに約2チャンクずつ連続したページ範囲を割り当てます。
+    プロセスプールが使えない場合は現在のプロセスで抽出します。
+
+    Args:
+        pdf_path: PDFファイルパス
+        start_page: 開始ページ（1始まり）
+        end_page: 終了ページ（この番号を含む）
+        engine: 抽出エンジン（Noneで DEFAULT_TEXT_ENGINE）
+        workers: ワーカープロセス数（Noneで PDF_TEXT_WORKERS、1以下で現在のプロセスのみ）
+
+    Returns:
+        ページ順のテキストのリスト
+    """
+    engine = resolve_text_engine(engine)
+    workers = PDF_TEXT_WORKERS if workers is None else workers
+    page_count = end_page - start_page + 1
+    if workers <= 1 or page_count < 2:
+        return extract_page_range(pdf_path, start_page, end_page, engine)
+
+    chunk_size = max(1, math.ceil(page_count / (workers * 2)))
+    ranges = [
+        (first, min(first + chunk_size - 1, end_page))
+        for first in range(start_page, end_page + 1, chunk_size)
+    ]
+    try:
+        pool = _get_process_pool(workers)
+        futures = [pool.submit(extract_page_range, pdf_path, first, last, engine) for first, last in ranges]
+        texts: List[str] = []
+        for future in futures:
+            texts.extend(future.result())
+        return texts
+    except Exception as e:
+        logger.warning(f"Parallel text extraction failed, extracting in-process: {e}")
+        _reset_process_pool()
+        return extract_page_range(pdf_path, start_page, end_page, engine)
+
+
+class PdfDocument:
+    """
+    1つのPDFファイル（内容ハッシュ単位）
+
+    PyPDF2 / PyMuPDF / pdfplumber のドキュメントは最初に使う時に1回だけ開き、
+    ページテキストはページ・エンジンごとに抽出結果をキャッシュします。
+    ページ番号はすべて1始まりです。
+    """
+
+    def __init__(self, path: str, file_hash: str, data: bytes):
+        """
+        Args:
+            path: PDFファイルパス（ログ表示用）
+            file_hash: ファイル内容のSHA-256
+            data: PDFファイルの内容
+        """
+        self.path = path
+        self.file_hash = file_hash
+        self._data = data
+        self._lock = threading.RLock()
+        self._pypdf2_reader = None
+        self._fitz_doc = None
+        self._plumber_pdf = None
+        self._page_count: Optional[int] = None
+        self._texts: Dict[Tuple[str, int], str] = {}
+        self._features: Dict[int, PageFeatures] = {}
+
+    def _reader(self):
+        """PyPDF2のリーダー（ロック内で呼ぶ）"""
+        if self._pypdf2_reader is None:
+            self._pypdf2_reader = PyPDF2.PdfReader(io.BytesIO(self._data))
+        return self._pypdf2_reader
+
+    def _fitz(self):
+        """PyMuPDFのドキュメント（ロック内で呼ぶ）"""
+        if not HAS_PYMUPDF:
+            raise ImportError("PyMuPDF is not installed")
+        if self._fitz_doc is None:
+            self._fitz_doc = fitz.open(stream=self._data, filetype="pdf")
+        return self._fitz_doc
+
+    def _plumber(self):
+        """pdfplumberのドキュメント（ロック内で呼ぶ）"""
+        if self._plumber_pdf is None:
+            import pdfplumber
+            self._plumber_pdf = pdfplumber.open(io.BytesIO(self._data))
+        return self._plumber_pdf
+
+    @property
+    def page_count(self) -> int:
+        """総ページ数"""
+        with self._lock:
+            if self._page_count is None:
+                if HAS_PYMUPDF:
+                    self._page_count = len(self._fitz())
+                else:
+                    self._page_count = len(self._reader().pages)
+            return self._page_count
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """PDFメタデータ（PyMuPDF）"""
+        with self._lock:
+            return dict(self._fitz().metadata or {})
+
+    def page_text(self, page_num: int, engine: Optional[str] = None) -> str:
+        """
+        1ページ分のテキストを取得（初回のみ抽出）
+
+        Args:
+            page_num: ページ番号（1始まり）
+            engine: 抽出エンジン（"pymupdf" または "pypdf2"）。Noneで DEFAULT_TEXT_ENGINE
+
+        Returns:
+            ページのテキスト
+        """
+        engine = resolve_text_engine(engine)
+        if not 1 <= page_num <= self.page_count:
+            raise IndexError(f"Page {page_num} out of range (1-{self.page_count})")
+
+        key = (engine, page_num)
+        with self._lock:
+            text = self._texts.get(key)
+            if text is None:
+                if engine == ENGINE_PYMUPDF:
+                    try:
+                        text = self._fitz()[page_num - 1].get_text()
+                    except Exception as e:
+                        logger.warning(f"PyMuPDF text extraction failed on page {page_num}, using PyPDF2: {e}")
+                if text is None:
+                    text = self._reader().pages[page_num - 1].extract_text() or ""
+                self._texts[key] = text
+            return text
+
+    def page_texts(self, start_page: int = 1, end_page: Optional[int] = None,
+                   engine: Optional[str] = None) -> List[str]:
+        """
+        ページ範囲のテキストを取得
+
+        未抽出のページが PARALLEL_MIN_PAGES 以上あり PDF_TEXT_WORKERS が2以上の場合は、
+        プロセスプールでまとめて抽出します。
+
+        Args:
+            start_page: 開始ページ（1始まり）
+            end_page: 終了ページ（この番号を含む）。Noneまたは総ページ数を超える場合は最終ページまで
+            engine: 抽出エンジン（Noneで DEFAULT_TEXT_ENGINE）
+
+        Returns:
+            ページ順のテキストのリスト
+        """
+        engine = resolve_text_engine(engine)
+        first = max(start_page, 1)
+        last = self.page_count if end_page is None else min(end_page, self.page_count)
+        if PDF_TEXT_WORKERS > 1:
+            self._prefetch_texts(first, last, engine)
+        return [self.page_text(page_num, engine) for page_num in range(first, last + 1)]
+
+    def _prefetch_texts(self, first: int, last: int, engine: str):
+        """未抽出のページをプロセスプールでまとめて抽出してキャッシュ"""
+        with self._lock:
+            missing = [p for p in range(first, last + 1) if (engine, p) not in self._texts]
+        if len(missing) < PARALLEL_MIN_PAGES:
+            return
+
+        # ロックを持たずに抽出（その間も他のスレッドは画像化などを行える）
+        texts = extract_page_texts_parallel(self.path, missing[0], missing[-1], engine)
+        with self._lock:
+            for page_num, text in enumerate(texts, start=missing[0]):
+                self._texts.setdefault((engine, page_num), text)
+
+    def paged_text(self, start_page: int = 1, end_page: Optional[int] = None,
+                   engine: Optional[str] = None, marker: Optional[str] = None) -> PagedText:
+        """
+        ページ範囲のテキストをページ配列付きで取得
+
+        Args:
+            start_page: 開始ページ（1始まり）
+            end_page: 終了ページ（この番号を含む）。Noneで最終ページまで
+            engine: 抽出エンジン（Noneで DEFAULT_TEXT_ENGINE）
+            marker: ページ番号マーカーの書式（例: "[PAGE {page}/{total}]"）。Noneでマーカーなし
+
+        Returns:
+            PagedText（{total} は範囲内のページ数）
+        """
+        first = max(start_page, 1)
+        texts = self.page_texts(first, end_page, engine)
+        return PagedText.from_pages(enumerate(texts, start=first), marker=marker)
+
+    def render_png(self, page_num: int, dpi: int = 150) -> bytes:
+        """
+        ページをPNG画像に変換
+
+        Args:
+            page_num: ページ番号（1始まり）
+            dpi: 解像度
+
+        Returns:
+            PNGバイト列
+        """
+        return self.render_image(page_num, dpi=dpi)[0]
+
+    def render_image(self, page_num: int, dpi: float = 150,
+                     clip: Optional[Tuple[float, float, float, float]] = None,
+                     image_format: str = FORMAT_PNG, grayscale: bool = False,
+                     quality: int = DEFAULT_IMAGE_QUALITY) -> Tuple[bytes, int, int]:
+        """
+        ページ（または一部の範囲）を画像に変換
+
+        Args:
+            page_num: ページ番号（1始まり）
+            dpi: 解像度
+            clip: 画像化する範囲 (x0, y0, x1, y1)（pt）。Noneでページ全体
+            image_format: "png" / "jpeg" / "webp"
+            grayscale: グレースケールで画像化するか
+            quality: JPEG・WebPの品質
+
+        Returns:
+            (画像バイト列, 幅px, 高さpx)
+        """
+        with self._lock:
+            page = self._fitz()[page_num - 1]
+            mat = fitz.Matrix(dpi / 72, dpi / 72)  # 72 DPI がデフォルト
+            pix = page.get_pixmap(
+                matrix=mat,
+                clip=fitz.Rect(clip) if clip else None,
+                colorspace=fitz.csGRAY if grayscale else fitz.csRGB,
+            )
+        # エンコードはロックの外で行う（Pixmapはドキュメントから独立している）
+        return encode_pixmap(pix, image_format, quality), pix.width, pix.height
+
+    def page_rect(self, page_num: int) -> Tuple[float, float, float, float]:
+        """ページの範囲 (x0, y0, x1, y1)（pt）"""
+        with self._lock:
+            return tuple(self._fitz()[page_num - 1].rect)
+
+    def content_bbox(self, page_num: int, margin: float = 0.0) -> Optional[Tuple[float, float, float, float]]:
+        """
+        ページ上で描画される内容（文字・線・画像）を囲む範囲
+
+        Args:
+            page_num: ページ番号（1始まり）
+            margin: 範囲の周囲に加える余白（pt）
+
+        Returns:
+            (x0, y0, x1, y1)（pt、ページの範囲内）。内容がないページはNone
+        """
+        with self._lock:
+            page = self._fitz()[page_num - 1]
+            bbox = fitz.Rect()
+            for kind, rect in page.get_bboxlog():
+                # 不可視テキスト（スキャンPDFのOCRレイヤーなど）は除く
+                if kind != "ignore-text":
+                    bbox |= rect
+            bbox &= page.rect
+            if bbox.is_empty:
+                return None
+            bbox = (bbox + (-margin, -margin, margin, margin)) & page.rect
+            return tuple(bbox)
+
+    def page_images(self, page_num: int) -> List[Dict[str, Any]]:
+        """
+        ページに埋め込まれた画像の情報を取得
+
+        Returns:
+            [{"index": 0, "ext": "png", "size": バイト数}, ...]
+        """
+        images = []
+        with self._lock:
+            doc = self._fitz()
+            for img_index, img in enumerate(doc[page_num - 1].get_images()):
+                xref = img[0]
+                try:
+                    base_image = doc.extract_image(xref)
+                    images.append({
+                        'index': img_index,
+                        'ext': base_image['ext'],
+                        'size': len(base_image['image'])
+                    })
+                except Exception as e:
+                    logger.warning(f"Failed to extract image on page {page_num}: {e}")
+        return images
+
+    def has_images(self, page_num: int) -> bool:
+        """ページに埋め込み画像があるか"""
+        with self._lock:
+            return bool(self._fitz()[page_num - 1].get_images())
+
+    def page_features(self, page_num: int) -> PageFeatures:
+        """
+        ページ分類用の特徴量（テキスト量・罫線・描画パス数・キーワード一致数）を取得
+
+        Args:
+            page_num: ページ番号（1始まり）
+
+        Returns:
+            PageFeatures（初回のみ計算）
+        """
+        text = self.page_text(page_num, engine=ENGINE_PYMUPDF)
+        with self._lock:
+            features = self._features.get(page_num)
+            if features is None:
+                features = classify_page(self._fitz()[page_num - 1], page_num, text=text)
+                self._features[page_num] = features
+            return features
+
+    def all_page_features(self) -> List[PageFeatures]:
+        """全ページの PageFeatures（ページ順）"""
+        return [self.page_features(page_num) for page_num in range(1, self.page_count + 1)]
+
+    def table_grids(self, page_num: int) -> List[Dict[str, Any]]:
+        """
+        ページの罫線と単語の位置から表を再構成（PyMuPDF の find_tables）
+
+        Returns:
+            表ごとの {"bbox": (x0, y0, x1, y1),
+                      "rows": [[セルのテキスト or None, ...], ...],
+                      "cells": [[(x0, y0, x1, y1) or None, ...], ...]}。
+            結合セルに覆われた位置は rows・cells とも None です
+        """
+        with self._lock:
+            page = self._fitz()[page_num - 1]
+            if not hasattr(page, "find_tables"):  # PyMuPDF 1.23未満
+                return []
+            grids = []
+            for table in page.find_tables().tables:
+                grids.append({
+                    "bbox": tuple(table.bbox),
+                    "rows": table.extract(),
+                    "cells": [[tuple(cell) if cell else None for cell in row.cells] for row in table.rows],
+                })
+            return grids
+
+    def page_tables(self, page_num: int) -> List[List[List[Optional[str]]]]:
+        """ページのテーブルを抽出（pdfplumber）"""
+        with self._lock:
+            return self._plumber().pages[page_num - 1].extract_tables()
+
+    def close(self):
+        """開いているドキュメントを閉じる"""
+        with self._lock:
+            if self._fitz_doc is not None:
+                self._fitz_doc.close()
+                self._fitz_doc = None
+            if self._plumber_pdf is not None:
+                self._plumber_pdf.close()
+                self._plumber_pdf = None
+            self._pypdf2_reader = None
+
+
+class PdfDocumentCache:
+    """
+    ファイル内容ハッシュをキーにしたPdfDocumentのLRUキャッシュ
+
+    スレッドセーフです。get_pdf_cache() でプロセス共通のインスタンスを取得してください。
+    """
+
+    def __init__(self, max_documents: int = DEFAULT_MAX_DOCUMENTS):
+        """
+        Args:
+            max_documents: 保持するドキュメント数の上限
+        """
+        self.max_documents = max(1, max_documents)
+        self._lock = threading.Lock()
+        self._documents: "OrderedDict[str, PdfDocument]" = OrderedDict()
+        # パス → (mtime, サイズ, ハッシュ)。ファイルが変わっていなければ再ハッシュしない
+        self._signatures: Dict[str, Tuple[int, int, str]] = {}
+
+    def get(self, pdf_path: str) -> PdfDocument:
+        """
+        PDFドキュメントを取得（同じ内容のファイルは同じインスタンス）
+
+        Args:
+            pdf_path: PDFファイルパス
+
+        Raises:
+            FileNotFoundError: ファイルがない場合
+        """
+        key = str(Path(pdf_path).resolve())
+        stat = os.stat(key)
+
+        with self._lock:
+            signature = self._signatures.get(key)
+            if signature and signature[:2] == (stat.st_mtime_ns, stat.st_size):
+                document = self._documents.get(signature[2])
+                if document is not None:
+                    self._documents.move_to_end(signature[2])
+                    return document
+
+        with open(key, 'rb') as f:
+            data = f.read()
+        file_hash = hashlib.sha256(data).hexdigest()
+
+        with self._lock:
+            self._signatures[key] = (stat.st_mtime_ns, stat.st_size, file_hash)
+            document = self._documents.get(file_hash)
+            if document is None:
+                document = PdfDocument(pdf_path, file_hash, data)
+                self._documents[file_hash] = document
+                logger.debug(f"PDF cached: {Path(pdf_path).name} (hash={file_hash[:12]})")
+                # 古いドキュメントは参照を外すだけ（使用中のスレッドがあり得るため閉じない）
+                while len(self._documents) > self.max_documents:
+                    self._documents.popitem(last=False)
+            else:
+                self._documents.move_to_end(file_hash)
+            return document
+
+    def clear(self):
+        """キャッシュを破棄"""
+        with self._lock:
+            self._documents.clear()
+            self._signatures.clear()
+
+
+# シングルトンインスタンス
+_pdf_cache: Optional[PdfDocumentCache] = None
+_pdf_cache_lock = threading.Lock()
+
+
+def get_pdf_cache() -> PdfDocumentCache:
+    """プロセス共通のPDFドキュメントキャッシュを取得"""
+    global _pdf_cache
+    with _pdf_cache_lock:
+        if _pdf_cache is None:
+            _pdf_cache = PdfDocumentCache()
+        return _pdf_cache
+
+
+def open_pdf(pdf_path: str) -> PdfDocument:
+    """キャッシュ済みのPDFドキュメントを取得（ショートカット関数）"""
+    return get_pdf_cache().get(pdf_path)
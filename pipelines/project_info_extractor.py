@@ -3,11 +3,10 @@
 import os
 from typing import Dict, Any
 from loguru import logger
-from anthropic import Anthropic
 from dotenv import load_dotenv
 
 from pipelines.schemas import ProjectInfo
-from pipelines.cost_tracker import record_cost
+from pipelines.llm_gateway import get_llm_gateway
 
 
 class ProjectInfoExtractor:
@@ -16,7 +15,7 @@ class ProjectInfoExtractor:
     def __init__(self):
         """Claude LLMを初期化"""
         load_dotenv()
-        self.client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
+        self.client = get_llm_gateway()
         self.model_name = os.getenv("CLAUDE_MODEL", "claude-sonnet-4-5-20250929")
         logger.info(f"ProjectInfoExtractor initialized: {self.model_name}")
 
@@ -69,16 +68,9 @@ class ProjectInfoExtractor:
                 model=self.model_name,
                 max_tokens=2000,
                 temperature=0,
-                messages=[{"role": "user", "content": prompt}]
-            )
-
-            # コスト記録
-            record_cost(
+                messages=[{"role": "user", "content": prompt}],
                 operation="工事情報抽出",
-                model_name=self.model_name,
-                input_tokens=response.usage.input_tokens,
-                output_tokens=response.usage.output_tokens,
-                metadata={"source": "extract_project_info"}
+                cost_metadata={"source": "extract_project_info"}
             )
 
             content = response.content[0].text
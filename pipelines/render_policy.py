@@ -0,0 +1,215 @@
+"""
+Vision API用のページ画像化ポリシー
+
+ページを固定解像度（150/200 DPI）のPNGで送ると、Vision APIの入力トークン数と送信サイズは
+画素数に比例して増えます。また、APIは長辺1568px・約115万画素を超える画像を縮小してから
+読むため、それ以上の解像度は送信サイズが増えるだけで読み取り精度には寄与しません。
+
+RenderPolicy はページごとに
+- 内容（諸元表などの密な表 / 図面 / 本文 / スキャン画像）に応じて解像度を選び、
+- API側で縮小されない画素数に収まるよう解像度を抑え、
+- 余白を除いた内容の範囲（content bbox）だけを切り出し、
+- 必要に応じてJPEG/WebP・グレースケールで圧縮
+して画像化します。
+"""
+
+import base64
+import io
+import math
+import os
+from dataclasses import dataclass
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from pipelines.page_classifier import DRAWING_MIN_SCORE, SPEC_TABLE_MIN_SCORE, PageFeatures
+
+# Vision APIが縮小せずに読む画像サイズの上限（長辺・画素数）
+API_MAX_LONG_EDGE = 1568
+API_MAX_PIXELS = 1_150_000
+
+# 画像1枚の入力トークン数の目安（幅px × 高さpx / 750）
+PIXELS_PER_TOKEN = 750
+
+# 画像形式
+FORMAT_PNG = "png"
+FORMAT_JPEG = "jpeg"
+FORMAT_WEBP = "webp"
+MEDIA_TYPES = {
+    FORMAT_PNG: "image/png",
+    FORMAT_JPEG: "image/jpeg",
+    FORMAT_WEBP: "image/webp",
+}
+
+# ページの内容の種類
+CONTENT_TABLE = "table"
+CONTENT_DRAWING = "drawing"
+CONTENT_SCAN = "scan"
+CONTENT_TEXT = "text"
+
+# スキャンページとみなす画像の占有率
+SCAN_MIN_IMAGE_COVERAGE = 0.5
+
+# 既定の画像形式・グレースケール・圧縮品質（環境変数で変更可能）
+DEFAULT_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", FORMAT_PNG)
+DEFAULT_GRAYSCALE = os.getenv("VISION_IMAGE_GRAYSCALE", "0") == "1"
+DEFAULT_IMAGE_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", "85"))
+
+
+def estimate_image_tokens(width: int, height: int) -> int:
+    """
+    画像1枚の入力トークン数の目安
+
+    APIの上限（API_MAX_LONG_EDGE・API_MAX_PIXELS）を超える画像は縮小後のサイズで計算します。
+    """
+    if width <= 0 or height <= 0:
+        return 0
+    scale = min(1.0, API_MAX_LONG_EDGE / max(width, height), math.sqrt(API_MAX_PIXELS / (width * height)))
+    return math.ceil((width * scale) * (height * scale) / PIXELS_PER_TOKEN)
+
+
+def encode_pixmap(pix, image_format: str = FORMAT_PNG, quality: int = DEFAULT_IMAGE_QUALITY) -> bytes:
+    """
+    PyMuPDFのPixmapを画像バイト列にエンコード
+
+    Args:
+        pix: fitz.Pixmap（RGBまたはグレースケール、アルファなし）
+        image_format: "png" / "jpeg" / "webp"
+        quality: JPEG・WebPの品質（1-100）
+
+    Returns:
+        画像バイト列
+    """
+    if image_format == FORMAT_PNG:
+        return pix.tobytes("png")
+    if image_format == FORMAT_JPEG:
+        return pix.tobytes("jpeg", jpg_quality=quality)
+    if image_format == FORMAT_WEBP:
+        from PIL import Image
+        mode = "L" if pix.n == 1 else "RGB"
+        image = Image.frombytes(mode, (pix.width, pix.height), pix.samples)
+        buffered = io.BytesIO()
+        image.save(buffered, format="WEBP", quality=quality)
+        return buffered.getvalue()
+    raise ValueError(f"Unknown image format: {image_format}")
+
+
+class RenderedPage(NamedTuple):
+    """Vision APIに送るページ画像"""
+    page_num: int
+    data: bytes
+    media_type: str
+    width: int
+    height: int
+    dpi: float
+    content_type: str
+
+    @property
+    def estimated_tokens(self) -> int:
+        """入力トークン数の目安"""
+        return estimate_image_tokens(self.width, self.height)
+
+    def to_content_block(self) -> Dict[str, Any]:
+        """Messages APIの画像コンテンツブロック"""
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": self.media_type,
+                "data": base64.b64encode(self.data).decode('utf-8'),
+            },
+        }
+
+
+@dataclass(frozen=True)
+class RenderPolicy:
+    """
+    ページの画像化ポリシー
+
+    dpi を指定すると内容に関係なくその解像度でページ全体を画像化します（従来の動作）。
+    """
+    dpi: Optional[int] = None            # 固定解像度（Noneで内容に応じて選ぶ）
+    table_dpi: int = 200                 # 密な表（諸元表など）
+    scan_dpi: int = 200                  # スキャン画像のページ
+    text_dpi: int = 150                  # 本文ページ
+    drawing_dpi: int = 100               # 図面（線が主体で文字が少ない）
+    fit_to_api_limit: bool = True        # APIで縮小されない画素数に収める
+    crop: bool = True                    # 余白を除いた内容の範囲だけを切り出す
+    crop_margin: float = 12.0            # 切り出し時の余白（pt）
+    image_format: str = DEFAULT_IMAGE_FORMAT
+    grayscale: bool = DEFAULT_GRAYSCALE
+    quality: int = DEFAULT_IMAGE_QUALITY
+
+    @classmethod
+    def fixed(cls, dpi: int) -> "RenderPolicy":
+        """固定解像度・ページ全体・PNGのポリシー"""
+        return cls(dpi=dpi, fit_to_api_limit=False, crop=False, image_format=FORMAT_PNG, grayscale=False)
+
+    @property
+    def media_type(self) -> str:
+        """画像のMIMEタイプ"""
+        return MEDIA_TYPES[self.image_format]
+
+    def content_type(self, features: PageFeatures) -> str:
+        """ページの内容の種類（table / drawing / scan / text）"""
+        if features.spec_table_score >= SPEC_TABLE_MIN_SCORE:
+            return CONTENT_TABLE
+        if features.drawing_score >= DRAWING_MIN_SCORE:
+            return CONTENT_DRAWING
+        if features.char_count == 0 and features.image_coverage >= SCAN_MIN_IMAGE_COVERAGE:
+            return CONTENT_SCAN
+        return CONTENT_TEXT
+
+    def choose_dpi(self, content_type: str, width_pt: float, height_pt: float) -> float:
+        """
+        内容の種類と画像化する範囲の大きさから解像度を決める
+
+        Args:
+            content_type: ページの内容の種類
+            width_pt: 画像化する範囲の幅（pt）
+            height_pt: 画像化する範囲の高さ（pt）
+        """
+        if self.dpi is not None:
+            return float(self.dpi)
+        dpi = {
+            CONTENT_TABLE: self.table_dpi,
+            CONTENT_SCAN: self.scan_dpi,
+            CONTENT_DRAWING: self.drawing_dpi,
+        }.get(content_type, self.text_dpi)
+        if self.fit_to_api_limit and width_pt > 0 and height_pt > 0:
+            limit = min(
+                API_MAX_LONG_EDGE / max(width_pt, height_pt),
+                math.sqrt(API_MAX_PIXELS / (width_pt * height_pt)),
+            ) * 72
+            # 画素数の丸めで上限を超えないよう少し下げる
+            dpi = min(dpi, math.floor(limit * 0.99))
+        return float(dpi)
+
+    def render(self, pdf, page_num: int) -> RenderedPage:
+        """
+        ページを画像化
+
+        Args:
+            pdf: PdfDocument（pdf_cache.open_pdf() の戻り値）
+            page_num: ページ番号（1始まり）
+
+        Returns:
+            RenderedPage
+        """
+        content_type = CONTENT_TEXT
+        if self.dpi is None:
+            content_type = self.content_type(pdf.page_features(page_num))
+
+        clip: Optional[Tuple[float, float, float, float]] = None
+        if self.crop:
+            clip = pdf.content_bbox(page_num, margin=self.crop_margin)
+        x0, y0, x1, y1 = clip or pdf.page_rect(page_num)
+
+        dpi = self.choose_dpi(content_type, x1 - x0, y1 - y0)
+        data, width, height = pdf.render_image(
+            page_num, dpi=dpi, clip=clip, image_format=self.image_format,
+            grayscale=self.grayscale, quality=self.quality,
+        )
+        return RenderedPage(page_num, data, self.media_type, width, height, dpi, content_type)
+
+
+# 既定のポリシー（内容に応じた解像度・切り出し・形式は環境変数で指定）
+DEFAULT_RENDER_POLICY = RenderPolicy()
@@ -5,12 +5,13 @@
 精度検証や見積比較に活用します。
 """
 
-import json
 from pathlib import Path
 from typing import List, Dict, Any, Optional
 from collections import defaultdict
 from loguru import logger
 
+from pipelines.kb_registry import get_kb_registry
+
 
 class SimilarProjectSearch:
     """
@@ -30,18 +31,16 @@ class SimilarProjectSearch:
         """
         self.kb_path = Path(kb_path)
         self.kb_data = self._load_kb()
-        self.project_index = self._build_project_index()
+        # プロジェクト別インデックスはKBスナップショットごとにプロセス内で共有
+        self.project_index = get_kb_registry().get_derived(
+            str(self.kb_path), "similar_project_index", self._build_project_index
+        )
 
     def _load_kb(self) -> List[Dict[str, Any]]:
-        """KBデータを読み込み"""
-        if not self.kb_path.exists():
-            logger.warning(f"KB file not found: {self.kb_path}")
-            return []
-
-        with open(self.kb_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        """KBデータを読み込み（プロセス共通の読み取り専用スナップショット）"""
+        return get_kb_registry().get_kb(str(self.kb_path))
 
-    def _build_project_index(self) -> Dict[str, Dict[str, Any]]:
+    def _build_project_index(self, kb_data: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
         """
         プロジェクト別のインデックスを構築
         """
@@ -53,7 +52,7 @@ class SimilarProjectSearch:
             "item_count": 0
         })
 
-        for item in self.kb_data:
+        for item in kb_data:
             project = item.get("source_project", "unknown")
             discipline = item.get("discipline", "")
             price = item.get("unit_price", 0) or 0
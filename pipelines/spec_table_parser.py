@@ -0,0 +1,268 @@
+"""
+諸元表のローカル抽出（テキストレイヤーから・API不要）
+
+テキストレイヤーのある仕様書PDFでは、諸元表の罫線と単語の位置（PyMuPDF の find_tables）から
+表のグリッドを再構成し、Vision抽出と同じ rooms / totals の構造に変換します。
+ページごとに信頼度を計算し、信頼度の低いページだけを Vision API に回します。
+
+列の見出しは複数行・結合セルになっているため、見出しセルの横幅に含まれる列すべてに
+そのテキストを割り当ててから、キーワードで列の意味（室数・階・ガス・コンセントなど）を判定します。
+"""
+
+import os
+import re
+import unicodedata
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from loguru import logger
+
+# ローカル抽出の結果を採用する信頼度（これ未満のページはVisionで抽出）
+LOCAL_TABLE_MIN_CONFIDENCE = float(os.getenv("SPEC_TABLE_LOCAL_MIN_CONFIDENCE", "0.8"))
+
+# ○（あり）とみなす記号、―（なし）とみなす記号
+MARK_CHARS = "○〇◎●"
+NONE_CHARS = "―－-ー×"
+
+# 列の判定キーワード（見出しはNFKCで正規化・空白除去して照合）
+COUNT_HEADERS = ("室数", "部屋数")
+FLOOR_HEADERS = ("階",)
+GAS_HEADERS = ("ガス", "ガス栓")  # 見出しの最下段と完全一致（「ガス湯沸器」などを除く）
+OUTLET_KEYWORDS = ("コンセント",)
+AIR_CONDITIONING_KEYWORDS = ("冷暖房", "空調", "エアコン")
+WATER_SUPPLY_KEYWORDS = ("給水",)
+DRAINAGE_KEYWORDS = ("排水",)
+LIGHTING_TYPE_KEYWORDS = ("照明器具",)
+LIGHTING_LUX_KEYWORDS = ("照度",)
+
+# 室名に含まれる場合は集計行とみなして除く
+TOTAL_ROW_KEYWORDS = ("合計", "小計")
+
+
+class SpecTablePage(NamedTuple):
+    """1ページ分のローカル抽出結果"""
+    page_num: int
+    rooms: List[Dict[str, Any]]
+    confidence: float  # 0〜1（室名のある行のうち、室数・各列を読み取れた行の割合）
+
+
+def normalize_cell(text: Optional[str]) -> str:
+    """セルのテキストを正規化（NFKC・改行と空白を除去）"""
+    return "".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+def parse_number(text: str) -> Optional[float]:
+    """数値のセルを読み取る（カンマ区切り可。数値でなければNone）"""
+    value = text.replace(",", "")
+    if re.fullmatch(r"\d+(\.\d+)?", value):
+        return float(value)
+    return None
+
+
+def mark_count(text: str) -> int:
+    """○・数値のセルを個数として読み取る（○は1、―や空欄は0）"""
+    number = parse_number(text)
+    if number is not None:
+        return int(number)
+    if any(ch in MARK_CHARS for ch in text):
+        return 1
+    return 0
+
+
+def is_marked(text: str) -> bool:
+    """○・数値などの記入があるか（―・空欄はFalse）"""
+    return bool(text) and not all(ch in NONE_CHARS for ch in text)
+
+
+def column_labels(grid: Dict[str, Any], header_rows: int) -> List[List[str]]:
+    """
+    列ごとの見出し（上の段から順）を作成
+
+    見出しセルが複数列に結合されている場合は、セルの横幅に中心が含まれる列すべてに割り当てます。
+    """
+    rows = grid["rows"]
+    cells = grid["cells"]
+    col_count = max((len(row) for row in rows), default=0)
+
+    # 列の左端（その列から始まるセルの左端の最小値）から列の中心を求める
+    lefts: List[Optional[float]] = [None] * col_count
+    for row in cells:
+        for col, cell in enumerate(row):
+            if cell is not None and (lefts[col] is None or cell[0] < lefts[col]):
+                lefts[col] = cell[0]
+    right_edge = grid["bbox"][2]
+    centers: List[Optional[float]] = []
+    for col, left in enumerate(lefts):
+        right = next((x for x in lefts[col + 1:] if x is not None), right_edge)
+        centers.append(None if left is None else (left + right) / 2)
+
+    labels: List[List[str]] = [[] for _ in range(col_count)]
+    for row_index in range(header_rows):
+        for col, cell in enumerate(cells[row_index]):
+            text = normalize_cell(rows[row_index][col]) if col < len(rows[row_index]) else ""
+            if cell is None or not text:
+                continue
+            for target, center in enumerate(centers):
+                if center is not None and cell[0] <= center <= cell[2]:
+                    if not labels[target] or labels[target][-1] != text:
+                        labels[target].append(text)
+    return labels
+
+
+def _find_columns(labels: Sequence[Sequence[str]], keywords: Sequence[str], exact_leaf: bool = False) -> List[int]:
+    """見出しにキーワードを含む列（exact_leaf=True の場合は最下段の見出しが一致する列）"""
+    columns = []
+    for col, parts in enumerate(labels):
+        if not parts:
+            continue
+        if exact_leaf:
+            if parts[-1] in keywords:
+                columns.append(col)
+        elif any(kw in part for part in parts for kw in keywords):
+            columns.append(col)
+    return columns
+
+
+def parse_spec_table_grid(grid: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], float]:
+    """
+    表のグリッドを rooms の構造に変換
+
+    Args:
+        grid: PdfDocument.table_grids() の要素
+
+    Returns:
+        (rooms, 信頼度)。室数の列が見つからない表は ([], 0.0)
+    """
+    rows = [[normalize_cell(text) for text in row] for row in grid["rows"]]
+
+    # 室数の列と、最初のデータ行（室数が数値の行）を探す
+    count_col = first_data_row = None
+    for row_index, row in enumerate(rows):
+        if count_col is None:
+            count_col = next((col for col, text in enumerate(row) if text in COUNT_HEADERS), None)
+            continue
+        if count_col < len(row) and parse_number(row[count_col]) is not None:
+            first_data_row = row_index
+            break
+    if count_col is None or first_data_row is None:
+        return [], 0.0
+
+    labels = column_labels(grid, first_data_row)
+    data_rows = rows[first_data_row:]
+
+    # 室名の列: 室数より左で、データ行の記入が最も多い列（同数なら右側）
+    fill_counts = [(sum(1 for row in data_rows if col < len(row) and row[col]), col) for col in range(count_col)]
+    if not fill_counts:
+        return [], 0.0
+    name_col = max(fill_counts)[1]
+
+    floor_cols = [col for col in _find_columns(labels, FLOOR_HEADERS) if col > count_col]
+    floor_col = floor_cols[0] if floor_cols else None
+    gas_cols = _find_columns(labels, GAS_HEADERS, exact_leaf=True)
+    outlet_cols = _find_columns(labels, OUTLET_KEYWORDS)
+    air_cols = _find_columns(labels, AIR_CONDITIONING_KEYWORDS)
+    water_cols = _find_columns(labels, WATER_SUPPLY_KEYWORDS)
+    drain_cols = _find_columns(labels, DRAINAGE_KEYWORDS)
+    lighting_type_cols = _find_columns(labels, LIGHTING_TYPE_KEYWORDS)
+    lux_cols = _find_columns(labels, LIGHTING_LUX_KEYWORDS)
+
+    field_columns = [gas_cols, outlet_cols, air_cols, water_cols, drain_cols, lighting_type_cols, lux_cols]
+    if not any(field_columns):
+        return [], 0.0
+
+    rooms = []
+    named_rows = 0
+    for row in data_rows:
+        if len(row) <= count_col:
+            continue
+        room_name = row[name_col]
+        if not room_name or any(kw in room_name for kw in TOTAL_ROW_KEYWORDS):
+            continue
+        named_rows += 1
+
+        count_text = row[count_col]
+        count = parse_number(count_text)
+        if count_text and count is None:
+            # 室数が読み取れない行（セルの結合ずれなど）は信頼度を下げて除く
+            continue
+
+        room: Dict[str, Any] = {"room_name": room_name, "count": int(count) if count is not None else None}
+        if floor_col is not None:
+            room["floor"] = row[floor_col] or None
+        if gas_cols:
+            room["gas_outlets"] = sum(mark_count(row[col]) for col in gas_cols)
+        if outlet_cols:
+            room["electrical_outlets"] = sum(mark_count(row[col]) for col in outlet_cols)
+        if air_cols:
+            room["has_air_conditioning"] = any(is_marked(row[col]) for col in air_cols)
+        if water_cols:
+            room["has_water_supply"] = any(is_marked(row[col]) for col in water_cols)
+        if drain_cols:
+            room["has_drainage"] = any(is_marked(row[col]) for col in drain_cols)
+        if lighting_type_cols:
+            room["lighting_type"] = row[lighting_type_cols[0]] or None
+        if lux_cols:
+            lux = parse_number(row[lux_cols[0]])
+            room["lighting_lux"] = int(lux) if lux is not None else None
+        rooms.append(room)
+
+    confidence = len(rooms) / named_rows if named_rows else 0.0
+    return rooms, confidence
+
+
+def extract_spec_table_page(pdf, page_num: int) -> SpecTablePage:
+    """
+    諸元表ページをテキストレイヤーから抽出
+
+    Args:
+        pdf: PdfDocument（pdf_cache.open_pdf() の戻り値）
+        page_num: ページ番号（1始まり）
+
+    Returns:
+        SpecTablePage。テキストレイヤー・表がないページは信頼度0
+    """
+    if pdf.page_features(page_num).char_count == 0:
+        return SpecTablePage(page_num, [], 0.0)
+
+    best = SpecTablePage(page_num, [], 0.0)
+    for grid in pdf.table_grids(page_num):
+        rooms, confidence = parse_spec_table_grid(grid)
+        if rooms and (confidence, len(rooms)) > (best.confidence, len(best.rooms)):
+            best = SpecTablePage(page_num, rooms, confidence)
+
+    logger.debug(f"Local spec table page {page_num}: {len(best.rooms)} rooms (confidence {best.confidence:.2f})")
+    return best
+
+
+def merge_rooms(room_lists: Sequence[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    ページごとの rooms を室名・階で統合（諸元表は建築・機械設備と電気設備でページが分かれるため）
+
+    同じ項目が複数のページにある場合は先に読み取った値を使います。
+    """
+    merged: Dict[Tuple[str, Any], Dict[str, Any]] = {}
+    for rooms in room_lists:
+        for room in rooms:
+            if not isinstance(room, dict):
+                continue
+            key = (room.get("room_name"), room.get("floor"))
+            target = merged.setdefault(key, {})
+            for field, value in room.items():
+                if target.get(field) is None:
+                    target[field] = value
+    return list(merged.values())
+
+
+def summarize_rooms(rooms: Sequence[Dict[str, Any]]) -> Dict[str, Any]:
+    """rooms から totals（部屋数・ガス栓数・コンセント数）を集計（Vision抽出と同じ計算）"""
+    totals = {
+        "room_count": 0,
+        "gas_outlet_total": 0,
+        "electrical_outlet_total": 0,
+        "total_area_m2": 0
+    }
+    for room in rooms:
+        count = room.get("count", 1) or 1
+        totals["room_count"] += count
+        totals["gas_outlet_total"] += (room.get("gas_outlets", 0) or 0) * count
+        totals["electrical_outlet_total"] += (room.get("electrical_outlets", 0) or 0) * count
+    return totals
@@ -0,0 +1,112 @@
+"""
+ステージ単位の結果キャッシュ
+
+見積生成パイプラインの各ステージ（テキスト抽出・建物情報抽出・Vision抽出など）の
+結果を、PDFハッシュ・ステージ名・プロンプトバージョン・モデル名をキーにして
+JSONファイルとして保存します。同じ仕様書で再実行した場合は、キャッシュがある
+ステージのAPI呼び出しを個別にスキップできます。
+"""
+
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Optional
+
+from loguru import logger
+
+
+def is_empty_result(result: Any) -> bool:
+    """
+    結果が空かどうか（空文字・空リスト・値がすべて空のdict）
+
+    抽出メソッドはAPIエラー時に {"rooms": [], "totals": {}} のような空の結果を返すため、
+    これらはキャッシュせず次回再実行します。
+    """
+    if isinstance(result, dict):
+        return all(is_empty_result(value) for value in result.values())
+    if isinstance(result, (list, tuple, str)):
+        return len(result) == 0
+    return result is None
+
+
+class StageCache:
+    """
+    コンテンツアドレス方式のステージ結果キャッシュ
+
+    キー = sha256(PDFハッシュ, ステージ名, プロンプトバージョン, モデル名)
+    プロンプトやモデルを変更した場合はバージョンを上げれば古い結果は使われません。
+    """
+
+    def __init__(self, cache_dir: str = "cache/stages", enabled: bool = True):
+        """
+        Args:
+            cache_dir: キャッシュの保存先ディレクトリ
+            enabled: Falseの場合は読み書きしない
+        """
+        self.cache_dir = Path(cache_dir)
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        if enabled:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def make_key(pdf_hash: str, stage: str, prompt_version: str, model_name: str) -> str:
+        """キャッシュキーを計算"""
+        raw = "\x1f".join([pdf_hash, stage, str(prompt_version), model_name or ""])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:24]
+
+    def _path(self, stage: str, key: str) -> Path:
+        return self.cache_dir / f"{stage}_{key}.json"
+
+    def get(self, pdf_hash: str, stage: str, prompt_version: str, model_name: str) -> Optional[Any]:
+        """
+        キャッシュ済みのステージ結果を取得
+
+        Returns:
+            保存された結果。キャッシュがない・読めない場合はNone
+        """
+        if not self.enabled:
+            return None
+        path = self._path(stage, self.make_key(pdf_hash, stage, prompt_version, model_name))
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+            logger.info(f"✓ Stage cache hit: {stage} ({path.name})")
+            return cached.get("result")
+        except Exception as e:
+            logger.warning(f"Stage cache read error ({stage}): {e}")
+            return None
+
+    def put(self, pdf_hash: str, stage: str, prompt_version: str, model_name: str, result: Any):
+        """
+        ステージ結果を保存（空の結果は保存しない）
+
+        Args:
+            result: JSONシリアライズ可能な結果
+        """
+        if not self.enabled or is_empty_result(result):
+            return
+        path = self._path(stage, self.make_key(pdf_hash, stage, prompt_version, model_name))
+        cache_data = {
+            "stage": stage,
+            "pdf_hash": pdf_hash,
+            "prompt_version": prompt_version,
+            "model_name": model_name,
+            "created_at": datetime.now().isoformat(),
+            "result": result,
+        }
+        try:
+            # 並列実行時に書きかけのファイルを読まれないよう一時ファイル経由で置き換え
+            with self._lock:
+                tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(cache_data, f, ensure_ascii=False, indent=2, default=str)
+                os.replace(tmp_path, path)
+            logger.info(f"✓ Stage cache saved: {stage} ({path.name})")
+        except Exception as e:
+            logger.warning(f"Stage cache write error ({stage}): {e}")
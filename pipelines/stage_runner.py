@@ -0,0 +1,114 @@
+"""
+ステージ並列実行モジュール
+
+依存関係（DAG）を持つ抽出ステージを、上限付きのスレッドプールで並列に実行します。
+LLM/Vision APIの待ち時間が大半を占めるため、互いに依存しないステージを
+同時に走らせて仕様書1件あたりの処理時間を短縮します。
+
+結果は登録順の辞書で返すため、呼び出し側は実行順に関係なく
+決まった順序で結果をマージできます。
+"""
+
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from loguru import logger
+
+# 同時に実行するステージ数の上限（環境変数で変更可能）
+DEFAULT_STAGE_WORKERS = int(os.getenv("ESTIMATE_STAGE_WORKERS", "4"))
+
+
+class Stage:
+    """実行ステージ（名前・処理・依存ステージ）"""
+
+    def __init__(self, name: str, func: Callable[..., Any], depends_on: Sequence[str] = ()):
+        """
+        Args:
+            name: ステージ名
+            func: 処理関数。依存ステージの結果をキーワード引数（ステージ名）で受け取る
+            depends_on: 依存するステージ名
+        """
+        self.name = name
+        self.func = func
+        self.depends_on = tuple(depends_on)
+
+
+class StageRunner:
+    """
+    DAGベースのステージ実行器
+
+    使用例:
+        runner = StageRunner()
+        runner.add("spec_text", lambda: extract_text(pdf))
+        runner.add("building_info", lambda spec_text: extract_info(spec_text), depends_on=["spec_text"])
+        runner.add("drawing_info", lambda: extract_drawing(pdf))
+        results = runner.run()
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        """
+        Args:
+            max_workers: 同時実行数の上限（Noneで ESTIMATE_STAGE_WORKERS）
+        """
+        self.max_workers = max(1, max_workers or DEFAULT_STAGE_WORKERS)
+        self.stages: Dict[str, Stage] = {}
+
+    def add(self, name: str, func: Callable[..., Any], depends_on: Sequence[str] = ()) -> "StageRunner":
+        """ステージを登録（依存ステージは先に登録しておくこと）"""
+        if name in self.stages:
+            raise ValueError(f"Stage already registered: {name}")
+        for dep in depends_on:
+            if dep not in self.stages:
+                raise ValueError(f"Unknown dependency '{dep}' for stage '{name}'")
+        self.stages[name] = Stage(name, func, depends_on)
+        return self
+
+    def run(self) -> Dict[str, Any]:
+        """
+        全ステージを実行
+
+        Returns:
+            ステージ名 → 結果 の辞書（登録順）
+
+        Raises:
+            ステージ内で発生した例外（登録順で最初に失敗したステージのもの）。
+            失敗したステージに依存するステージは実行されません。
+        """
+        results: Dict[str, Any] = {}
+        errors: Dict[str, BaseException] = {}
+        pending: List[Stage] = list(self.stages.values())
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="stage") as executor:
+            while pending or running:
+                # 依存が揃ったステージを投入
+                for stage in list(pending):
+                    if any(dep in errors for dep in stage.depends_on):
+                        pending.remove(stage)
+                        logger.warning(f"Stage skipped (dependency failed): {stage.name}")
+                        continue
+                    if all(dep in results for dep in stage.depends_on):
+                        pending.remove(stage)
+                        kwargs = {dep: results[dep] for dep in stage.depends_on}
+                        running[executor.submit(stage.func, **kwargs)] = stage
+                        logger.debug(f"Stage started: {stage.name}")
+
+                if not running:
+                    break
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        results[stage.name] = future.result()
+                        logger.debug(f"Stage finished: {stage.name}")
+                    except Exception as e:
+                        errors[stage.name] = e
+                        logger.error(f"Stage failed: {stage.name}: {e}")
+
+        for name in self.stages:
+            if name in errors:
+                raise errors[name]
+
+        return {name: results[name] for name in self.stages if name in results}
@@ -0,0 +1,135 @@
+"""
+ストリーミング応答のJSON配列の逐次パース
+
+LLMの応答（```json ... ``` のコードブロックや説明文を含む）を受け取った順に渡すと、
+JSON配列の要素のオブジェクトが閉じた時点でそのオブジェクトを返します。
+応答全体を待たずに見積項目を順に処理・表示するために使います。
+"""
+
+import json
+from typing import Any, Dict, List
+
+from loguru import logger
+
+
+class JSONArrayStreamParser:
+    """
+    JSON配列を逐次パースする
+
+    配列の開始より前のテキスト（説明文・コードブロックの開始）は読み飛ばし、
+    配列の直下のオブジェクト（{...}）が閉じるたびにパースして返します。
+    配列の開始は、```json のコードブロックの直後の "["、または次の空白以外の文字が "{" か "]" の "[" です
+    （説明文中の「[注記]」などは配列とみなしません）。
+    文字列中の括弧・エスケープは考慮します。配列の直下のオブジェクト以外の要素は読み飛ばし、
+    パースできないオブジェクトとあわせて errors に数えます。
+
+    使い方:
+        parser = JSONArrayStreamParser()
+        for text in text_stream:
+            for item in parser.feed(text):
+                ...
+    """
+
+    def __init__(self):
+        self._buffer: List[str] = []   # 処理中のオブジェクトの文字
+        self._started = False          # 配列の "[" を読んだか
+        self._candidate = False        # 配列の開始の候補の "[" を読み、次の空白以外の文字を待っているか
+        self._preamble = ""            # 配列の開始より前のテキストの末尾（コードブロックの開始の判定用）
+        self.finished = False          # 配列の "]" を読んだか
+        self._depth = 0                # 配列の内側での括弧の深さ（0: 配列の直下）
+        self._in_string = False
+        self._escape = False
+        self._stray = False            # 配列の直下にオブジェクト以外の文字があったか（要素ごとに1回数える）
+        self.items_parsed = 0
+        self.errors = 0
+
+    def feed(self, text: str) -> List[Dict[str, Any]]:
+        """
+        応答の続きを渡し、新たに閉じたオブジェクトを返す
+
+        Args:
+            text: 応答テキストの続き（任意の位置で区切られていてよい）
+
+        Returns:
+            新たにパースできたオブジェクト（dict）のリスト
+        """
+        items: List[Dict[str, Any]] = []
+        for ch in text:
+            if self.finished:
+                break
+            if not self._started:
+                if not self._start_array(ch):
+                    continue
+                if ch != "{":
+                    continue
+
+            if self._depth > 0:
+                self._buffer.append(ch)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if self._depth == 0 and not (ch.isspace() or ch in ",{]"):
+                # 配列の直下のオブジェクト以外（"{" が欠けた要素など）は読み飛ばし、壊れた要素として数える
+                if not self._stray:
+                    self._stray = True
+                    self.errors += 1
+                    logger.warning("Skipped non-object content in streamed JSON array")
+            if ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                if self._depth == 0:
+                    self._buffer = [ch]
+                    self._stray = False
+                self._depth += 1
+            elif ch in "}]":
+                if self._depth == 0:
+                    if ch == "]":
+                        self.finished = True
+                    continue
+                self._depth -= 1
+                if self._depth == 0:
+                    item = self._parse("".join(self._buffer))
+                    self._buffer = []
+                    if item is not None:
+                        items.append(item)
+        return items
+
+    def _start_array(self, ch: str) -> bool:
+        """配列の開始前の1文字を読み、配列が始まったか（"{" の場合はその文字から配列の中として処理する）"""
+        if self._candidate:
+            if ch.isspace():
+                return False
+            self._candidate = False
+            if ch == "{":
+                self._started = True
+                return True
+            if ch == "]":
+                self._started = self.finished = True
+                return False
+        if ch == "[":
+            if self._preamble.rstrip().endswith("```json"):
+                self._started = True
+                return True
+            self._candidate = True
+        self._preamble = (self._preamble + ch)[-16:]
+        return False
+
+    def _parse(self, text: str):
+        """閉じたオブジェクトをパース（パースできない・オブジェクト以外の要素はNone）"""
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError as e:
+            self.errors += 1
+            logger.warning(f"Skipped malformed JSON item in stream: {e}")
+            return None
+        if not isinstance(value, dict):
+            return None
+        self.items_parsed += 1
+        return value
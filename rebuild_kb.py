@@ -2,15 +2,21 @@
 KB完全再構築スクリプト
 
 2つの見積書PDFから正しい工事区分でKBを構築します。
+見積書PDFが前回の構築から変わっていなければ（KBマニフェストで判定）、再抽出せずに前回の項目を使います。
 """
 
 import json
 from pathlib import Path
 from datetime import date
 from pipelines.estimate_from_reference import EstimateFromReference
+from pipelines.kb_manifest import KBManifest, file_sha256
 from pipelines.schemas import DisciplineType, PriceReference
 from loguru import logger
 
+# EstimateFromReference による抽出処理のバージョン（抽出・変換処理を変更したら上げる。2: チャンク分割抽出）
+REFERENCE_EXTRACTOR_VERSION = "2"
+
+
 def convert_estimate_items_to_kb(estimate_items, project_name: str):
     """EstimateItemをPriceReferenceに変換"""
     kb_items = []
@@ -67,17 +73,37 @@ def rebuild_kb():
         print(f"{'='*80}")
         print(f"ファイル: {gas_pdf} ({Path(gas_pdf).stat().st_size / 1024 / 1024:.1f}MB)")
 
-        # ガス設備として抽出
-        estimate_items = extractor.extract_estimate_from_pdf(
-            pdf_path=gas_pdf,
-            discipline=DisciplineType.GAS
-        )
-
-        print(f"\n抽出結果:")
-        print(f"  抽出項目数: {len(estimate_items)}項目")
-
-        # KB形式に変換
-        kb_items_gas = convert_estimate_items_to_kb(estimate_items, "都立山崎高校_都市ガス")
+        manifest = KBManifest.for_kb("kb/price_kb.json")
+        file_hash = file_sha256(gas_pdf)
+        entry = manifest.entry(gas_pdf)
+        previous_items = []
+        if entry and Path("kb/price_kb.json").exists():
+            with open("kb/price_kb.json", 'r', encoding='utf-8') as f:
+                previous_items = [item for item in json.load(f) if item.get("item_id") in set(entry["item_ids"])]
+
+        if previous_items and manifest.is_current(gas_pdf, file_hash, "reference", REFERENCE_EXTRACTOR_VERSION,
+                                                  None, extractor.model_name):
+            # 前回から変わっていないため再抽出しない
+            kb_items_gas = previous_items
+            print(f"\n変更なし: 前回の抽出結果を使用（{entry['extracted_at']}）")
+        else:
+            # ガス設備として抽出
+            estimate_items = extractor.extract_estimate_from_pdf(
+                pdf_path=gas_pdf,
+                discipline=DisciplineType.GAS
+            )
+
+            print(f"\n抽出結果:")
+            print(f"  抽出項目数: {len(estimate_items)}項目")
+
+            # KB形式に変換
+            kb_items_gas = convert_estimate_items_to_kb(estimate_items, "都立山崎高校_都市ガス")
+
+        # KBをこのPDFの項目だけで作り直すため、マニフェストもこのPDFの記録だけにする
+        manifest.entries.clear()
+        manifest.record(gas_pdf, file_hash, "reference", REFERENCE_EXTRACTOR_VERSION, None,
+                        extractor.model_name, [item["item_id"] for item in kb_items_gas],
+                        project_name="都立山崎高校_都市ガス")
         all_kb_items.extend(kb_items_gas)
 
         print(f"  KB登録数: {len(kb_items_gas)}項目（単価あり）")
@@ -103,6 +129,8 @@ def rebuild_kb():
     with open("kb/price_kb.json", 'w', encoding='utf-8') as f:
         json.dump(all_kb_items, f, ensure_ascii=False, indent=2)
 
+    manifest.save()
+
     print(f"\n  保存完了: kb/price_kb.json")
 
     # 3. KB内容を確認
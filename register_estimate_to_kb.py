@@ -13,7 +13,8 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent))
 
 from pipelines.kb_builder import PriceKBBuilder
-from pipelines.schemas import DisciplineType
+from pipelines.kb_manifest import KBManifest
+from pipelines.schemas import PriceReference
 from loguru import logger
 
 
@@ -31,16 +32,25 @@ def main():
     kb_builder = PriceKBBuilder(kb_path="kb/price_kb.json")
 
     # Extract price references from human estimate PDF
+    # (skipped when the KB manifest shows the same file was already extracted)
     logger.info("見積書から単価情報を抽出中...")
-    price_refs = kb_builder.extract_estimate_from_pdf(
-        str(estimate_pdf),
-        project_name="大洲バイオマス発電所_仮設事務所"
+    summary = kb_builder.update_kb_from_sources(
+        [str(estimate_pdf)],
+        project_names={str(estimate_pdf): "大洲バイオマス発電所_仮設事務所"},
+        retract_missing=False
     )
 
-    if not price_refs:
+    if summary["failed"]:
         logger.error("抽出された項目がありません")
         return
 
+    if summary["unchanged"]:
+        logger.info("見積書は登録済みで変更がないため、再抽出をスキップしました")
+        return
+
+    entry = KBManifest.for_kb(kb_builder.kb_path).entry(str(estimate_pdf))
+    item_ids = set(entry["item_ids"])
+    price_refs = [PriceReference(**item) for item in kb_builder.kb_items if item.get("item_id") in item_ids]
     logger.info(f"抽出された項目数: {len(price_refs)}")
 
     # Show extracted items by discipline
@@ -54,6 +64,7 @@ def main():
         logger.info(f"  {disc}: {count}項目")
 
     # Merge with existing KB
+    # (items from other estimates with the same description/specification/unit are replaced by the new ones)
     logger.info("既存KBとマージ中...")
     merged_refs = kb_builder.merge_with_existing_kb(
         price_refs,
@@ -61,10 +72,9 @@ def main():
     )
 
     # Save merged KB
-    output_path = "kb/price_kb.json"
-    kb_builder.save_kb_to_json(merged_refs, output_path)
+    kb_builder.save_kb_to_json(merged_refs, kb_builder.kb_path)
 
-    logger.info(f"KBを保存しました: {output_path}")
+    logger.info(f"KBを保存しました: {kb_builder.kb_path}")
     logger.info(f"総項目数: {len(merged_refs)}")
 
     # Show sample items
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Vision API用のページ画像化のベンチマーク
+
+使用方法:
+    python scripts/benchmark_vision_render.py [--api] [PDFファイル ...]
+
+処理内容:
+    1. test-files/ 内のPDF（または引数で指定したPDF）から、ページ分類で選んだ諸元表・図面ページと
+       先頭 PAGES_PER_FILE ページを対象に
+    2. 画像化の設定（固定解像度PNG / 内容に応じた解像度・切り出し / JPEG・WebP・グレースケール）ごとに
+       画像化時間・画像サイズ・画素数・入力トークン数の目安を表形式で出力
+    3. --api を指定した場合は、各画像をVision APIで文字起こしして
+       実際の入力トークン数・応答時間・読み取り精度を出力（ANTHROPIC_API_KEY が必要、API料金が発生します）
+
+読み取り精度は、PDFのテキストレイヤーの文字（空白を除きNFKCで正規化）のうち
+文字起こし結果に含まれた割合（文字の多重集合での再現率）です。
+テキストレイヤーのないページ（スキャン画像）は基準設定（REFERENCE_SETTING）の文字起こし結果を正解とします。
+"""
+
+import os
+import sys
+import time
+import unicodedata
+from collections import Counter
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from loguru import logger
+
+from pipelines.page_classifier import select_drawing_pages, select_spec_table_pages
+from pipelines.pdf_cache import HAS_PYMUPDF, open_pdf
+from pipelines.render_policy import RenderPolicy
+
+# 比較する画像化の設定
+SETTINGS = {
+    # 基準設定（REFERENCE_SETTING）は先頭に置く
+    "fixed-200-png": RenderPolicy.fixed(200),
+    "fixed-150-png": RenderPolicy.fixed(150),
+    "adaptive-png": RenderPolicy(image_format="png", grayscale=False),
+    "adaptive-jpeg": RenderPolicy(image_format="jpeg", grayscale=False),
+    "adaptive-webp": RenderPolicy(image_format="webp", grayscale=False),
+    "adaptive-gray-jpeg": RenderPolicy(image_format="jpeg", grayscale=True),
+}
+
+# テキストレイヤーのないページで正解とする設定
+REFERENCE_SETTING = "fixed-200-png"
+
+# PDFごとに対象とする先頭ページ数
+PAGES_PER_FILE = 2
+
+OCR_PROMPT = "この画像のテキストを全て読み取ってください。表形式のデータも含めて、できるだけ正確に文字起こししてください。装飾や書式は不要です。"
+MODEL_NAME = os.getenv("BENCHMARK_VISION_MODEL", "claude-sonnet-4-20250514")
+
+
+def target_pages(pdf) -> list:
+    """ベンチマーク対象のページ番号"""
+    features = pdf.all_page_features()
+    pages = set(range(1, min(pdf.page_count, PAGES_PER_FILE) + 1))
+    pages.update(select_spec_table_pages(features))
+    pages.update(select_drawing_pages(features))
+    return sorted(pages)
+
+
+def normalize(text: str) -> str:
+    """比較用に正規化（NFKC・空白除去）"""
+    return "".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+def char_recall(expected: str, actual: str) -> float:
+    """expected の文字のうち actual に含まれた割合（文字の多重集合）"""
+    expected_chars = Counter(normalize(expected))
+    if not expected_chars:
+        return 0.0
+    actual_chars = Counter(normalize(actual))
+    overlap = sum((expected_chars & actual_chars).values())
+    return overlap / sum(expected_chars.values())
+
+
+def transcribe(client, rendered) -> dict:
+    """Vision APIで文字起こし"""
+    start = time.perf_counter()
+    response = client.messages.create(
+        model=MODEL_NAME,
+        max_tokens=8000,
+        messages=[{
+            "role": "user",
+            "content": [rendered.to_content_block(), {"type": "text", "text": OCR_PROMPT}],
+        }],
+        operation="画像化ベンチマーク",
+        cost_metadata={"source": "benchmark_vision_render", "page": rendered.page_num},
+    )
+    elapsed = time.perf_counter() - start
+
+    return {
+        "text": response.content[0].text,
+        "input_tokens": response.usage.input_tokens,
+        "seconds": elapsed,
+    }
+
+
+def main():
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    args = sys.argv[1:]
+    use_api = "--api" in args
+    pdf_files = [Path(p) for p in args if p != "--api"] or sorted((project_root / "test-files").glob("*.pdf"))
+
+    if not HAS_PYMUPDF:
+        print("PyMuPDF is not installed")
+        return
+
+    client = None
+    if use_api:
+        from pipelines.llm_gateway import get_llm_gateway
+        client = get_llm_gateway()
+
+    totals = {name: Counter() for name in SETTINGS}
+
+    print("=" * 110)
+    print("Vision画像化ベンチマーク" + ("（API呼び出しあり）" if use_api else "（API呼び出しなし: --api で精度・実トークン数を計測）"))
+    print("=" * 110)
+    print(f"{'ファイル':<22} {'頁':>3} {'内容':<8} {'設定':<20} {'DPI':>4} {'画素':>11} {'KB':>6} "
+          f"{'画像化秒':>8} {'推定tok':>7} {'実tok':>6} {'API秒':>6} {'精度':>6}")
+    print("-" * 110)
+
+    for pdf_path in pdf_files:
+        pdf = open_pdf(str(pdf_path))
+        for page_num in target_pages(pdf):
+            expected = pdf.page_text(page_num)
+            for name, policy in SETTINGS.items():
+                start = time.perf_counter()
+                rendered = policy.render(pdf, page_num)
+                render_seconds = time.perf_counter() - start
+
+                result = {}
+                if client is not None:
+                    result = transcribe(client, rendered)
+                    if name == REFERENCE_SETTING and not normalize(expected):
+                        expected = result["text"]
+                    result["recall"] = char_recall(expected, result["text"]) if normalize(expected) else None
+
+                total = totals[name]
+                total["pages"] += 1
+                total["bytes"] += len(rendered.data)
+                total["estimated_tokens"] += rendered.estimated_tokens
+                total["render_ms"] += int(render_seconds * 1000)
+                if result:
+                    total["input_tokens"] += result["input_tokens"]
+                    total["api_ms"] += int(result["seconds"] * 1000)
+                    if result["recall"] is not None:
+                        total["recall_pages"] += 1
+                        total["recall_permille"] += int(result["recall"] * 1000)
+
+                size = f"{rendered.width}x{rendered.height}"
+                api_seconds = f"{result['seconds']:.1f}" if result else "-"
+                recall = f"{result['recall']:.3f}" if result.get("recall") is not None else "-"
+                print(f"{pdf_path.name[:20]:<22} {page_num:>3} {rendered.content_type:<8} {name:<20} "
+                      f"{rendered.dpi:>4.0f} {size:>11} {len(rendered.data) // 1024:>6} "
+                      f"{render_seconds:>8.3f} {rendered.estimated_tokens:>7} "
+                      f"{result.get('input_tokens', '-'):>6} {api_seconds:>6} {recall:>6}")
+        print("-" * 110)
+
+    print("合計")
+    print(f"{'設定':<20} {'頁':>4} {'KB':>8} {'画像化秒':>8} {'推定tok':>8} {'実tok':>8} {'API秒':>7} {'平均精度':>8}")
+    for name, total in totals.items():
+        api_seconds = f"{total['api_ms'] / 1000:.1f}" if total["api_ms"] else "-"
+        recall = (f"{total['recall_permille'] / total['recall_pages'] / 1000:.3f}"
+                  if total["recall_pages"] else "-")
+        print(f"{name:<20} {total['pages']:>4} {total['bytes'] // 1024:>8} {total['render_ms'] / 1000:>8.2f} "
+              f"{total['estimated_tokens']:>8} {total['input_tokens'] or '-':>8} {api_seconds:>7} {recall:>8}")
+
+
+if __name__ == "__main__":
+    main()
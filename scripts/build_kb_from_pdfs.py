@@ -3,18 +3,24 @@
 PDF見積書からKBを構築するバッチスクリプト
 
 使用方法:
-    python scripts/build_kb_from_pdfs.py
+    python scripts/build_kb_from_pdfs.py [--force] [--batch [--wait]]
 
 処理内容:
     1. data/フォルダ内の全PDF見積書を検索
-    2. OCRで項目・単価を抽出
-    3. 既存KBとマージ
-    4. kb/price_kb.jsonに保存
+    2. 新規・変更されたPDFだけOCRで項目・単価を抽出（KBマニフェストで判定、--force で全件）
+    3. 変更・削除されたPDFの古い項目を取り除いてKBを差分更新
+    4. 抽出した項目を統合（中央値）し、既存KBとマージ（同一項目は新しいデータで置き換え）
+    5. kb/price_kb.jsonとkb/price_kb_manifest.jsonに保存
+
+--batch を指定すると、抽出の呼び出しを Message Batches API でまとめて送ります（料金は半額）。
+    1回目: バッチを送信してバッチIDを cache/batches/kb_build.json に保存して終了
+    2回目以降: 処理状況を確認し、完了していれば結果を応答キャッシュに取り込んでからKBを更新
+    --wait を付けると、送信後（または確認時）に完了まで待ってそのままKBを更新します。
 """
 
+import os
 import sys
 from pathlib import Path
-import json
 from datetime import datetime
 
 # プロジェクトルートをパスに追加
@@ -22,6 +28,7 @@ project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
 from pipelines.kb_builder import PriceKBBuilder
+from pipelines.llm_batch import LLMBatchJob
 from loguru import logger
 
 
@@ -49,6 +56,39 @@ def extract_project_name(pdf_path: Path) -> str:
     return pdf_path.stem
 
 
+def run_batch(kb: PriceKBBuilder, pdf_files, force: bool, wait: bool) -> bool:
+    """
+    抽出の呼び出しを Message Batches API で実行（結果は応答キャッシュに取り込む）
+
+    Returns:
+        KBの更新に進めるか（バッチの結果を取り込んだ、または送る呼び出しがない）
+    """
+    job = LLMBatchJob.named("kb_build")
+
+    if not job.pending:
+        requests = kb.batch_requests_for_sources([str(p) for p in pdf_files], force=force)
+        job.clear()
+        if job.submit(requests) is None:
+            print("\nバッチ: 送信する呼び出しはありません（抽出済み、または応答キャッシュにあり）")
+            return True
+        print(f"\nバッチ送信: {job.batch_id}（{len(job.state['requests'])}件）")
+
+    status = job.wait() if wait else job.poll()
+    counts = job.state.get("request_counts", {})
+    print(f"バッチ {job.batch_id}: {status} "
+          f"（処理中 {counts.get('processing', 0)}, 成功 {counts.get('succeeded', 0)}, "
+          f"エラー {counts.get('errored', 0)}, 期限切れ {counts.get('expired', 0)}）")
+    if status != "ended":
+        print("完了後にもう一度 --batch を付けて実行してください")
+        return False
+
+    results = job.ingest()
+    print(f"バッチ結果を取り込み: {results}")
+    if results.get("succeeded", 0) < sum(results.values()):
+        print("  失敗した呼び出しはKB更新時に同期呼び出しで再実行します")
+    return True
+
+
 def main():
     print("=" * 60)
     print("PDF見積書からKB構築")
@@ -62,60 +102,18 @@ def main():
         print("PDF見積書が見つかりませんでした")
         return
 
-    # KB Builderを初期化
-    kb = PriceKBBuilder()
-
-    # 既存KBを読み込み
+    force = "--force" in sys.argv
     kb_path = project_root / "kb" / "price_kb.json"
-    existing_refs = kb.load_kb_from_json(str(kb_path))
-    print(f"既存KB項目数: {len(existing_refs)}")
-
-    # 各PDFから抽出
-    all_extracted = []
-    success_count = 0
-    error_count = 0
-
-    for i, pdf_path in enumerate(pdf_files, 1):
-        project_name = extract_project_name(pdf_path)
-        print(f"\n[{i}/{len(pdf_files)}] {project_name}")
-        print(f"  ファイル: {pdf_path.name}")
-
-        try:
-            refs = kb.extract_estimate_from_pdf(
-                str(pdf_path),
-                project_name=project_name
-            )
-            print(f"  抽出項目数: {len(refs)}")
-            all_extracted.extend(refs)
-            success_count += 1
-        except Exception as e:
-            print(f"  エラー: {e}")
-            error_count += 1
-            continue
 
-    print(f"\n抽出完了: {success_count}件成功, {error_count}件エラー")
-    print(f"抽出項目総数: {len(all_extracted)}")
+    # KB Builderを初期化（応答キャッシュ・バッチのジョブファイルなどの相対パスをプロジェクトルート基準にする）
+    os.chdir(project_root)
+    kb = PriceKBBuilder(str(kb_path))
+    print(f"既存KB項目数: {len(kb.kb_items)}")
 
-    if not all_extracted:
-        print("抽出された項目がありません")
+    # バッチモード: 結果を応答キャッシュに取り込んでから、通常の差分更新（APIを呼ばない）に進む
+    if "--batch" in sys.argv and not run_batch(kb, pdf_files, force, wait="--wait" in sys.argv):
         return
 
-    # 複数見積を統合（中央値）
-    print("\n複数見積を統合中（中央値）...")
-    aggregated = kb.aggregate_multiple_estimates(
-        all_extracted,
-        method="median"
-    )
-    print(f"統合後項目数: {len(aggregated)}")
-
-    # 既存KBとマージ
-    print("\n既存KBとマージ中...")
-    merged = kb.merge_with_existing_kb(
-        aggregated,
-        merge_strategy="keep_new"
-    )
-    print(f"マージ後項目数: {len(merged)}")
-
     # バックアップを作成
     backup_path = kb_path.with_suffix(f".backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
     if kb_path.exists():
@@ -125,9 +123,27 @@ def main():
             f.write(backup_data)
         print(f"\nバックアップ作成: {backup_path.name}")
 
-    # 保存
-    kb.save_kb_to_json(merged, str(kb_path))
-    print(f"KB保存完了: {kb_path}")
+    # 新規・変更されたPDFだけ抽出して差分更新（削除されたPDFの項目は取り除く）
+    summary = kb.update_kb_from_sources(
+        [str(p) for p in pdf_files],
+        project_names={str(p): extract_project_name(p) for p in pdf_files},
+        force=force
+    )
+
+    print(f"\n抽出: {len(summary['extracted'])}件, 変更なし（抽出済み）: {len(summary['unchanged'])}件, "
+          f"エラー: {len(summary['failed'])}件, 削除されたファイル: {len(summary['retracted'])}件")
+    for path in summary["failed"]:
+        print(f"  エラー（次回再抽出）: {Path(path).name}")
+    print(f"追加項目数: {summary['added_items']}, 削除項目数: {summary['removed_items']}")
+
+    # 複数見積を統合（中央値）して既存KBとマージ
+    total_items = summary['total_items']
+    if summary["extracted"]:
+        print("\n複数見積を統合（中央値）して既存KBとマージ中...")
+        total_items = kb.consolidate_sources(summary["extracted"], method="median", merge_strategy="keep_new")
+    print(f"KB保存完了: {kb_path} ({total_items}項目)")
+
+    merged = kb.kb_items
 
     # 統計を表示
     print("\n" + "=" * 60)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+過去案件フォルダの一括取り込み
+
+使用方法:
+    python scripts/bulk_ingest.py [ディレクトリ] [--output kb/bulk_ingest] [--workers N]
+                                  [--batch-size N] [--limit N] [--llm] [--merge]
+
+処理内容:
+    1. ディレクトリ（既定: data/）をzipアーカイブの中も含めて走査
+    2. ファイルの種類ごとに抽出処理をワーカープロセスで並列実行
+       （見積明細Excel → 価格KBの行、仕様書・質疑書・メールなど → 文書テキスト）
+    3. 価格KBの行・文書テキストをバッチファイルに書き出し、処理済みファイルをチェックポイントに記録
+       （中断後に同じコマンドを再実行すると未処理のファイルから再開）
+    4. --merge を指定した場合は、出力した行を kb/price_kb.json にマージ
+
+--llm を指定すると、見積書フォルダのPDF・画像もLLM（テキスト / OCR）で価格KB化します
+（ANTHROPIC_API_KEY が必要、API料金が発生します）。
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+# プロジェクトルートをパスに追加
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from loguru import logger
+
+from pipelines.bulk_ingest import (
+    DEFAULT_BATCH_SIZE, DEFAULT_OUTPUT_DIR, DEFAULT_WORKERS, BulkIngestor, merge_rows_into_kb
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="過去案件フォルダの一括取り込み")
+    parser.add_argument("root", nargs="?", default=str(project_root / "data"), help="走査するディレクトリ")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_DIR, help="出力ディレクトリ")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="ワーカープロセス数")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="バッチファイルあたりの行数")
+    parser.add_argument("--limit", type=int, default=None, help="処理するファイル数の上限")
+    parser.add_argument("--llm", action="store_true", help="見積書PDF・画像をLLMで価格KB化する")
+    parser.add_argument("--merge", action="store_true", help="出力した行を価格KBにマージする")
+    parser.add_argument("--kb", default="kb/price_kb.json", help="価格KBのパス")
+    args = parser.parse_args()
+
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    print("=" * 60)
+    print(f"一括取り込み: {args.root}")
+    print("=" * 60)
+
+    ingestor = BulkIngestor(
+        args.root, output_dir=args.output, workers=args.workers,
+        batch_size=args.batch_size, use_llm=args.llm, kb_path=args.kb,
+    )
+    summary = ingestor.run(limit=args.limit)
+
+    print(f"\n処理済みのためスキップ: {summary['already_done']}件")
+    print("取り込み方法別:")
+    for route, count in sorted(summary["route"].items()):
+        print(f"  {route}: {count}件")
+    print("状態別:")
+    for status, count in sorted(summary["status"].items()):
+        print(f"  {status}: {count}件")
+    print(f"価格KBの行: {summary['rows']}行")
+    print(f"文書: {summary['documents']}件")
+
+    if summary["errors"]:
+        print("\nエラー（再実行時に再試行します）:")
+        for source_id, error in summary["errors"]:
+            print(f"  {source_id}: {error}")
+
+    print(f"\n出力先: {ingestor.output_dir}")
+
+    if args.merge:
+        total = merge_rows_into_kb(args.output, kb_path=args.kb)
+        print(f"価格KBにマージ: {total}項目 ({args.kb})")
+
+
+if __name__ == "__main__":
+    main()
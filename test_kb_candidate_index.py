@@ -0,0 +1,79 @@
+"""
+KB転置インデックスの等価性テスト
+
+転置インデックスで候補を絞り込んだ文字列マッチングが、
+現在のKBに対して全件走査と同じマッチ結果になることを確認します。
+（APIは使用しません）
+"""
+
+import os
+import sys
+sys.path.insert(0, '.')
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "dummy")
+
+from pipelines.estimate_generator_ai import AIEstimateGenerator, SYNONYM_DICT
+from pipelines.kb_features import KBFeatureTable
+from pipelines.schemas import EstimateItem, DisciplineType
+
+
+def _build_items(price_kb):
+    """KB項目名・仕様・単位をもとに見積項目を作成（表記ゆれ・短い名称を含む）"""
+    disciplines = list(DisciplineType)
+    units = ["m", "式", "個", "箇所", "台", None]
+    suffixes = ["", "工事", "撤去", "取付費", " 配管"]
+    items = []
+    for i, kb_item in enumerate(price_kb):
+        name = kb_item.get("description") or ""
+        spec = kb_item.get("features", {}).get("specification", "")
+        if i % 3 == 1 and len(name) > 2:
+            name = name[:len(name) // 2]
+        name += suffixes[i % len(suffixes)]
+        if i % 4 == 2:
+            spec = ["", "15A", "20A", "VE22", "x"][i % 5]
+        unit = kb_item.get("unit") if i % 2 == 0 else units[i % len(units)]
+        items.append(EstimateItem(
+            item_no=str(i), name=name, specification=spec, unit=unit,
+            quantity=1, level=1 + i % 3, discipline=disciplines[i % len(disciplines)],
+        ))
+
+    # 類義語・短い名称・空の名称
+    for j, name in enumerate(list(SYNONYM_DICT.keys()) + ["A", "穴", "白ガス管", "", "ab c"]):
+        items.append(EstimateItem(
+            item_no=f"x{j}", name=name, specification=["", "15A", "1"][j % 3], unit=units[j % len(units)],
+            quantity=1, level=1, discipline=disciplines[j % len(disciplines)],
+        ))
+    return items
+
+
+def _match_results(items):
+    return [(item.unit_price, item.confidence, item.price_references, item.source_reference) for item in items]
+
+
+def test_candidate_index_matches_full_scan():
+    """転置インデックスによる候補絞り込みと全件走査の結果が一致すること"""
+    indexed = AIEstimateGenerator(use_vector_search=False, use_cache=False)
+    full_scan = AIEstimateGenerator(use_vector_search=False, use_cache=False)
+    # 候補を絞り込まない（常に全件走査）。KBレジストリの共有テーブルではなく専用のテーブルを変更する
+    full_scan._kb_features = KBFeatureTable(full_scan.price_kb, SYNONYM_DICT)
+    full_scan._kb_features.candidate_rows = lambda *args, **kwargs: None
+    assert full_scan._get_kb_features() is not indexed._get_kb_features()
+
+    items = _build_items(indexed.price_kb)
+
+    for method in ["enrich_with_prices", "enrich_with_prices_unified"]:
+        expected = _match_results(getattr(full_scan, method)([item.model_copy(deep=True) for item in items]))
+        actual = _match_results(getattr(indexed, method)([item.model_copy(deep=True) for item in items]))
+        mismatches = [i for i, (e, a) in enumerate(zip(expected, actual)) if e != a]
+        matched = sum(1 for r in actual if r[0] is not None)
+        print(f"{method}: {len(items)} items, matched={matched}, mismatches={len(mismatches)}")
+        assert not mismatches, f"{method}: {len(mismatches)} items differ (first: {items[mismatches[0]].name})"
+
+
+if __name__ == "__main__":
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    test_candidate_index_matches_full_scan()
+    print("✅ 転置インデックスの結果は全件走査と一致")
@@ -0,0 +1,78 @@
+"""
+KBマニフェストによる差分更新のテスト
+
+同じ案件名の見積書が2つある場合に、一方の再抽出・削除がもう一方の項目を取り除かないことを確認します。
+（抽出処理は固定の結果を返すものに置き換え、APIは使用しません）
+"""
+
+import os
+import sys
+import tempfile
+from datetime import date
+from pathlib import Path
+sys.path.insert(0, '.')
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "dummy")
+
+from pipelines.kb_builder import PriceKBBuilder
+from pipelines.schemas import PriceReference
+
+PROJECT = "大洲バイオマス発電所"
+
+
+def _refs(descriptions, price):
+    """抽出結果（item_id は extract_estimate_from_pdf と同じ「案件名_連番」）"""
+    return [
+        PriceReference(item_id=f"{PROJECT}_{i + 1:03d}", description=description, discipline="電気設備工事",
+                       unit="式", unit_price=price, valid_from=date.today(), source_project=PROJECT,
+                       features={"specification": ""})
+        for i, description in enumerate(descriptions)
+    ]
+
+
+def test_sources_sharing_project_name():
+    """同じ案件名の2ファイルの項目が、再抽出・削除で互いに消えないこと"""
+    workdir = Path(tempfile.mkdtemp())
+    kb_path = str(workdir / "price_kb.json")
+    source_a, source_b = str(workdir / "a.pdf"), str(workdir / "b.pdf")
+    Path(source_a).write_bytes(b"a1")
+    Path(source_b).write_bytes(b"b1")
+
+    results = {source_a: _refs(["幹線", "分電盤"], 1000), source_b: _refs(["照明器具"], 2000)}
+    builder = PriceKBBuilder(kb_path=kb_path)
+    builder.extract_estimate_from_pdf = lambda path, project_name=None: results[path]
+    project_names = {source_a: PROJECT, source_b: PROJECT}
+
+    def descriptions():
+        return sorted(item["description"] for item in builder.kb_items)
+
+    summary = builder.update_kb_from_sources([source_a, source_b], project_names=project_names)
+    assert len(summary["extracted"]) == 2
+    assert descriptions() == ["分電盤", "幹線", "照明器具"]
+    assert len({item["item_id"] for item in builder.kb_items}) == 3
+
+    # 変更がなければ再抽出しない
+    summary = builder.update_kb_from_sources([source_a, source_b], project_names=project_names)
+    assert len(summary["unchanged"]) == 2
+
+    # aを変更して再抽出しても、bの項目（同じ「案件名_001」）は残ること
+    Path(source_a).write_bytes(b"a2")
+    results[source_a] = _refs(["幹線（改）"], 1500)
+    summary = builder.update_kb_from_sources([source_a, source_b], project_names=project_names)
+    assert summary["extracted"] == [source_a] and summary["removed_items"] == 2
+    assert descriptions() == ["幹線（改）", "照明器具"]
+
+    # bを削除すると、bの項目だけが取り除かれること
+    Path(source_b).unlink()
+    summary = builder.update_kb_from_sources([source_a], project_names=project_names)
+    assert len(summary["retracted"]) == 1
+    assert descriptions() == ["幹線（改）"]
+
+
+if __name__ == "__main__":
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    test_sources_sharing_project_name()
+    print("✅ 同じ案件名の見積書の項目は、互いの再抽出・削除で消えない")
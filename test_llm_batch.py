@@ -0,0 +1,181 @@
+"""
+Message Batches API による一括実行のテスト
+
+ローカルのスタブサーバー（Message Batches API の送信・状況確認・結果取得を模したもの）に対して
+バッチを送信・確認・取り込みし、取り込んだ結果で通常のチャンク抽出がAPIを呼ばずに完了することを確認します。
+（実際のAPIは使用しません）
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+sys.path.insert(0, '.')
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "dummy")
+
+from anthropic import Anthropic
+
+from pipelines import cost_tracker
+from pipelines.chunked_extraction import chunk_request_params, chunk_text, extract_items_chunked
+from pipelines.llm_batch import LLMBatchJob, batch_request
+from pipelines.llm_gateway import LLMGateway
+from pipelines.llm_response_cache import LLMResponseCache
+
+MODEL = "claude-sonnet-4-20250514"
+TEXT = "".join(f"[PAGE {page}/3]\n" + "".join(f"項目{page}-{i} 1 式 {page * 1000 + i}\n" for i in range(5))
+               for page in (1, 2, 3))
+
+
+def build_prompt(text):
+    return f"次の見積書テキストから項目をJSON配列で抽出してください。\n{text}"
+
+
+class StubBatchServer(BaseHTTPRequestHandler):
+    """Message Batches API のスタブ（1回目の状況確認は処理中、2回目以降は完了）"""
+
+    batches = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body, content_type="application/json"):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _batch(self, batch_id):
+        batch = self.batches[batch_id]
+        ended = batch["polls"] > 1
+        count = len(batch["requests"])
+        return {
+            "id": batch_id, "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            "request_counts": {"processing": 0 if ended else count, "succeeded": count - 1 if ended else 0,
+                               "errored": 1 if ended else 0, "canceled": 0, "expired": 0},
+            "created_at": "2025-01-01T00:00:00Z", "expires_at": "2025-01-02T00:00:00Z",
+            "ended_at": "2025-01-01T01:00:00Z" if ended else None,
+            "archived_at": None, "cancel_initiated_at": None,
+            "results_url": f"http://127.0.0.1:{self.server.server_port}/v1/messages/batches/{batch_id}/results"
+            if ended else None,
+        }
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        batch_id = f"msgbatch_{len(self.batches) + 1:03d}"
+        self.batches[batch_id] = {"requests": body["requests"], "polls": 0}
+        self._send_json(self._batch(batch_id))
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        batch_id = parts[3]
+        if parts[-1] == "results":
+            lines = []
+            for index, request in enumerate(self.batches[batch_id]["requests"]):
+                if index == 0:
+                    result = {"type": "errored", "error": {"type": "error",
+                                                           "error": {"type": "api_error", "message": "stub"}}}
+                else:
+                    prompt = request["params"]["messages"][0]["content"]
+                    names = [line.split()[0] for line in prompt.splitlines() if line.startswith("項目")]
+                    items = [{"name": name, "quantity": 1, "unit": "式"} for name in names]
+                    text = json.dumps(items, ensure_ascii=False)
+                    # 2件目は出力が max_tokens で切れた結果（最後の項目の途中まで）
+                    truncated = index == 1
+                    if truncated:
+                        text = text[:text.rfind("{") + 5]
+                    result = {"type": "succeeded", "message": {
+                        "id": f"msg_{index}", "type": "message", "role": "assistant", "model": MODEL,
+                        "content": [{"type": "text", "text": text}],
+                        "stop_reason": "max_tokens" if truncated else "end_turn", "stop_sequence": None,
+                        "usage": {"input_tokens": 100, "output_tokens": 50},
+                    }}
+                lines.append(json.dumps({"custom_id": request["custom_id"], "result": result}, ensure_ascii=False))
+            self._send_json("\n".join(lines) + "\n", content_type="application/binary")
+        else:
+            self.batches[batch_id]["polls"] += 1
+            self._send_json(self._batch(batch_id))
+
+
+class _NoAPIClient:
+    """同期呼び出しの回数を数えるクライアント（バッチで失敗したチャンクだけが呼ばれる）"""
+
+    def __init__(self):
+        self.calls = 0
+        self.messages = self
+
+    def create(self, **params):
+        self.calls += 1
+        raise RuntimeError("synchronous call")
+
+
+def test_batch_submit_poll_ingest():
+    """送信・状況確認・取り込みの後、成功したチャンクは応答キャッシュから抽出されること"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubBatchServer)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    workdir = tempfile.mkdtemp()
+    # コストは一時ファイルに記録する（実際のコストログ logs/api_costs.json に書かない）
+    original_tracker = cost_tracker._tracker_instance
+    tracker = cost_tracker.CostTracker(log_path=os.path.join(workdir, "api_costs.json"))
+    cost_tracker._tracker_instance = tracker
+    try:
+        client = Anthropic(api_key="dummy", base_url=f"http://127.0.0.1:{server.server_port}", max_retries=0)
+        cache = LLMResponseCache(path=os.path.join(workdir, "responses.sqlite3"))
+        gateway = LLMGateway(api_key="dummy", max_retries=0, response_cache=cache)
+        job_path = os.path.join(workdir, "kb_build.json")
+
+        chunks = chunk_text(TEXT, max_chars=60, overlap_lines=0)
+        requests = [batch_request(chunk_request_params(MODEL, chunk, build_prompt), operation="test")
+                    for chunk in chunks]
+        job = LLMBatchJob(job_path, client=client, gateway=gateway)
+        batch_id = job.submit(requests + requests[:1])
+        assert batch_id and len(job.state["requests"]) == len(chunks)
+
+        # ジョブファイルから続きを確認できること
+        job = LLMBatchJob(job_path, client=client, gateway=gateway)
+        assert job.pending and job.poll() == "in_progress"
+        assert job.wait(poll_interval=0) == "ended"
+        counts = job.ingest()
+        assert counts["succeeded"] == len(chunks) - 1 and counts["errored"] == 1
+        assert not job.pending
+        assert len(tracker.records) == len(chunks) - 1 and all(record["batch"] for record in tracker.records)
+
+        # 成功したチャンク（max_tokens で切れたものを含む）はキャッシュにあり、
+        # 失敗したチャンクだけが同期呼び出しになること
+        cached = [cache.contains(request["params"]) for request in requests]
+        assert not cached[0] and all(cached[1:])
+
+        sync_client = _NoAPIClient()
+        gateway._client = sync_client
+        try:
+            extract_items_chunked(gateway, MODEL, TEXT, build_prompt, operation="test",
+                                  max_chars=60, max_workers=1)
+        except RuntimeError:
+            pass
+        assert sync_client.calls == 1
+
+        # 切れた結果は、完結している項目までを読み取れること
+        chunk_items = extract_items_chunked(gateway, MODEL, chunks[1].text, build_prompt, operation="test",
+                                            max_chars=60, max_workers=1)
+        assert chunk_items and sync_client.calls == 1
+
+        # 取り込み済みのジョブは再送信でき、キャッシュ済みのリクエストは送らないこと
+        assert job.submit(requests[1:]) is None
+        print(f"batch {batch_id}: {counts}")
+    finally:
+        cost_tracker._tracker_instance = original_tracker
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    test_batch_submit_poll_ingest()
+    print("✅ バッチの送信・確認・取り込みと、取り込んだ結果による抽出を確認")
@@ -0,0 +1,164 @@
+"""
+ストリーミング応答の逐次パースのテスト
+
+LLMの応答を任意の位置で区切って渡しても、JSON配列の要素が閉じた時点で
+応答全体をパースした場合と同じ項目が得られることを確認します。
+（APIは使用しません）
+"""
+
+import json
+import os
+import sys
+sys.path.insert(0, '.')
+
+os.environ.setdefault("ANTHROPIC_API_KEY", "dummy")
+
+from pipelines import estimate_generator_ai
+from pipelines.streaming_json import JSONArrayStreamParser
+from pipelines.estimate_generator_ai import AIEstimateGenerator
+from pipelines.schemas import EstimateItem, DisciplineType
+
+ITEMS = [
+    {"item_no": "1", "name": "白ガス管", "specification": "15A {ねじ接合}", "quantity": 12.5, "unit": "m"},
+    {"item_no": "2", "name": "ガス栓 \"ヒューズ付\"", "specification": "[壁付] \\ 1口", "quantity": 3, "unit": "個"},
+    {"item_no": "3", "name": "配管支持金物", "specification": "", "quantity": None, "unit": "式",
+     "details": {"parts": [1, 2, {"x": "}"}]}},
+]
+
+RESPONSE = (
+    "仕様書の内容から、以下の項目を生成しました。\n```json\n"
+    + json.dumps(ITEMS, ensure_ascii=False, indent=2)
+    + "\n```\n以上です。[注記] {補足}"
+)
+
+
+def _feed_in_chunks(text, size):
+    parser = JSONArrayStreamParser()
+    items = []
+    for i in range(0, len(text), size):
+        items.extend(parser.feed(text[i:i + size]))
+    return parser, items
+
+
+def test_parser_matches_full_parse():
+    """どの位置で区切っても、応答全体のパースと同じ項目が得られること"""
+    for size in [1, 2, 3, 7, 64, len(RESPONSE)]:
+        parser, items = _feed_in_chunks(RESPONSE, size)
+        assert items == ITEMS, f"chunk size {size}: {items}"
+        assert parser.finished and parser.errors == 0
+
+
+def test_parser_yields_items_before_array_closes():
+    """配列が閉じる前に、閉じたオブジェクトから順に返すこと"""
+    parser = JSONArrayStreamParser()
+    first_item_end = RESPONSE.index("},") + 1
+    assert parser.feed(RESPONSE[:first_item_end - 1]) == []
+    assert parser.feed(RESPONSE[first_item_end - 1:first_item_end]) == [ITEMS[0]]
+    assert not parser.finished
+
+
+def test_parser_ignores_brackets_before_array():
+    """説明文中の「[注記]」などの括弧は読み飛ばし、コードブロック・オブジェクトの配列から開始すること"""
+    preamble = "【ガス設備】[注記] 仕様書の記載[p.3]に基づき、以下の項目を生成しました。\n"
+    for response in [preamble + RESPONSE, preamble + json.dumps(ITEMS, ensure_ascii=False)]:
+        for size in [1, 5, len(response)]:
+            parser, items = _feed_in_chunks(response, size)
+            assert items == ITEMS, f"chunk size {size}: {items}"
+
+    parser, items = _feed_in_chunks("[注記] 該当する項目はありません。\n```json\n[]\n```", 3)
+    assert items == [] and parser.finished
+
+
+def test_parser_skips_malformed_items():
+    """壊れた要素・オブジェクト以外の要素は読み飛ばして数え、続く要素はパースすること"""
+    parser = JSONArrayStreamParser()
+    items = parser.feed('[{"name": "A"}, {"name": "B",}, 1, {"name": "C"}]')
+    assert items == [{"name": "A"}, {"name": "C"}]
+    assert parser.errors == 2
+
+
+class _StubGateway:
+    """stream_text で応答を1文字ずつ返すゲートウェイ"""
+
+    def __init__(self, text):
+        self.text = text
+
+    def stream_text(self, operation=None, cost_metadata=None, **params):
+        yield from self.text
+
+
+def _to_gas_item(item_data):
+    return EstimateItem(item_no=item_data.get("item_no", ""), name=item_data["name"],
+                        quantity=item_data.get("quantity"), unit=item_data.get("unit"),
+                        discipline=DisciplineType.GAS)
+
+
+def test_stream_estimate_items_repairs_malformed_items():
+    """壊れた要素があった場合は、応答全体を修復してパースした結果（項目が多ければ）を返すこと"""
+    generator = AIEstimateGenerator(use_vector_search=False, use_cache=False)
+    # 先頭の要素の "{" が欠けた応答（逐次パースではCだけ、extract_json_array_robust はA・Bを修復できる）
+    generator.client = _StubGateway(
+        '```json\n[\n  "name": "A",\n  "confidence": 0.8\n  "name": "B",\n  "confidence": 0.7\n  },\n'
+        '  {"name": "C", "confidence": 0.9}\n]\n```'
+    )
+    received, withdrawn = [], []
+    generator.on_item_generated = received.append
+    generator.on_items_reset = withdrawn.extend
+    items, _ = generator._stream_estimate_items(
+        [{"role": "user", "content": "test"}], _to_gas_item, operation="test", cost_metadata={}
+    )
+    assert [item.name for item in items] == ["A", "B"]
+    # 壊れた要素の後のCは渡さず、読み直した結果だけを渡すこと
+    assert received == items and withdrawn == []
+
+
+def test_stream_estimate_items_resets_replaced_items():
+    """渡した項目が読み直した結果と異なる場合は、on_items_reset で取り消してから渡し直すこと"""
+    generator = AIEstimateGenerator(use_vector_search=False, use_cache=False)
+    generator.client = _StubGateway('[{"name": "A"}, {"name": "B",}, {"name": "C"}]')
+    received, withdrawn = [], []
+    generator.on_item_generated = received.append
+    generator.on_items_reset = withdrawn.extend
+
+    # 読み直しで先頭の項目が変わった場合（修復結果を固定）
+    original = estimate_generator_ai.extract_json_array_robust
+    estimate_generator_ai.extract_json_array_robust = lambda text: [{"name": "A2"}, {"name": "B"}, {"name": "C"}]
+    try:
+        items, _ = generator._stream_estimate_items(
+            [{"role": "user", "content": "test"}], _to_gas_item, operation="test", cost_metadata={}
+        )
+    finally:
+        estimate_generator_ai.extract_json_array_robust = original
+    assert [item.name for item in items] == ["A2", "B", "C"]
+    assert [item.name for item in withdrawn] == ["A"]
+    assert [item.name for item in received] == ["A", "A2", "B", "C"]
+
+
+def test_stream_estimate_items_calls_back_per_item():
+    """項目ごとに on_item_generated が呼ばれ、応答全体のテキストが返ること"""
+    generator = AIEstimateGenerator(use_vector_search=False, use_cache=False)
+    generator.client = _StubGateway(RESPONSE)
+    received = []
+    generator.on_item_generated = received.append
+
+    items, response_text = generator._stream_estimate_items(
+        [{"role": "user", "content": "test"}], _to_gas_item, operation="test", cost_metadata={}
+    )
+    assert response_text == RESPONSE
+    assert [item.name for item in items] == [item["name"] for item in ITEMS]
+    assert received == items
+
+
+if __name__ == "__main__":
+    from loguru import logger
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    test_parser_matches_full_parse()
+    test_parser_yields_items_before_array_closes()
+    test_parser_ignores_brackets_before_array()
+    test_parser_skips_malformed_items()
+    test_stream_estimate_items_repairs_malformed_items()
+    test_stream_estimate_items_resets_replaced_items()
+    test_stream_estimate_items_calls_back_per_item()
+    print("✅ ストリーミング応答の逐次パースは応答全体のパースと一致")